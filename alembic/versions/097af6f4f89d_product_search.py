@@ -0,0 +1,78 @@
+"""product search
+
+Revision ID: 097af6f4f89d
+Revises: b6fb0b79aff1
+Create Date: 2026-10-18 09:12:40.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '097af6f4f89d'
+down_revision: Union[str, Sequence[str], None] = 'b6fb0b79aff1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# copia delle istruzioni di app/search.py al momento di questa revisione: la migrazione non deve
+# cambiare se cambia il codice dell'applicazione
+SQLITE_SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, content='products', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, name) VALUES (new.id, new.name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO products_fts(rowid, name) VALUES (new.id, new.name);
+    END""",
+    "INSERT INTO products_fts(products_fts) VALUES ('rebuild')",
+]
+
+SQLITE_DROP_SEARCH_DDL = [
+    "DROP TRIGGER IF EXISTS products_fts_au",
+    "DROP TRIGGER IF EXISTS products_fts_ad",
+    "DROP TRIGGER IF EXISTS products_fts_ai",
+    "DROP TABLE IF EXISTS products_fts",
+]
+
+POSTGRES_SEARCH_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    """CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+        AS $$ SELECT public.unaccent('public.unaccent', $1) $$""",
+    """CREATE INDEX IF NOT EXISTS ix_products_name_trgm ON products
+        USING gin (f_unaccent(lower(name)) gin_trgm_ops)""",
+    """CREATE INDEX IF NOT EXISTS ix_products_name_tsv ON products
+        USING gin (to_tsvector('italian', f_unaccent(name)))""",
+]
+
+POSTGRES_DROP_SEARCH_DDL = [
+    "DROP INDEX IF EXISTS ix_products_name_tsv",
+    "DROP INDEX IF EXISTS ix_products_name_trgm",
+    "DROP FUNCTION IF EXISTS f_unaccent(text)",
+]
+
+
+def _execute(statements: dict) -> None:
+    bind = op.get_bind()
+    for statement in statements.get(bind.dialect.name, []):
+        op.execute(statement)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    _execute({'sqlite': SQLITE_SEARCH_DDL, 'postgresql': POSTGRES_SEARCH_DDL})
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    _execute({'sqlite': SQLITE_DROP_SEARCH_DDL, 'postgresql': POSTGRES_DROP_SEARCH_DDL})
@@ -0,0 +1,56 @@
+"""catalog delta sync
+
+Revision ID: 5c1f0e2a9b7d
+Revises: dba24354daca
+Create Date: 2026-10-18 11:02:17.481930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c1f0e2a9b7d'
+down_revision: Union[str, Sequence[str], None] = 'dba24354daca'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# trigger FTS5 come creati dalla revisione 097af6f4f89d
+SQLITE_SEARCH_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, name) VALUES (new.id, new.name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO products_fts(rowid, name) VALUES (new.id, new.name);
+    END""",
+    "INSERT INTO products_fts(products_fts) VALUES ('rebuild')",
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table in ('products', 'supermarkets'):
+        op.add_column(table, sa.Column('version', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+        op.add_column(table, sa.Column('deleted_at', sa.DateTime(), nullable=True))
+        op.create_index(op.f(f'ix_{table}_version'), table, ['version'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in ('supermarkets', 'products'):
+        op.drop_index(op.f(f'ix_{table}_version'), table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('deleted_at')
+            batch_op.drop_column('updated_at')
+            batch_op.drop_column('version')
+    # su SQLite batch_alter_table ricrea la tabella products e perde i trigger della ricerca
+    if op.get_bind().dialect.name == 'sqlite':
+        for statement in SQLITE_SEARCH_TRIGGERS:
+            op.execute(statement)
@@ -0,0 +1,69 @@
+"""shopping stats
+
+Revision ID: 8a3d6b1e4f20
+Revises: 5c1f0e2a9b7d
+Create Date: 2026-10-18 11:48:36.207415
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8a3d6b1e4f20'
+down_revision: Union[str, Sequence[str], None] = '5c1f0e2a9b7d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# aggregazione di app/shopping_stats.py al momento di questa revisione, una SELECT per dimensione
+STATS_TOTALS = """sum(i.price_paid * coalesce(i.quantity, 0)), sum(coalesce(i.quantity, 0)),
+    sum({greatest}(coalesce(i.original_price, i.price_paid) - i.price_paid, 0) * coalesce(i.quantity, 0)),
+    count(DISTINCT h.id)"""
+
+STATS_DIMENSIONS = [
+    ('month', 'substr(CAST(h.created_at AS VARCHAR), 1, 7)', 'CAST(NULL AS VARCHAR)'),
+    ('category', "coalesce(i.category, '')", 'CAST(NULL AS VARCHAR)'),
+    ('supermarket', "coalesce(CAST(i.supermarket_id AS VARCHAR), '')", 'max(i.supermarket_name)'),
+]
+
+
+def _rebuild_stats_statement(dialect_name: str) -> str:
+    totals = STATS_TOTALS.format(greatest='greatest' if dialect_name == 'postgresql' else 'max')
+    selects = [f"""SELECT h.user_id, '{dimension}', {key}, {label}, {totals}
+    FROM shopping_history h JOIN shopping_history_items i ON i.history_id = h.id
+    GROUP BY h.user_id, {key}""" for dimension, key, label in STATS_DIMENSIONS]
+    return ("INSERT INTO shopping_stats (user_id, dimension, key, label, total_spent, total_items, savings, trips)\n"
+            + "\nUNION ALL\n".join(selects))
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('shopping_history_items', sa.Column('original_price', sa.Float(), nullable=True))
+    op.create_table('shopping_stats',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('dimension', sa.String(), nullable=False),
+    sa.Column('key', sa.String(), nullable=False),
+    sa.Column('label', sa.String(), nullable=True),
+    sa.Column('total_spent', sa.Float(), nullable=False),
+    sa.Column('total_items', sa.Integer(), nullable=False),
+    sa.Column('savings', sa.Float(), nullable=False),
+    sa.Column('trips', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_shopping_stats_id'), 'shopping_stats', ['id'], unique=False)
+    op.create_index('uq_shopping_stats_user_dimension_key', 'shopping_stats', ['user_id', 'dimension', 'key'],
+                    unique=True)
+    # riepilogo iniziale calcolato dallo storico esistente (lo sconto delle spese passate non e' noto)
+    op.execute(_rebuild_stats_statement(op.get_bind().dialect.name))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('uq_shopping_stats_user_dimension_key', table_name='shopping_stats')
+    op.drop_index(op.f('ix_shopping_stats_id'), table_name='shopping_stats')
+    op.drop_table('shopping_stats')
+    with op.batch_alter_table('shopping_history_items') as batch_op:
+        batch_op.drop_column('original_price')
@@ -0,0 +1,30 @@
+"""product equivalence index
+
+Revision ID: b8e4c1d7f352
+Revises: d5b2e8f4a190
+Create Date: 2026-10-19 15:24:08.913402
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8e4c1d7f352'
+down_revision: Union[str, Sequence[str], None] = 'd5b2e8f4a190'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # indice di espressione: /cart/optimize cerca i candidati per lower(trim(name)), lower(trim(unit))
+    op.create_index('ix_products_equivalence_key', 'products',
+                    [sa.text('lower(trim(name))'), sa.text('lower(trim(unit))')], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_products_equivalence_key', table_name='products')
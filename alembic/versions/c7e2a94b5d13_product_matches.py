@@ -0,0 +1,38 @@
+"""product matches
+
+Revision ID: c7e2a94b5d13
+Revises: f41b7c9d2e65
+Create Date: 2026-10-18 15:02:11.804213
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7e2a94b5d13'
+down_revision: Union[str, Sequence[str], None] = 'f41b7c9d2e65'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('product_matches',
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('match_id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['match_id'], ['products.id'], ),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.PrimaryKeyConstraint('product_id', 'match_id')
+    )
+    op.create_index('ix_product_matches_match', 'product_matches', ['match_id'], unique=False)
+    # l'indice si popola con `python -m app.product_matching`: il confronto dei nomi e' codice Python
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_product_matches_match', table_name='product_matches')
+    op.drop_table('product_matches')
@@ -0,0 +1,31 @@
+"""remove deleted product references
+
+Revision ID: d5b2e8f4a190
+Revises: a3f9d1c6e827
+Create Date: 2026-10-19 11:02:45.530118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5b2e8f4a190'
+down_revision: Union[str, Sequence[str], None] = 'a3f9d1c6e827'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # righe rimaste da prima che l'eliminazione di un prodotto ripulisse carrelli e preferiti
+    for table in ('cart', 'favorites'):
+        op.execute(f"DELETE FROM {table} WHERE product_id IN "
+                   "(SELECT id FROM products WHERE deleted_at IS NOT NULL)")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # le righe eliminate non si possono ricostruire
+    pass
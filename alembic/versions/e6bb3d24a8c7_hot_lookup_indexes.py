@@ -0,0 +1,106 @@
+"""hot lookup indexes
+
+Revision ID: e6bb3d24a8c7
+Revises: 097af6f4f89d
+Create Date: 2026-10-18 09:41:03.552917
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e6bb3d24a8c7'
+down_revision: Union[str, Sequence[str], None] = '097af6f4f89d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _create_missing_tables() -> None:
+    # preferiti e storico non hanno mai avuto una migration (nei database esistenti li ha creati
+    # create_all): su un database nuovo si creano qui, con le colonne che avevano prima di questa revisione
+    tables = set(sa.inspect(op.get_bind()).get_table_names())
+    if 'favorites' not in tables:
+        op.create_table('favorites',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=True),
+        sa.Column('owner_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['owner_id'], ['users.id'], ),
+        sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index(op.f('ix_favorites_id'), 'favorites', ['id'], unique=False)
+    if 'shopping_history' not in tables:
+        op.create_table('shopping_history',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.String(), nullable=False),
+        sa.Column('total_price', sa.Float(), nullable=False),
+        sa.Column('total_items', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index(op.f('ix_shopping_history_id'), 'shopping_history', ['id'], unique=False)
+    if 'shopping_history_items' not in tables:
+        op.create_table('shopping_history_items',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('history_id', sa.Integer(), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=True),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('image', sa.String(), nullable=True),
+        sa.Column('unit', sa.String(), nullable=True),
+        sa.Column('price_paid', sa.Float(), nullable=False),
+        sa.Column('was_discounted', sa.Boolean(), nullable=True),
+        sa.Column('quantity', sa.Integer(), nullable=True),
+        sa.Column('category', sa.String(), nullable=True),
+        sa.Column('aisle_order', sa.Float(), nullable=True),
+        sa.Column('supermarket_id', sa.Integer(), nullable=True),
+        sa.Column('supermarket_name', sa.String(), nullable=True),
+        sa.Column('calories', sa.Float(), nullable=True),
+        sa.Column('fat', sa.Float(), nullable=True),
+        sa.Column('carbs', sa.Float(), nullable=True),
+        sa.Column('protein', sa.Float(), nullable=True),
+        sa.ForeignKeyConstraint(['history_id'], ['shopping_history.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index(op.f('ix_shopping_history_items_id'), 'shopping_history_items', ['id'], unique=False)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    _create_missing_tables()
+    # i duplicati (stesso prodotto due volte nel carrello/preferiti dello stesso utente)
+    # impedirebbero la creazione degli indici unique: nel carrello la riga piu' vecchia prende
+    # la somma delle quantita', poi restano solo le righe piu' vecchie
+    op.execute("UPDATE cart SET quantity = (SELECT SUM(COALESCE(duplicate.quantity, 1)) FROM cart AS duplicate "
+               "WHERE duplicate.owner_id = cart.owner_id AND duplicate.product_id = cart.product_id) "
+               "WHERE id IN (SELECT MIN(id) FROM cart GROUP BY owner_id, product_id HAVING COUNT(*) > 1)")
+    for table in ('cart', 'favorites'):
+        op.execute(f"DELETE FROM {table} WHERE id NOT IN "
+                   f"(SELECT MIN(id) FROM {table} GROUP BY owner_id, product_id)")
+    op.create_index('uq_cart_owner_product', 'cart', ['owner_id', 'product_id'],
+                    unique=True, if_not_exists=True)
+    op.create_index('uq_favorites_owner_product', 'favorites', ['owner_id', 'product_id'],
+                    unique=True, if_not_exists=True)
+    op.create_index('ix_products_supermarket_aisle', 'products', ['supermarket_id', 'aisle_order'],
+                    unique=False, if_not_exists=True)
+    op.create_index(op.f('ix_shopping_history_items_history_id'), 'shopping_history_items', ['history_id'],
+                    unique=False, if_not_exists=True)
+    op.create_index(op.f('ix_recipe_items_recipe_id'), 'recipe_items', ['recipe_id'],
+                    unique=False, if_not_exists=True)
+    op.create_index(op.f('ix_shopping_history_user_id'), 'shopping_history', ['user_id'],
+                    unique=False, if_not_exists=True)
+    op.create_index(op.f('ix_recipes_owner_id'), 'recipes', ['owner_id'],
+                    unique=False, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_recipes_owner_id'), table_name='recipes')
+    op.drop_index(op.f('ix_shopping_history_user_id'), table_name='shopping_history')
+    op.drop_index(op.f('ix_recipe_items_recipe_id'), table_name='recipe_items')
+    op.drop_index(op.f('ix_shopping_history_items_history_id'), table_name='shopping_history_items')
+    op.drop_index('ix_products_supermarket_aisle', table_name='products')
+    op.drop_index('uq_favorites_owner_product', table_name='favorites')
+    op.drop_index('uq_cart_owner_product', table_name='cart')
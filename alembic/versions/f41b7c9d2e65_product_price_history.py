@@ -0,0 +1,46 @@
+"""product price history
+
+Revision ID: f41b7c9d2e65
+Revises: 8a3d6b1e4f20
+Create Date: 2026-10-18 12:20:54.319802
+
+"""
+import time
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f41b7c9d2e65'
+down_revision: Union[str, Sequence[str], None] = '8a3d6b1e4f20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('product_prices',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('recorded_at', sa.Integer(), nullable=False),
+    sa.Column('original_cents', sa.Integer(), nullable=True),
+    sa.Column('discounted_cents', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_product_prices_product_recorded', 'product_prices', ['product_id', 'recorded_at'],
+                    unique=False)
+    # punto di partenza: il prezzo attuale di ogni prodotto al momento della migrazione
+    op.execute(sa.text(
+        "INSERT INTO product_prices (product_id, recorded_at, original_cents, discounted_cents) "
+        "SELECT id, :now, CAST(ROUND(original_price * 100) AS INTEGER), "
+        "CAST(ROUND(discounted_price * 100) AS INTEGER) FROM products WHERE deleted_at IS NULL"
+    ).bindparams(now=int(time.time())))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_product_prices_product_recorded', table_name='product_prices')
+    op.drop_table('product_prices')
@@ -0,0 +1,90 @@
+from itertools import combinations, islice
+from math import comb
+
+import numpy as np
+
+# oltre questo numero di combinazioni di supermercati la ricerca esatta lascia il posto a quella greedy
+MAX_EXACT_COMBINATIONS = 20000
+COMBINATION_CHUNK = 4096
+
+
+def equivalence_key(name: str | None, unit: str | None) -> tuple[str, str]:
+    # prodotti equivalenti: stesso nome e stessa unita', senza distinguere le maiuscole.
+    # Deve corrispondere a lower(trim(...)) usato per cercare i candidati nel database
+    return (name or "").strip().lower(), (unit or "").strip().lower()
+
+
+def price_matrix(item_keys, candidates, store_ids):
+    # candidates: (chiave, supermarket_id, product_id, prezzo unitario). Restituisce la matrice
+    # articoli x supermercati del prezzo unitario minimo (inf dove manca) e il prodotto scelto
+    item_index = {key: index for index, key in enumerate(item_keys)}
+    store_index = {store_id: index for index, store_id in enumerate(store_ids)}
+    rows = np.array([item_index[key] for key, *_ in candidates], dtype=np.intp)
+    columns = np.array([store_index[store_id] for _, store_id, *_ in candidates], dtype=np.intp)
+    product_ids = np.array([product_id for _, _, product_id, _ in candidates], dtype=np.int64)
+    prices = np.array([price for *_, price in candidates], dtype=np.float64)
+
+    prices_by_store = np.full((len(item_keys), len(store_ids)), np.inf)
+    np.minimum.at(prices_by_store, (rows, columns), prices)
+    products_by_store = np.zeros(prices_by_store.shape, dtype=np.int64)
+    cheapest = prices == prices_by_store[rows, columns]
+    products_by_store[rows[cheapest], columns[cheapest]] = product_ids[cheapest]
+    return prices_by_store, products_by_store
+
+
+def _basket_costs(costs, store_sets):
+    # costo del carrello per ogni insieme di supermercati: ogni articolo va dove costa meno
+    return costs[:, store_sets].min(axis=2).sum(axis=0)
+
+
+def _exact_stores(costs, size):
+    best_cost, best_stores = np.inf, None
+    store_sets = combinations(range(costs.shape[1]), size)
+    # a blocchi: la matrice articoli x combinazioni x supermercati resta di dimensione limitata
+    while chunk := list(islice(store_sets, COMBINATION_CHUNK)):
+        chunk = np.array(chunk, dtype=np.intp)
+        totals = _basket_costs(costs, chunk)
+        index = int(totals.argmin())
+        if totals[index] < best_cost:
+            best_cost, best_stores = totals[index], chunk[index]
+    return best_stores
+
+
+def _greedy_stores(costs, size):
+    # aggiunge ogni volta il supermercato che riduce di piu' il totale, poi prova gli scambi
+    # di un supermercato finche' il totale scende
+    current = np.full(costs.shape[0], np.inf)
+    chosen = []
+    for _ in range(size):
+        totals = np.minimum(current[:, None], costs).sum(axis=0)
+        totals[chosen] = np.inf
+        store = int(totals.argmin())
+        chosen.append(store)
+        current = np.minimum(current, costs[:, store])
+    best_cost = current.sum()
+    improved = True
+    while improved:
+        improved = False
+        for position in range(size):
+            others = costs[:, [store for index, store in enumerate(chosen) if index != position]]
+            rest = others.min(axis=1) if others.shape[1] else np.full(costs.shape[0], np.inf)
+            totals = np.minimum(rest[:, None], costs).sum(axis=0)
+            totals[chosen] = np.inf
+            store = int(totals.argmin())
+            if totals[store] < best_cost - 1e-9:
+                chosen[position], best_cost, improved = store, totals[store], True
+    return np.array(sorted(chosen), dtype=np.intp)
+
+
+def cheapest_stores(prices_by_store, quantities, max_stores: int):
+    # indici dei supermercati (al massimo max_stores) che minimizzano il totale del carrello.
+    # Un articolo introvabile nei supermercati scelti pesa piu' di qualunque prezzo reale, cosi'
+    # si preferisce sempre la combinazione che copre piu' articoli
+    costs = prices_by_store * np.asarray(quantities, dtype=np.float64)[:, None]
+    finite = np.isfinite(costs)
+    penalty = costs[finite].max(initial=0.0) * costs.shape[0] + 1.0
+    costs = np.where(finite, costs, penalty)
+    size = min(max_stores, costs.shape[1])
+    if comb(costs.shape[1], size) <= MAX_EXACT_COMBINATIONS:
+        return _exact_stores(costs, size)
+    return _greedy_stores(costs, size)
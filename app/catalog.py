@@ -0,0 +1,82 @@
+import hashlib
+from typing import Annotated
+
+from fastapi import Depends, HTTPException, Request, Response
+from sqlalchemy import delete, event, select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, with_loader_criteria
+from starlette import status
+
+from app.models import Cart, CatalogVersion, Favorites, Products, Supermarkets
+from app.routers.auth import get_current_user
+
+CATALOG_CACHE_CONTROL = "private, no-cache"
+
+
+@event.listens_for(CatalogVersion.__table__, "after_create")
+def _create_catalog_version_row(target, connection, **kw):
+    connection.execute(text("INSERT INTO catalog_version (id, version) VALUES (1, 1)"))
+
+
+# prodotti e supermercati eliminati restano come tombstone per la sincronizzazione incrementale:
+# ogni select ORM li esclude, tranne quelle eseguite con execution_options(include_deleted=True)
+@event.listens_for(Session, "do_orm_execute")
+def _hide_deleted_catalog_rows(execute_state):
+    if (execute_state.is_select and not execute_state.is_column_load and not execute_state.is_relationship_load
+            and not execute_state.execution_options.get("include_deleted", False)):
+        execute_state.statement = execute_state.statement.options(
+            with_loader_criteria(Products, Products.deleted_at.is_(None), include_aliases=True),
+            with_loader_criteria(Supermarkets, Supermarkets.deleted_at.is_(None), include_aliases=True),
+        )
+
+
+async def remove_product_references(db: AsyncSession, product_ids) -> None:
+    # nella transazione che crea i tombstone: carrelli e preferiti non restano a puntare a prodotti
+    # eliminati, che nessuna select ORM restituisce piu'. product_ids puo' essere una subquery
+    await db.execute(delete(Cart).filter(Cart.product_id.in_(product_ids))
+                     .execution_options(synchronize_session=False))
+    await db.execute(delete(Favorites).filter(Favorites.product_id.in_(product_ids))
+                     .execution_options(synchronize_session=False))
+
+
+async def get_catalog_version(db: AsyncSession) -> int:
+    return await db.scalar(select(CatalogVersion.version).filter(CatalogVersion.id == 1)) or 0
+
+
+async def bump_catalog_version(db: AsyncSession) -> int:
+    # eseguito nella stessa transazione della modifica: il nuovo ETag compare solo dopo il commit.
+    # Il lock sulla riga serializza le scritture, quindi la versione restituita (usata per marcare
+    # le righe modificate) cresce nello stesso ordine dei commit
+    return await db.scalar(update(CatalogVersion).filter(CatalogVersion.id == 1)
+                           .values(version=CatalogVersion.version + 1)
+                           .returning(CatalogVersion.version))
+
+
+def catalog_etag(version: int, request: Request) -> str:
+    # la stessa versione produce corpi diversi per path e filtri diversi
+    url = f"{request.url.path}?{request.url.query}"
+    representation = hashlib.sha256(url.encode()).hexdigest()[:16]
+    return f'"{version}-{representation}"'
+
+
+def etag_matches(etag: str, if_none_match: str | None) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+
+def conditional_catalog_get(get_db):
+    # la versione del catalogo si legge da una tabella di una riga: con If-None-Match valido
+    # si risponde 304 senza interrogare prodotti o supermercati; gli header restituiti servono
+    # alle risposte costruite a mano (StreamingResponse), che ignorano quelli della Response iniettata
+    async def dependency(request: Request, response: Response,
+                         user: Annotated[dict, Depends(get_current_user)],
+                         db: Annotated[AsyncSession, Depends(get_db)]):
+        etag = catalog_etag(await get_catalog_version(db), request)
+        headers = {"ETag": etag, "Cache-Control": CATALOG_CACHE_CONTROL}
+        if etag_matches(etag, request.headers.get("if-none-match")):
+            raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        response.headers.update(headers)
+        return headers
+    return dependency
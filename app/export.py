@@ -0,0 +1,49 @@
+import csv
+import io
+import zlib
+
+import orjson
+from fastapi.responses import StreamingResponse
+
+EXPORT_BATCH_SIZE = 1000
+MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+
+async def _encoded_chunks(rows, columns, format):
+    # un pezzo per blocco di righe lette dal cursore: in memoria c'e' sempre al massimo un blocco
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if format == "csv":
+        writer.writerow(columns)
+    # partitions(): un passaggio nel driver async per blocco invece che per riga
+    async for partition in rows.partitions():
+        if format == "csv":
+            writer.writerows(partition)
+        else:
+            buffer.writelines(orjson.dumps(dict(zip(columns, row))).decode() + "\n" for row in partition)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+async def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=31)  # 31: intestazione e trailer gzip
+    async for chunk in chunks:
+        if compressed := compressor.compress(chunk):
+            yield compressed
+    yield compressor.flush()
+
+
+def export_response(rows, columns, format: str, filename: str, gzip: bool = False) -> StreamingResponse:
+    # rows: risultato di AsyncSession.stream(...) eseguito con yield_per
+    body = _encoded_chunks(rows, columns, format)
+    filename = f"{filename}.{format}"
+    media_type = MEDIA_TYPES[format]
+    if gzip:
+        body = _gzip_chunks(body)
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(body, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
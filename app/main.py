@@ -1,9 +1,14 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from app import passwords
 from app.database import engine, Base
+from app.metrics import MetricsMiddleware
+from app.schemas import ORJSONResponse
 from app.routers import (auth, products, favorites, supermarkets, recipes, recipe_items,
-                         cart, users, shopping_history)
+                         cart, users, shopping_history, dashboard, metrics)
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -12,7 +17,13 @@ from fastapi.responses import JSONResponse
 
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    passwords.shutdown_executor()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 @app.exception_handler(Exception)
 async def all_exception_handler(request: Request, exc: Exception):
@@ -30,6 +41,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 
 
@@ -43,4 +55,6 @@ app.include_router(recipes.router)
 app.include_router(recipe_items.router)
 app.include_router(cart.router)
 app.include_router(users.router)
-app.include_router(shopping_history.router)
\ No newline at end of file
+app.include_router(shopping_history.router)
+app.include_router(dashboard.router)
+app.include_router(metrics.router)
\ No newline at end of file
@@ -0,0 +1,190 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import passwords
+from app.recipe_summary import recipe_summary_cache
+from app.token_cache import token_cache
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class SQLStats:
+    __slots__ = ("statements", "seconds")
+
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+
+
+# statistiche SQL della richiesta (o del blocco track_sql) in corso: il contesto arriva fino ai
+# greenlet dei driver async, quindi gli eventi dell'engine sanno a quale richiesta appartengono
+_current_sql = ContextVar("current_sql", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_start"].pop()
+    stats = _current_sql.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.seconds += time.perf_counter() - started
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context):
+    # l'istruzione fallita non arriva ad after_cursor_execute
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_start"):
+        connection.info["query_start"].pop()
+
+
+@contextmanager
+def track_sql():
+    stats = SQLStats()
+    token = _current_sql.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_sql.reset(token)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.latency = {}
+        self.statements = {}
+        self.db_seconds = {}
+
+    def clear(self):
+        with self._lock:
+            self.requests = {}
+            self.latency = {}
+            self.statements = {}
+            self.db_seconds = {}
+
+    def observe(self, method, route, status_code, seconds, statements, db_seconds):
+        with self._lock:
+            key = (method, route, str(status_code))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            route_key = (method, route)
+            self.latency.setdefault(route_key, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self.statements.setdefault(route_key, Histogram(STATEMENT_BUCKETS)).observe(statements)
+            self.db_seconds[route_key] = self.db_seconds.get(route_key, 0.0) + db_seconds
+
+    def _histogram_lines(self, name, histograms):
+        lines = []
+        for (method, route), histogram in sorted(histograms.items()):
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append(f"{name}_bucket{_labels(method=method, route=route, le=bound)} {count}")
+            lines.append(f"{name}_bucket{_labels(method=method, route=route, le='+Inf')} {histogram.count}")
+            lines.append(f"{name}_sum{_labels(method=method, route=route)} {histogram.sum}")
+            lines.append(f"{name}_count{_labels(method=method, route=route)} {histogram.count}")
+        return lines
+
+    def render(self) -> str:
+        with self._lock:
+            lines = ["# HELP http_requests_total Richieste HTTP per route e status.",
+                     "# TYPE http_requests_total counter"]
+            lines += [f"http_requests_total{_labels(method=method, route=route, status=status_code)} {count}"
+                      for (method, route, status_code), count in sorted(self.requests.items())]
+            lines += ["# HELP http_request_duration_seconds Latenza delle richieste HTTP.",
+                      "# TYPE http_request_duration_seconds histogram"]
+            lines += self._histogram_lines("http_request_duration_seconds", self.latency)
+            lines += ["# HELP http_request_db_statements Istruzioni SQL eseguite per richiesta.",
+                      "# TYPE http_request_db_statements histogram"]
+            lines += self._histogram_lines("http_request_db_statements", self.statements)
+            lines += ["# HELP http_request_db_seconds_total Tempo speso nel database per route.",
+                      "# TYPE http_request_db_seconds_total counter"]
+            lines += [f"http_request_db_seconds_total{_labels(method=method, route=route)} {seconds}"
+                      for (method, route), seconds in sorted(self.db_seconds.items())]
+
+        password_stats = passwords.get_stats()
+        lines += ["# HELP password_hash_pending Hash bcrypt in coda o in esecuzione.",
+                  "# TYPE password_hash_pending gauge",
+                  f"password_hash_pending {password_stats['pending']}"]
+        for name in ("submitted", "completed", "rejected"):
+            lines += [f"# TYPE password_hash_{name}_total counter",
+                      f"password_hash_{name}_total {password_stats[name]}"]
+        for name in ("queue_wait_seconds", "hash_seconds"):
+            lines += [f"# TYPE password_{name}_total counter",
+                      f"password_{name}_total {password_stats[name]}"]
+
+        cache_stats = token_cache.stats()
+        for name in ("hits", "misses", "evictions"):
+            lines += [f"# TYPE token_cache_{name}_total counter",
+                      f"token_cache_{name}_total {cache_stats[name]}"]
+        lines += ["# TYPE token_cache_size gauge", f"token_cache_size {cache_stats['size']}"]
+
+        summary_stats = recipe_summary_cache.stats()
+        for name in ("hits", "misses"):
+            lines += [f"# TYPE recipe_summary_cache_{name}_total counter",
+                      f"recipe_summary_cache_{name}_total {summary_stats[name]}"]
+        lines += ["# TYPE recipe_summary_cache_size gauge", f"recipe_summary_cache_size {summary_stats['size']}"]
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+class MetricsMiddleware:
+    # middleware ASGI puro: misura anche le risposte in streaming fino all'ultimo byte
+    def __init__(self, app, registry: MetricsRegistry = metrics):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        with track_sql() as stats:
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                # il router scrive la route trovata nello scope: si usa il template, non il path reale
+                route = getattr(scope.get("route"), "path", "unmatched")
+                self.registry.observe(scope["method"], route, status_code, time.perf_counter() - started,
+                                      stats.statements, stats.seconds)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Index, func
 from sqlalchemy.orm import relationship
 
 from app.database import Base
@@ -35,9 +35,19 @@ class Products(Base):
     carbs = Column(Float, nullable=True)
     protein = Column(Float, nullable=True)
     location = Column(String, nullable=True)
+    # sincronizzazione incrementale: versione del catalogo dell'ultima modifica e tombstone
+    version = Column(Integer, nullable=False, default=0, server_default="0", index=True)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    deleted_at = Column(DateTime, nullable=True)
     supermarket = relationship("Supermarkets", back_populates="products")
     cart_items = relationship("Cart", back_populates="product")
 
+    __table_args__ = (
+        Index("ix_products_supermarket_aisle", "supermarket_id", "aisle_order"),
+        # chiave di equivalenza (basket.equivalence_key) usata da /cart/optimize
+        Index("ix_products_equivalence_key", func.lower(func.trim(name)), func.lower(func.trim(unit))),
+    )
+
 class Favorites(Base):
     __tablename__ = 'favorites'
 
@@ -45,6 +55,10 @@ class Favorites(Base):
     product_id = Column(Integer, ForeignKey('products.id'))
     owner_id = Column(Integer, ForeignKey('users.id'))
 
+    __table_args__ = (
+        Index("uq_favorites_owner_product", "owner_id", "product_id", unique=True),
+    )
+
 class Supermarkets(Base):
     __tablename__ = 'supermarkets'
 
@@ -52,6 +66,9 @@ class Supermarkets(Base):
     name = Column(String)
     image = Column(String, nullable=True)
     location = Column(String, nullable=True)
+    version = Column(Integer, nullable=False, default=0, server_default="0", index=True)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    deleted_at = Column(DateTime, nullable=True)
     products = relationship("Products", back_populates="supermarket")
 
 
@@ -61,14 +78,14 @@ class Recipes(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String)
     image = Column(String, nullable=True)
-    owner_id = Column(Integer, ForeignKey('users.id'))
+    owner_id = Column(Integer, ForeignKey('users.id'), index=True)
 
 
 class RecipeItems(Base):
     __tablename__ = 'recipe_items'
 
     id = Column(Integer, primary_key=True, index=True)
-    recipe_id = Column(Integer, ForeignKey('recipes.id'))
+    recipe_id = Column(Integer, ForeignKey('recipes.id'), index=True)
     product_id = Column(Integer, ForeignKey('products.id'))
     quantity = Column(Integer)
 
@@ -84,11 +101,15 @@ class Cart(Base):
     product = relationship("Products", back_populates="cart_items")
     owner = relationship("Users", back_populates="cart_items")
 
+    __table_args__ = (
+        Index("uq_cart_owner_product", "owner_id", "product_id", unique=True),
+    )
+
 class ShoppingHistory(Base):
     __tablename__ = "shopping_history"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False, index=True)
     created_at = Column(String, nullable=False)
     total_price = Column(Float, nullable=False)
     total_items = Column(Integer, nullable=False)
@@ -100,7 +121,7 @@ class ShoppingHistoryItem(Base):
     __tablename__ = "shopping_history_items"
 
     id = Column(Integer, primary_key=True, index=True)
-    history_id = Column(Integer, ForeignKey("shopping_history.id"), nullable=False)
+    history_id = Column(Integer, ForeignKey("shopping_history.id"), nullable=False, index=True)
 
     product_id = Column(Integer, nullable=True)
 
@@ -109,6 +130,7 @@ class ShoppingHistoryItem(Base):
     unit = Column(String, nullable=True)
 
     price_paid = Column(Float, nullable=False)
+    original_price = Column(Float, nullable=True)
     was_discounted = Column(Boolean, default=False)
 
     quantity = Column(Integer, default=1)
@@ -126,3 +148,68 @@ class ShoppingHistoryItem(Base):
 
     # relazione inversa
     history = relationship("ShoppingHistory", back_populates="items")
+
+
+class ProductPrice(Base):
+    __tablename__ = "product_prices"
+
+    # storico dei prezzi in sola aggiunta: timestamp unix e prezzi in centesimi interi
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, ForeignKey('products.id'), nullable=False)
+    recorded_at = Column(Integer, nullable=False)
+    original_cents = Column(Integer, nullable=True)
+    discounted_cents = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        Index("ix_product_prices_product_recorded", "product_id", "recorded_at"),
+    )
+
+
+class ProductMatch(Base):
+    __tablename__ = "product_matches"
+
+    # indice dei prodotti equivalenti in supermercati diversi: ogni coppia e' salvata nei due versi
+    product_id = Column(Integer, ForeignKey('products.id'), primary_key=True)
+    match_id = Column(Integer, ForeignKey('products.id'), primary_key=True)
+    score = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index("ix_product_matches_match", "match_id"),
+    )
+
+
+class ShoppingStats(Base):
+    __tablename__ = "shopping_stats"
+
+    # riepilogo della spesa per utente: una riga per mese, categoria o supermercato
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False)
+    dimension = Column(String, nullable=False)
+    key = Column(String, nullable=False)
+    label = Column(String, nullable=True)
+    total_spent = Column(Float, nullable=False, default=0)
+    total_items = Column(Integer, nullable=False, default=0)
+    savings = Column(Float, nullable=False, default=0)
+    trips = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("uq_shopping_stats_user_dimension_key", "user_id", "dimension", "key", unique=True),
+    )
+
+
+class CatalogVersion(Base):
+    __tablename__ = "catalog_version"
+
+    # riga unica, incrementata a ogni modifica di prodotti o supermercati
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=1)
+
+
+class RevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+
+    # token revocati con il logout, condivisi tra i worker; le righe scadute si possono eliminare
+    id = Column(Integer, primary_key=True, index=True)
+    digest = Column(String, nullable=False, unique=True)
+    expires_at = Column(DateTime, nullable=True, index=True)
+    revoked_at = Column(DateTime, nullable=False, index=True)
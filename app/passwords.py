@@ -0,0 +1,101 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+from starlette import status
+
+bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def default_hash_workers() -> int:
+    # ogni worker uvicorn ha il proprio pool: con WEB_CONCURRENCY worker (la stessa variabile letta
+    # da uvicorn per --workers) le CPU si dividono tra loro invece di moltiplicare i processi bcrypt
+    web_concurrency = max(int(os.getenv("WEB_CONCURRENCY", 1)), 1)
+    return max((os.cpu_count() or 1) // web_concurrency, 1)
+
+
+# bcrypt costa ~250ms di CPU: gira in un pool di processi per non bloccare l'event loop.
+# Oltre MAX_PENDING richieste in coda si risponde 503, cosi' un picco di login non affama l'API.
+# Con un numero di worker diverso da WEB_CONCURRENCY va impostato PASSWORD_HASH_WORKERS
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", default_hash_workers()))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", PASSWORD_HASH_WORKERS * 8))
+
+_executor = None
+_lock = threading.Lock()
+_stats = {
+    "submitted": 0,
+    "completed": 0,
+    "rejected": 0,
+    "pending": 0,
+    "peak_pending": 0,
+    "queue_wait_seconds": 0.0,
+    "hash_seconds": 0.0,
+}
+
+
+def _hash(password):
+    start = time.perf_counter()
+    return bcrypt_context.hash(password), time.perf_counter() - start
+
+
+def _verify(password, hashed_password):
+    start = time.perf_counter()
+    return bcrypt_context.verify(password, hashed_password), time.perf_counter() - start
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            # spawn: il processo principale ha thread attivi (driver async), fork non e' sicuro
+            _executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def shutdown_executor():
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def _run(func, *args):
+    with _lock:
+        if _stats["pending"] >= PASSWORD_HASH_MAX_PENDING:
+            _stats["rejected"] += 1
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="Server busy, retry later", headers={"Retry-After": "1"})
+        _stats["submitted"] += 1
+        _stats["pending"] += 1
+        _stats["peak_pending"] = max(_stats["peak_pending"], _stats["pending"])
+    start = time.perf_counter()
+    try:
+        result, hash_seconds = await asyncio.wrap_future(_get_executor().submit(func, *args))
+    finally:
+        with _lock:
+            _stats["pending"] -= 1
+    with _lock:
+        _stats["completed"] += 1
+        _stats["hash_seconds"] += hash_seconds
+        _stats["queue_wait_seconds"] += max(time.perf_counter() - start - hash_seconds, 0.0)
+    return result
+
+
+async def hash_password(password: str) -> str:
+    return await _run(_hash, password)
+
+
+async def verify_password(password: str, hashed_password: str) -> bool:
+    return await _run(_verify, password, hashed_password)
+
+
+def get_stats():
+    with _lock:
+        return {**_stats, "workers": PASSWORD_HASH_WORKERS, "max_pending": PASSWORD_HASH_MAX_PENDING}
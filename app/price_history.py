@@ -0,0 +1,51 @@
+import time
+
+from sqlalchemy import case, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import ProductPrice, Products
+
+
+def to_cents(price: float | None) -> int | None:
+    return None if price is None else round(price * 100)
+
+
+def price_row(product_id: int, original_price: float | None, discounted_price: float | None,
+              recorded_at: int | None = None) -> dict:
+    return {
+        "product_id": product_id,
+        "recorded_at": int(time.time()) if recorded_at is None else recorded_at,
+        "original_cents": to_cents(original_price),
+        "discounted_cents": to_cents(discounted_price),
+    }
+
+
+def price_point(product: Products, recorded_at: int | None = None) -> dict:
+    return price_row(product.id, product.original_price, product.discounted_price, recorded_at)
+
+
+def price_changed(product: Products, original_price: float | None, discounted_price: float | None) -> bool:
+    # confronto in centesimi: 1.1 e 1.10000001 sono lo stesso prezzo
+    return (to_cents(product.original_price) != to_cents(original_price) or
+            to_cents(product.discounted_price) != to_cents(discounted_price))
+
+
+async def get_price_points(db: AsyncSession, product_id: int, start: int, end: int, points: int):
+    # un punto per intervallo di bucket_seconds con min, max e media del prezzo effettivo:
+    # anni di variazioni diventano al massimo `points` righe, calcolate con un GROUP BY sull'indice.
+    # L'ultima variazione precedente a start finisce nel primo bucket: e' il prezzo in vigore all'inizio
+    bucket_seconds = (end - start) // points + 1
+    previous_change = (select(func.max(ProductPrice.recorded_at))
+                       .filter(ProductPrice.product_id == product_id)
+                       .filter(ProductPrice.recorded_at <= start).scalar_subquery())
+    bucket = case((ProductPrice.recorded_at < start, 0), else_=(ProductPrice.recorded_at - start) // bucket_seconds)
+    price = func.coalesce(ProductPrice.discounted_cents, ProductPrice.original_cents)
+    rows = (await db.execute(
+        select(bucket, func.min(price), func.max(price), func.avg(price), func.count(ProductPrice.id))
+        .filter(ProductPrice.product_id == product_id)
+        .filter(ProductPrice.recorded_at >= func.coalesce(previous_change, start))
+        .filter(ProductPrice.recorded_at <= end)
+        .group_by(bucket).order_by(bucket))).all()
+    return bucket_seconds, [{"t": start + index * bucket_seconds, "min_cents": low, "max_cents": high,
+                             "avg_cents": round(average), "samples": samples}
+                            for index, low, high, average, samples in rows]
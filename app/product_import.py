@@ -0,0 +1,62 @@
+import csv
+import io
+import json
+from itertools import islice
+
+from starlette.concurrency import run_in_threadpool
+
+IMPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+
+
+class RowError(ValueError):
+    pass
+
+
+def detect_format(filename: str | None, content_type: str | None) -> str | None:
+    filename = (filename or "").lower()
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if filename.endswith(".csv") or content_type in ("text/csv", "application/csv"):
+        return "csv"
+    if filename.endswith((".ndjson", ".jsonl")) or content_type in ("application/x-ndjson", "application/jsonl"):
+        return "ndjson"
+    return None
+
+
+def _csv_rows(text):
+    reader = csv.DictReader(text)
+    for row in reader:
+        # celle vuote = valori assenti; le colonne in piu' (chiave None) vengono ignorate
+        yield reader.line_num, {key: value if value != "" else None for key, value in row.items() if key is not None}
+
+
+def _ndjson_rows(text):
+    for line_number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_number, RowError("Invalid JSON")
+            continue
+        yield line_number, row if isinstance(row, dict) else RowError("Row must be a JSON object")
+
+
+def iter_rows(file, format: str):
+    # (numero di riga, dict) oppure (numero di riga, RowError) per le righe illeggibili
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    try:
+        yield from _csv_rows(text) if format == "csv" else _ndjson_rows(text)
+    except UnicodeDecodeError:
+        yield 0, RowError("File is not valid UTF-8")
+    finally:
+        # il file appartiene all'UploadFile: lo chiude starlette
+        text.detach()
+
+
+async def read_batches(file, format: str, batch_size: int = IMPORT_BATCH_SIZE):
+    # il file caricato e' gia' su disco (SpooledTemporaryFile): la lettura e il parsing di ogni
+    # blocco girano nel threadpool e in memoria resta un solo blocco di righe alla volta
+    rows = iter_rows(file, format)
+    while batch := await run_in_threadpool(lambda: list(islice(rows, batch_size))):
+        yield batch
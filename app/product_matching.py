@@ -0,0 +1,173 @@
+# indice dei prodotti equivalenti tra supermercati diversi. I prodotti sono divisi in blocchi per
+# unita', categoria e numeri nel nome (formati diversi non sono equivalenti); dentro un blocco si
+# confrontano, con la similarita' di Jaccard sui trigrammi del nome normalizzato, solo le coppie
+# trovate con un indice invertito sui trigrammi piu' rari.
+# Le scritture sul catalogo aggiornano solo i prodotti toccati, in background dopo la risposta;
+# la ricostruzione completa e'
+#
+#     python -m app.product_matching
+import asyncio
+import math
+import re
+import unicodedata
+from collections import Counter, defaultdict
+
+from sqlalchemy import delete, func, insert, or_, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import AsyncSessionLocal
+from app.models import ProductMatch, Products
+
+MATCH_THRESHOLD = 0.5
+INSERT_BATCH_SIZE = 5000
+# id per istruzione: remove_product_matches li usa due volte, asyncpg accetta al massimo 32767 parametri
+MATCH_CHUNK_SIZE = 1000
+QUANTITY = re.compile(r"\b(\d+(?:\.\d+)?) (kg|g|l|ml|cl|pz)\b")
+NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+
+def normalize_name(name: str | None) -> str:
+    text = unicodedata.normalize("NFKD", name or "").encode("ascii", "ignore").decode().lower()
+    text = " ".join(re.findall(r"[a-z0-9]+(?:[.,][0-9]+)?", text)).replace(",", ".")
+    # "1 l" e "1l" sono lo stesso formato
+    return QUANTITY.sub(r"\1\2", text)
+
+
+def block_key(unit: str | None, category: str | None) -> tuple[str, str]:
+    return (unit or "").strip().lower(), (category or "").strip().lower()
+
+
+def name_numbers(normalized: str) -> tuple[str, ...]:
+    return tuple(sorted(set(NUMBER.findall(normalized))))
+
+
+def trigrams(normalized: str) -> frozenset[str]:
+    padded = f"  {normalized} "
+    return frozenset(padded[index:index + 3] for index in range(len(padded) - 2))
+
+
+def similarity(left: frozenset[str], right: frozenset[str]) -> float:
+    if not left or not right:
+        return 0.0
+    shared = len(left & right)
+    return shared / (len(left) + len(right) - shared)
+
+
+class _Block:
+    def __init__(self):
+        self.products = {}
+        self.prefixes = None
+        self.postings = None
+
+    def add(self, product_id, supermarket_id, normalized):
+        self.products[product_id] = (supermarket_id, trigrams(normalized))
+
+    def _index(self):
+        # prefix filtering: con i trigrammi ordinati dal piu' raro, due nomi con Jaccard >= soglia
+        # hanno almeno un trigramma in comune tra i primi len - ceil(soglia * len) + 1 di ciascuno.
+        # Si indicizzano solo quei prefissi, non tutte le coppie del blocco
+        frequency = Counter(gram for _, grams in self.products.values() for gram in grams)
+        self.prefixes, self.postings = {}, defaultdict(list)
+        for product_id, (_, grams) in self.products.items():
+            ordered = sorted(grams, key=lambda gram: (frequency[gram], gram))
+            prefix = ordered[:len(ordered) - math.ceil(MATCH_THRESHOLD * len(ordered)) + 1]
+            self.prefixes[product_id] = prefix
+            for gram in prefix:
+                self.postings[gram].append(product_id)
+
+    def pairs(self, product_ids):
+        # coppie (id minore, id maggiore) -> punteggio dei prodotti indicati contro tutto il blocco
+        if self.postings is None:
+            self._index()
+        pairs = {}
+        for product_id in product_ids:
+            supermarket_id, grams = self.products[product_id]
+            candidates = {candidate_id for gram in self.prefixes[product_id] for candidate_id in self.postings[gram]}
+            # con insiemi di dimensioni troppo diverse Jaccard >= soglia e' impossibile
+            low, high = len(grams) * MATCH_THRESHOLD, len(grams) / MATCH_THRESHOLD
+            for candidate_id in candidates:
+                candidate_supermarket_id, candidate_grams = self.products[candidate_id]
+                pair = (min(product_id, candidate_id), max(product_id, candidate_id))
+                if (candidate_supermarket_id == supermarket_id or pair in pairs
+                        or not low <= len(candidate_grams) <= high):
+                    continue
+                score = similarity(grams, candidate_grams)
+                if score >= MATCH_THRESHOLD:
+                    pairs[pair] = round(score, 4)
+        return pairs
+
+
+def _block_columns():
+    return func.lower(func.trim(Products.unit)), func.lower(func.trim(Products.category))
+
+
+async def _load_blocks(db: AsyncSession, product_ids=None) -> dict[tuple[str, str], _Block]:
+    # con product_ids solo i blocchi a cui appartengono quei prodotti, in una sola query
+    block_model = select(Products.id, Products.supermarket_id, Products.name, Products.unit, Products.category)
+    if product_ids is not None:
+        block_model = block_model.filter(tuple_(*_block_columns()).in_(
+            select(*_block_columns()).filter(Products.id.in_(product_ids))))
+    blocks = defaultdict(_Block)
+    for product_id, supermarket_id, name, unit, category in await db.execute(block_model.order_by(Products.id)):
+        normalized = normalize_name(name)
+        blocks[(*block_key(unit, category), name_numbers(normalized))].add(product_id, supermarket_id, normalized)
+    return blocks
+
+
+async def _insert_pairs(db: AsyncSession, pairs: dict) -> None:
+    rows = [row for (left, right), score in pairs.items()
+            for row in ({"product_id": left, "match_id": right, "score": score},
+                        {"product_id": right, "match_id": left, "score": score})]
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        await db.execute(insert(ProductMatch.__table__), rows[start:start + INSERT_BATCH_SIZE])
+
+
+async def remove_product_matches(db: AsyncSession, product_ids) -> None:
+    await db.execute(delete(ProductMatch).filter(or_(ProductMatch.product_id.in_(product_ids),
+                                                     ProductMatch.match_id.in_(product_ids))))
+
+
+async def update_product_matches(db: AsyncSession, product_ids) -> None:
+    # i prodotti creati o modificati vengono confrontati solo con il proprio blocco, a gruppi di
+    # MATCH_CHUNK_SIZE id
+    product_ids = sorted(set(product_ids))
+    chunks = [set(product_ids[start:start + MATCH_CHUNK_SIZE])
+              for start in range(0, len(product_ids), MATCH_CHUNK_SIZE)]
+    for chunk in chunks:
+        await remove_product_matches(db, chunk)
+    done = set()
+    for chunk in chunks:
+        pairs = {}
+        for block in (await _load_blocks(db, chunk)).values():
+            pairs.update(block.pairs(chunk & block.products.keys()))
+        # le coppie con un prodotto dei gruppi precedenti sono gia' state inserite
+        await _insert_pairs(db, {pair: score for pair, score in pairs.items()
+                                 if pair[0] not in done and pair[1] not in done})
+        done |= chunk
+
+
+async def refresh_product_matches(product_ids) -> None:
+    # BackgroundTasks delle scritture sul catalogo: gira dopo la risposta, con sessione e
+    # transazione proprie. Se fallisce l'indice resta indietro fino alla ricostruzione completa
+    async with AsyncSessionLocal() as db:
+        await update_product_matches(db, product_ids)
+        await db.commit()
+
+
+async def rebuild_product_matches(db: AsyncSession) -> int:
+    await db.execute(delete(ProductMatch))
+    pairs = {}
+    for block in (await _load_blocks(db)).values():
+        pairs.update(block.pairs(block.products))
+    await _insert_pairs(db, pairs)
+    await db.commit()
+    return len(pairs)
+
+
+async def _main():
+    async with AsyncSessionLocal() as db:
+        print(f"product matches: {await rebuild_product_matches(db)} pairs")
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
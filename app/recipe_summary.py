@@ -0,0 +1,113 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Products, RecipeItems
+
+RECIPE_SUMMARY_CACHE_SIZE = int(os.getenv("RECIPE_SUMMARY_CACHE_SIZE", 10000))
+RECIPE_SUMMARY_TTL = int(os.getenv("RECIPE_SUMMARY_TTL", 300))
+NUTRIENTS = ("calories", "fat", "carbs", "protein")
+
+
+# riepiloghi per ricetta, validi finche' non cambia la versione del catalogo (prezzi e valori
+# nutrizionali) e finche' gli ingredienti della ricetta non vengono modificati da questo processo.
+# Come per la revoca dei token l'invalidazione e' locale: il TTL limita quanto puo' restare
+# indietro un altro worker dopo una modifica agli ingredienti
+class RecipeSummaryCache:
+    def __init__(self, maxsize: int = RECIPE_SUMMARY_CACHE_SIZE, ttl: int = RECIPE_SUMMARY_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, recipe_id: int, catalog_version: int):
+        with self._lock:
+            entry = self._entries.get(recipe_id)
+            if entry is None or entry[0] != catalog_version or entry[1] <= time.monotonic():
+                self._entries.pop(recipe_id, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(recipe_id)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, recipe_id: int, catalog_version: int, summary: dict):
+        with self._lock:
+            self._entries[recipe_id] = (catalog_version, time.monotonic() + self.ttl, summary)
+            self._entries.move_to_end(recipe_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *recipe_ids: int):
+        with self._lock:
+            for recipe_id in recipe_ids:
+                self._entries.pop(recipe_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "maxsize": self.maxsize}
+
+
+recipe_summary_cache = RecipeSummaryCache()
+
+
+def _empty_summary(recipe_id: int) -> dict:
+    return {"recipe_id": recipe_id, "items": 0, "unavailable": 0, "total_cost": 0.0,
+            **{nutrient: 0.0 for nutrient in NUTRIENTS}, "supermarkets": []}
+
+
+async def compute_recipe_summaries(db: AsyncSession, recipe_ids) -> dict[int, dict]:
+    # una sola query: ingredienti in join con i prodotti, aggregati per ricetta e supermercato.
+    # Gli ingredienti con il prodotto eliminato finiscono nel gruppo con supermarket_id NULL
+    price = func.coalesce(Products.discounted_price, Products.original_price)
+    quantity = func.coalesce(RecipeItems.quantity, 1)
+    rows = (await db.execute(
+        select(RecipeItems.recipe_id, Products.supermarket_id, func.count(RecipeItems.id),
+               func.count(Products.id), func.sum(quantity * price),
+               *(func.sum(quantity * getattr(Products, nutrient)) for nutrient in NUTRIENTS))
+        .outerjoin(Products, Products.id == RecipeItems.product_id)
+        .filter(RecipeItems.recipe_id.in_(recipe_ids))
+        .group_by(RecipeItems.recipe_id, Products.supermarket_id)
+        .order_by(RecipeItems.recipe_id, Products.supermarket_id))).all()
+    summaries = {recipe_id: _empty_summary(recipe_id) for recipe_id in recipe_ids}
+    for recipe_id, supermarket_id, items, available, cost, *nutrients in rows:
+        summary = summaries[recipe_id]
+        summary["items"] += items
+        summary["unavailable"] += items - available
+        if not available:
+            continue
+        summary["total_cost"] += cost or 0.0
+        for nutrient, value in zip(NUTRIENTS, nutrients):
+            summary[nutrient] += value or 0.0
+        summary["supermarkets"].append({"supermarket_id": supermarket_id, "items": available,
+                                        "cost": round(cost or 0.0, 2)})
+    for summary in summaries.values():
+        summary["total_cost"] = round(summary["total_cost"], 2)
+        for nutrient in NUTRIENTS:
+            summary[nutrient] = round(summary[nutrient], 1)
+    return summaries
+
+
+async def get_recipe_summaries(db: AsyncSession, recipe_ids: list[int], catalog_version: int) -> list[dict]:
+    summaries = {}
+    for recipe_id in recipe_ids:
+        cached = recipe_summary_cache.get(recipe_id, catalog_version)
+        if cached is not None:
+            summaries[recipe_id] = cached
+    missing = [recipe_id for recipe_id in recipe_ids if recipe_id not in summaries]
+    if missing:
+        for recipe_id, summary in (await compute_recipe_summaries(db, missing)).items():
+            recipe_summary_cache.put(recipe_id, catalog_version, summary)
+            summaries[recipe_id] = summary
+    return [summaries[recipe_id] for recipe_id in recipe_ids]
@@ -2,15 +2,20 @@ from datetime import timedelta, datetime
 
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 from starlette import status
-from passlib.context import CryptContext
 from typing import Annotated
 from jose import jwt, JWTError
 
-from app.database import SessionLocal
-from app.models import Users
+from app.database import AsyncSessionLocal
+from app.models import RevokedToken, Users
+from app.schemas import UserResponse
+from app.passwords import hash_password, verify_password
+from app.token_cache import sync_revocations, token_cache, token_digest
 
 router = APIRouter(
     prefix="/auth",
@@ -46,23 +51,19 @@ LxFdwzOcfsBB4Y6F7JowyqpWV7ddUyjkPtZPSplrVBcgdyqCrKCMfWUUHu5ITAuK
 
 ALGORITHM = 'HS256'
 
-bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_bearer = OAuth2PasswordBearer(tokenUrl="auth/token")
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
 
-def authenticate_user(username: str, password: str, db: db_dependency):
-    user = db.query(Users).filter(Users.username == username).first()
+async def authenticate_user(username: str, password: str, db: db_dependency):
+    user = await db.scalar(select(Users).filter(Users.username == username))
     if user is None:
         return False
-    if not bcrypt_context.verify(password, user.hashed_password):
+    if not await verify_password(password, user.hashed_password):
         return False
     return user
 
@@ -72,7 +73,15 @@ def create_access_token(username: str, user_id: int, role: str, expires_delta: t
     to_encode.update({"exp": expires})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_bearer)]):
+async def get_current_user(token: Annotated[str, Depends(oauth2_bearer)], db: db_dependency):
+    await sync_revocations(db)
+    digest = token_digest(token)
+    if token_cache.is_revoked(digest):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="Could not validate user")
+    cached = token_cache.get(digest)
+    if cached is not None:
+        return cached
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -81,7 +90,9 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_bearer)]):
         if username is None or user_id is None:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                                 detail="Could not validate user")
-        return {'username': username, 'id': user_id, 'user_role': user_role}
+        user = {'username': username, 'id': user_id, 'user_role': user_role}
+        token_cache.put(digest, user, payload.get("exp"))
+        return user
     except JWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Could not validate user")
@@ -99,25 +110,40 @@ class Token(BaseModel):
     access_token: str
     token_type: str
 
-@router.post("", status_code=status.HTTP_201_CREATED)
+@router.post("", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
 async def create_user(db: db_dependency, user: CreateUserRequest):
     create_user_model = Users(
         email=user.email,
         username=user.username,
         first_name=user.first_name,
         last_name=user.last_name,
-        hashed_password=bcrypt_context.hash(user.password)
+        hashed_password=await hash_password(user.password)
     )
     db.add(create_user_model)
-    db.commit()
-    db.refresh(create_user_model)
+    await db.commit()
+    await db.refresh(create_user_model)
     return create_user_model
 
 @router.post("/token", response_model=Token, status_code=status.HTTP_201_CREATED)
 async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], db: db_dependency):
-    user = authenticate_user(username=form_data.username, password=form_data.password, db=db)
+    user = await authenticate_user(username=form_data.username, password=form_data.password, db=db)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate user")
     token = create_access_token(user.username, user.id, user.role, timedelta(days=30))
-    return {'access_token': token, 'token_type': 'bearer'}
\ No newline at end of file
+    return {'access_token': token, 'token_type': 'bearer'}
+
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(token: Annotated[str, Depends(oauth2_bearer)], db: db_dependency):
+    await get_current_user(token, db)
+    payload = jwt.get_unverified_claims(token)
+    digest = token_digest(token)
+    now = datetime.utcnow()
+    expires_at = datetime.utcfromtimestamp(payload["exp"]) if payload.get("exp") else None
+    # la revoca salvata nel database raggiunge gli altri worker alla loro prossima sincronizzazione
+    revoke = postgresql_insert if db.get_bind().dialect.name == "postgresql" else sqlite_insert
+    await db.execute(revoke(RevokedToken).values(digest=digest, expires_at=expires_at, revoked_at=now)
+                     .on_conflict_do_nothing(index_elements=[RevokedToken.digest]))
+    await db.execute(delete(RevokedToken).filter(RevokedToken.expires_at <= now))
+    await db.commit()
+    token_cache.revoke(digest, payload.get("exp"))
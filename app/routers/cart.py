@@ -1,30 +1,44 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, Path
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Path
 from pydantic import BaseModel, Field
-from sqlalchemy.orm import Session
+import numpy as np
+from sqlalchemy import func, select, insert, update, delete, case, tuple_
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Annotated, Optional
 from starlette import status
 from datetime import datetime
 
-from app.database import SessionLocal
+from app.basket import cheapest_stores, equivalence_key, price_matrix
+from app.database import AsyncSessionLocal
 from app.routers import shopping_history_item
 from app.routers.auth import get_current_user
 from app.models import Cart, Products, Supermarkets, ShoppingHistory, ShoppingHistoryItem
+from app.schemas import BasketPlan, CartResponse, ShoppingRouteGroup
+from app.shopping_stats import add_shopping_stats
 
 router = APIRouter(
     prefix="/cart",
     tags=["cart"]
 )
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
 user_dependency = Annotated[dict, Depends(get_current_user)]
 
+def cart_upsert(dialect_name: str, values: list[dict], merge_quantities: bool = False):
+    # insert-or-update sull'indice unique (owner_id, product_id): una sola istruzione per tutte le righe
+    if dialect_name == "postgresql":
+        stmt = postgresql_insert(Cart).values(values)
+    else:
+        stmt = sqlite_insert(Cart).values(values)
+    quantity = Cart.quantity + stmt.excluded.quantity if merge_quantities else stmt.excluded.quantity
+    return stmt.on_conflict_do_update(index_elements=[Cart.owner_id, Cart.product_id],
+                                      set_={"quantity": quantity, "checked": stmt.excluded.checked})
+
 class CartRequest(BaseModel):
     product_id: int = Field(gt=0)
     quantity: int = Field(gt=0)
@@ -34,6 +48,16 @@ class CartUpdate(BaseModel):
     quantity: Optional[int] = Field(default=None, gt=0)
     checked: Optional[bool] = Field(default=None)
 
+class CartOperation(BaseModel):
+    id: int = Field(gt=0)
+    quantity: Optional[int] = Field(default=None, gt=0)
+    checked: Optional[bool] = Field(default=None)
+    delete: bool = False
+
+MAX_CART_OPERATIONS = 500
+DEFAULT_OPTIMIZE_STORES = 2
+MAX_OPTIMIZE_STORES = 10
+
 """
 @router.get("", status_code=status.HTTP_200_OK)
 async def read_cart_of_everybody(user: user_dependency, db: db_dependency, supermarket_id: Optional[int] = Query(default=None, gt=0)):
@@ -46,95 +70,254 @@ async def read_cart_of_everybody(user: user_dependency, db: db_dependency, super
     return db.query(Cart).all()
 """
 
-@router.get("", status_code=status.HTTP_200_OK)
+@router.get("", response_model=list[CartResponse], status_code=status.HTTP_200_OK)
 async def read_cart(user: user_dependency, db: db_dependency, supermarket_id: Optional[int] = Query(default=None, gt=0)):
     if supermarket_id is not None:
-        supermarket_model = db.query(Supermarkets).filter(Supermarkets.id == supermarket_id).first()
+        supermarket_model = await db.scalar(select(Supermarkets).filter(Supermarkets.id == supermarket_id))
         if supermarket_model is None:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Supermarket not found")
-        cart_model = (db.query(Cart).join(Products).filter(Products.supermarket_id == supermarket_id)
-                      .filter(Cart.owner_id == user.get('id')).all())
-        return cart_model
-    return db.query(Cart).filter(Cart.owner_id == user.get('id')).all()
+        cart_model = await db.scalars(select(Cart).join(Products).filter(Products.supermarket_id == supermarket_id)
+                                      .filter(Cart.owner_id == user.get('id')))
+        return cart_model.all()
+    # come /cart/route: le righe di prodotti eliminati non compaiono
+    return (await db.scalars(select(Cart).join(Products).filter(Cart.owner_id == user.get('id')))).all()
+
+@router.get("/optimize", response_model=BasketPlan, status_code=status.HTTP_200_OK)
+async def optimize_cart(user: user_dependency, db: db_dependency,
+                        max_stores: int = Query(default=DEFAULT_OPTIMIZE_STORES, ge=1, le=MAX_OPTIMIZE_STORES),
+                        include_checked: bool = False):
+    # dove comprare gli articoli del carrello spendendo meno, usando al massimo max_stores supermercati
+    effective_price = func.coalesce(Products.discounted_price, Products.original_price)
+    cart_model = (select(Cart.id, Cart.quantity, Products.id, Products.name, Products.unit, effective_price)
+                  .outerjoin(Products, Products.id == Cart.product_id)
+                  .filter(Cart.owner_id == user.get("id")).order_by(Cart.id))
+    if not include_checked:
+        cart_model = cart_model.filter(Cart.checked.isnot(True))
+    cart_rows = (await db.execute(cart_model)).all()
+    # gli articoli il cui prodotto e' stato eliminato non hanno nome e unita' da confrontare
+    unavailable = [cart_id for cart_id, _, product_id, *_ in cart_rows if product_id is None]
+    cart_rows = [row for row in cart_rows if row[2] is not None]
+    plan = {"max_stores": max_stores, "total": 0.0, "current_total": 0.0, "savings": 0.0,
+            "stores": [], "unavailable": unavailable}
+    if not cart_rows:
+        return plan
 
-@router.get("/{cart_id}", status_code=status.HTTP_200_OK)
+    item_keys = [equivalence_key(name, unit) for _, _, _, name, unit, _ in cart_rows]
+    keys = list(dict.fromkeys(item_keys))
+    key_index = {key: index for index, key in enumerate(keys)}
+    # stesse espressioni di ix_products_equivalence_key: il filtro sul nome usa l'indice,
+    # quello sulla coppia (nome, unita') scarta le combinazioni di articoli diversi
+    name_key, unit_key = func.lower(func.trim(Products.name)), func.lower(func.trim(Products.unit))
+    product_rows = (await db.execute(
+        select(Products.id, Products.name, Products.unit, Products.supermarket_id, Supermarkets.name, effective_price)
+        .join(Supermarkets, Supermarkets.id == Products.supermarket_id)
+        .filter(name_key.in_({name for name, _ in keys}))
+        .filter(tuple_(name_key, unit_key).in_(keys)))).all()
+    supermarket_names, products, candidates = {}, {}, []
+    for product_id, name, unit, supermarket_id, supermarket_name, price in product_rows:
+        key = equivalence_key(name, unit)
+        # trim() in SQL toglie solo gli spazi, strip() anche gli altri caratteri di spaziatura
+        if key not in key_index or price is None:
+            continue
+        supermarket_names[supermarket_id] = supermarket_name
+        products[product_id] = (name, unit)
+        candidates.append((key, supermarket_id, product_id, price))
+    store_ids = sorted(supermarket_names)
+    if not store_ids:
+        plan["unavailable"] += [cart_id for cart_id, *_ in cart_rows]
+        return plan
+
+    # una riga per chiave di equivalenza, poi una per articolo del carrello (anche con chiavi ripetute)
+    key_prices, key_products = price_matrix(keys, candidates, store_ids)
+    rows = np.array([key_index[key] for key in item_keys], dtype=np.intp)
+    prices_by_store, products_by_store = key_prices[rows], key_products[rows]
+    quantities = np.array([quantity or 1 for _, quantity, *_ in cart_rows], dtype=np.float64)
+
+    chosen = cheapest_stores(prices_by_store, quantities, max_stores)
+    chosen_prices = prices_by_store[:, chosen]
+    best = chosen_prices.argmin(axis=1)
+    unit_prices = chosen_prices[np.arange(len(cart_rows)), best]
+    covered = np.isfinite(unit_prices)
+    current_prices = np.array([price for *_, price in cart_rows], dtype=np.float64)
+
+    stores = {}
+    for index in np.flatnonzero(covered):
+        store = int(chosen[best[index]])
+        supermarket_id = store_ids[store]
+        product_id = int(products_by_store[index, store])
+        name, unit = products[product_id]
+        quantity = int(quantities[index])
+        stores.setdefault(supermarket_id, []).append({
+            "cart_id": cart_rows[index][0], "product_id": product_id, "name": name, "unit": unit,
+            "quantity": quantity, "price": float(unit_prices[index]),
+            "total": round(float(unit_prices[index]) * quantity, 2)})
+    plan["stores"] = [{"supermarket_id": supermarket_id, "supermarket_name": supermarket_names[supermarket_id],
+                       "total": round(sum(item["total"] for item in items), 2), "items": items}
+                      for supermarket_id, items in sorted(stores.items())]
+    plan["unavailable"] += [cart_rows[index][0] for index in np.flatnonzero(~covered)]
+    # confronto sugli stessi articoli: quelli non coperti dai supermercati scelti restano fuori
+    plan["total"] = round(float((unit_prices[covered] * quantities[covered]).sum()), 2)
+    plan["current_total"] = round(float((current_prices[covered] * quantities[covered]).sum()), 2)
+    plan["savings"] = round(plan["current_total"] - plan["total"], 2)
+    return plan
+
+@router.get("/route", response_model=list[ShoppingRouteGroup], status_code=status.HTTP_200_OK)
+async def read_cart_route(user: user_dependency, db: db_dependency):
+    # il carrello gia' diviso per supermercato e in ordine di corsia, con una sola query:
+    # l'ordinamento segue l'indice (supermarket_id, aisle_order), i prodotti senza corsia in fondo
+    cart_model = (await db.execute(
+        select(Cart.id, Cart.quantity, Cart.checked, Products, Supermarkets)
+        .join(Products, Products.id == Cart.product_id)
+        .outerjoin(Supermarkets, Supermarkets.id == Products.supermarket_id)
+        .filter(Cart.owner_id == user.get("id"))
+        .order_by(Products.supermarket_id, Products.aisle_order.is_(None), Products.aisle_order, Cart.id))).all()
+    groups = []
+    for cart_id, quantity, checked, product, supermarket in cart_model:
+        if not groups or groups[-1]["supermarket_id"] != product.supermarket_id:
+            groups.append({"supermarket_id": product.supermarket_id, "supermarket": supermarket,
+                           "total": 0.0, "remaining": 0.0, "items": []})
+        group = groups[-1]
+        price = product.discounted_price or product.original_price
+        subtotal = round((price or 0.0) * (quantity or 1), 2)
+        group["items"].append({"id": cart_id, "product_id": product.id, "quantity": quantity or 1,
+                               "checked": checked, "price": price, "subtotal": subtotal, "product": product})
+        group["total"] += subtotal
+        if not checked:
+            group["remaining"] += subtotal
+    for group in groups:
+        group["total"], group["remaining"] = round(group["total"], 2), round(group["remaining"], 2)
+    return groups
+
+@router.get("/{cart_id}", response_model=CartResponse, status_code=status.HTTP_200_OK)
 async def read_cart_by_id(user: user_dependency, db: db_dependency, cart_id: int = Path(gt=0)):
-        cart_model = db.query(Cart).filter(Cart.id == cart_id).filter(Cart.owner_id == user.get('id')).first()
+        cart_model = await db.scalar(select(Cart).filter(Cart.id == cart_id).filter(Cart.owner_id == user.get('id')))
         if cart_model is None:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart not found")
         return cart_model
 
-@router.post("", status_code=status.HTTP_201_CREATED)
+@router.post("", response_model=CartResponse, status_code=status.HTTP_201_CREATED)
 async def create_cart(user: user_dependency, db: db_dependency, cart_request: CartRequest):
-    product_model = db.query(Products).filter(Products.id == cart_request.product_id).first()
+    product_model = await db.scalar(select(Products).filter(Products.id == cart_request.product_id))
     if not product_model:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
-    existing = (db.query(Cart).filter(Cart.product_id == cart_request.product_id)
-                .filter(Cart.owner_id == user.get('id')).first())
-    if existing:
+    # il controllo dei duplicati e' l'indice unique (owner_id, product_id): due richieste
+    # concorrenti per lo stesso prodotto non possono inserire entrambe
+    if db.get_bind().dialect.name == "postgresql":
+        stmt = postgresql_insert(Cart)
+    else:
+        stmt = sqlite_insert(Cart)
+    cart = await db.scalar(stmt.values(**cart_request.model_dump(), owner_id=user.get('id'))
+                           .on_conflict_do_nothing(index_elements=[Cart.owner_id, Cart.product_id])
+                           .returning(Cart))
+    if cart is None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Product already in cart")
-    cart = Cart(**cart_request.model_dump(), owner_id=user.get('id'))
-    db.add(cart)
-    db.commit()
-    db.refresh(cart)
+    await db.commit()
     return cart
 
 @router.post("/finalize", status_code=status.HTTP_201_CREATED)
 async def create_shopping_history(user: user_dependency, db: db_dependency):
     owner_id = user.get("id")
-    cart_model = db.query(Cart).filter(Cart.owner_id == owner_id).filter(Cart.checked == True).all()
+    # carrello, prodotti e supermercati in un'unica query: niente lazy load per riga
+    cart_model = (await db.execute(
+        select(Cart.id, Cart.quantity, Products, Supermarkets.name)
+        .join(Products, Cart.product_id == Products.id)
+        .outerjoin(Supermarkets, Products.supermarket_id == Supermarkets.id)
+        .filter(Cart.owner_id == owner_id).filter(Cart.checked == True)
+        .order_by(Cart.id))).all()
     if not cart_model:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="The cart is empty!")
     created_at = datetime.utcnow().isoformat()
-    total_items = sum(item.quantity for item in cart_model)
-    total_price = sum((item.product.discounted_price or item.product.original_price)
-                                     * item.quantity for item in cart_model)
-    shopping_history_model = ShoppingHistory(total_items=total_items, total_price=total_price,
-                                             user_id=owner_id, created_at=created_at)
-    db.add(shopping_history_model)
-    db.commit()
-    db.refresh(shopping_history_model)
-
-    for item in cart_model:
-        product = item.product
-        price_paid = product.discounted_price or product.original_price
-        was_discounted = True if product.discounted_price else False
-
-        shopping_history_item_model = ShoppingHistoryItem(
-            history_id=shopping_history_model.id,
-            product_id=product.id,
-            name=product.name,
-            image=product.image,
-            unit=product.unit,
-            price_paid=price_paid,
-            was_discounted=was_discounted,
-            quantity = item.quantity,
-            category=product.category,
-            aisle_order = product.aisle_order,
-            supermarket_id = product.supermarket_id,
-            supermarket_name = product.supermarket.name,
-            calories = product.calories,
-            fat = product.fat,
-            carbs = product.carbs,
-            protein = product.protein,
-        )
-        db.add(shopping_history_item_model)
-    db.commit()
-
-
-    db.query(Cart).filter(Cart.owner_id == owner_id).filter(Cart.checked == True).delete()
-    db.commit()
+    total_items = sum(quantity for _, quantity, _, _ in cart_model)
+    total_price = sum((product.discounted_price or product.original_price) * quantity
+                      for _, quantity, product, _ in cart_model)
+
+    # storico, righe dello storico, riepilogo statistiche e svuotamento del carrello nella stessa transazione
+    history_id = await db.scalar(insert(ShoppingHistory).values(
+        total_items=total_items, total_price=total_price, user_id=owner_id, created_at=created_at
+    ).returning(ShoppingHistory.id))
+    history_items = [
+        {
+            "history_id": history_id,
+            "product_id": product.id,
+            "name": product.name,
+            "image": product.image,
+            "unit": product.unit,
+            "price_paid": product.discounted_price or product.original_price,
+            "original_price": product.original_price,
+            "was_discounted": True if product.discounted_price else False,
+            "quantity": quantity,
+            "category": product.category,
+            "aisle_order": product.aisle_order,
+            "supermarket_id": product.supermarket_id,
+            "supermarket_name": supermarket_name,
+            "calories": product.calories,
+            "fat": product.fat,
+            "carbs": product.carbs,
+            "protein": product.protein,
+        }
+        for _, quantity, product, supermarket_name in cart_model
+    ]
+    await db.execute(insert(ShoppingHistoryItem), history_items)
+    await add_shopping_stats(db, history_id)
+    await db.execute(delete(Cart).filter(Cart.id.in_([cart_id for cart_id, _, _, _ in cart_model]))
+                     .execution_options(synchronize_session=False))
+    await db.commit()
 
     return {
         "message": "Spesa finalizzata con successo",
         "finalized_items": len(cart_model),
-        "history_id": shopping_history_model.id
+        "history_id": history_id
     }
 
 
+@router.patch("", status_code=status.HTTP_200_OK)
+async def update_cart_batch(user: user_dependency, db: db_dependency,
+                            operations: list[CartOperation] = Body(min_length=1, max_length=MAX_CART_OPERATIONS)):
+    owned_ids = set((await db.scalars(select(Cart.id).filter(Cart.owner_id == user.get('id'))
+                                      .filter(Cart.id.in_({op.id for op in operations})))).all())
+    results = []
+    seen_ids = set()
+    delete_ids = []
+    quantities = {}
+    checked = {}
+    for op in operations:
+        if op.id in seen_ids:
+            results.append({"id": op.id, "status": "duplicate"})
+            continue
+        seen_ids.add(op.id)
+        if op.id not in owned_ids:
+            results.append({"id": op.id, "status": "not_found"})
+        elif op.delete:
+            delete_ids.append(op.id)
+            results.append({"id": op.id, "status": "deleted"})
+        elif op.quantity is None and op.checked is None:
+            results.append({"id": op.id, "status": "invalid"})
+        else:
+            if op.quantity is not None:
+                quantities[op.id] = op.quantity
+            if op.checked is not None:
+                checked[op.id] = op.checked
+            results.append({"id": op.id, "status": "updated"})
+
+    # tutte le modifiche in un solo UPDATE (CASE sull'id) e un solo DELETE, con un unico commit
+    update_ids = quantities.keys() | checked.keys()
+    if update_ids:
+        values = {}
+        if quantities:
+            values["quantity"] = case(quantities, value=Cart.id, else_=Cart.quantity)
+        if checked:
+            values["checked"] = case(checked, value=Cart.id, else_=Cart.checked)
+        await db.execute(update(Cart).filter(Cart.id.in_(update_ids)).values(**values)
+                         .execution_options(synchronize_session=False))
+    if delete_ids:
+        await db.execute(delete(Cart).filter(Cart.id.in_(delete_ids))
+                         .execution_options(synchronize_session=False))
+    await db.commit()
+    return results
+
 @router.put("/{cart_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def update_cart(user: user_dependency, db: db_dependency, cart_update: CartUpdate, cart_id: int = Path(gt=0)):
-    cart_model = db.query(Cart).filter(Cart.id == cart_id).filter(Cart.owner_id == user.get('id')).first()
+    cart_model = await db.scalar(select(Cart).filter(Cart.id == cart_id).filter(Cart.owner_id == user.get('id')))
     if cart_model is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart not found")
     if cart_update.checked is None and cart_update.quantity is None:
@@ -143,33 +326,35 @@ async def update_cart(user: user_dependency, db: db_dependency, cart_update: Car
         cart_model.quantity = cart_update.quantity
     if cart_update.checked is not None:
         cart_model.checked = cart_update.checked
-    db.commit()
+    await db.commit()
 
 @router.delete("/{cart_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_cart_id(user: user_dependency, db: db_dependency, cart_id: int = Path(gt=0)):
-    cart_model = db.query(Cart).filter(Cart.id == cart_id).filter(Cart.owner_id == user.get('id')).first()
+    cart_model = await db.scalar(select(Cart).filter(Cart.id == cart_id).filter(Cart.owner_id == user.get('id')))
     if cart_model is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart not found")
-    db.delete(cart_model)
-    db.commit()
+    await db.delete(cart_model)
+    await db.commit()
 
 @router.delete("", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_cart(user: user_dependency, db: db_dependency, supermarket_id: Optional[int] = Query(default=None, gt=0), checked: Optional[bool] = Query(default=None)):
     if supermarket_id is None and checked is None:
-        deleted = db.query(Cart).filter(Cart.owner_id == user.get('id')).delete(synchronize_session=False)
-        db.commit()
-        if deleted == 0:
+        result = await db.execute(delete(Cart).filter(Cart.owner_id == user.get('id'))
+                                  .execution_options(synchronize_session=False))
+        await db.commit()
+        if result.rowcount == 0:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart not found")
         return
-    cart_model = db.query(Cart.id).join(Products).filter(Cart.owner_id == user.get('id'))
+    cart_model = select(Cart.id).join(Products).filter(Cart.owner_id == user.get('id'))
     if supermarket_id is not None:
-        supermarket_model = db.query(Supermarkets).filter(Supermarkets.id == supermarket_id).first()
+        supermarket_model = await db.scalar(select(Supermarkets).filter(Supermarkets.id == supermarket_id))
         if supermarket_model is None:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Supermarket not found")
         cart_model = cart_model.filter(Products.supermarket_id == supermarket_id)
     if checked is not None:
         cart_model = cart_model.filter(Cart.checked == checked)
-    deleted = db.query(Cart).filter(Cart.id.in_(cart_model)).delete(synchronize_session=False)
-    db.commit()
-    if deleted == 0:
+    result = await db.execute(delete(Cart).filter(Cart.id.in_(cart_model))
+                              .execution_options(synchronize_session=False))
+    await db.commit()
+    if result.rowcount == 0:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart not found")
@@ -0,0 +1,75 @@
+import hashlib
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Annotated
+from starlette import status
+
+from app.catalog import etag_matches
+from app.database import AsyncSessionLocal
+from app.routers.auth import get_current_user
+from app.models import CatalogVersion, Products, Recipes, Supermarkets, Users
+from app.schemas import DashboardResponse, RecipeResponse, UserResponse
+
+router = APIRouter(
+    prefix="/dashboard",
+    tags=["dashboard"]
+)
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
+user_dependency = Annotated[dict, Depends(get_current_user)]
+
+DASHBOARD_DEALS = 8
+DASHBOARD_CACHE_CONTROL = "private, no-cache"
+
+# tutto quello che serve alla home in una sola richiesta: cinque query nella stessa sessione
+@router.get("", response_model=DashboardResponse, status_code=status.HTTP_200_OK)
+async def get_dashboard(user: user_dependency, db: db_dependency, request: Request):
+    catalog_version = select(CatalogVersion.version).filter(CatalogVersion.id == 1).scalar_subquery()
+    user_row = (await db.execute(select(Users, catalog_version).filter(Users.id == user.get('id')))).first()
+    if user_row is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    user_model, version = user_row
+    recipes = (await db.scalars(select(Recipes).filter(Recipes.owner_id == user_model.id)
+                                .order_by(Recipes.id))).all()
+
+    # l'ETag si calcola prima delle aggregazioni sui prodotti: supermercati, conteggi e offerte
+    # dipendono solo dalla versione del catalogo, il resto (profilo, ricette) e' gia' stato letto.
+    # Con If-None-Match valido si risponde 304 senza eseguire le query sul catalogo
+    fingerprint = hashlib.sha256(f"{version}:".encode())
+    fingerprint.update(UserResponse.model_validate(user_model).model_dump_json().encode())
+    for recipe in recipes:
+        fingerprint.update(RecipeResponse.model_validate(recipe).model_dump_json().encode())
+    etag = f'"{fingerprint.hexdigest()[:32]}"'
+    headers = {"ETag": etag, "Cache-Control": DASHBOARD_CACHE_CONTROL, "Vary": "Authorization"}
+    if etag_matches(etag, request.headers.get("if-none-match")):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    supermarkets = (await db.scalars(select(Supermarkets).order_by(Supermarkets.id))).all()
+    counts = (await db.execute(select(Products.supermarket_id, func.count(Products.id),
+                                      func.count(Products.discounted_price))
+                               .group_by(Products.supermarket_id)
+                               .order_by(Products.supermarket_id))).all()
+    deals = (await db.scalars(select(Products)
+                              .filter(Products.discounted_price.is_not(None), Products.original_price > 0)
+                              .order_by((Products.discounted_price / Products.original_price).asc(), Products.id)
+                              .limit(DASHBOARD_DEALS))).all()
+
+    dashboard = DashboardResponse.model_validate({
+        "user": user_model,
+        "supermarkets": supermarkets,
+        "recipes": recipes,
+        "product_summary": {
+            "total": sum(total for _, total, _ in counts),
+            "discounted": sum(discounted for _, _, discounted in counts),
+            "by_supermarket": [{"supermarket_id": supermarket_id, "total": total, "discounted": discounted}
+                               for supermarket_id, total, discounted in counts],
+        },
+        "deals": deals,
+    }, from_attributes=True)
+    return Response(content=dashboard.model_dump_json().encode(), media_type="application/json", headers=headers)
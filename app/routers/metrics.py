@@ -0,0 +1,17 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from starlette import status
+
+from app.metrics import metrics
+
+router = APIRouter(
+    prefix="/metrics",
+    tags=["metrics"]
+)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# letto dallo scraper Prometheus: nessuna autenticazione, va esposto solo sulla rete interna
+@router.get("", status_code=status.HTTP_200_OK, include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type=PROMETHEUS_CONTENT_TYPE)
@@ -1,27 +1,53 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, Path
-from pydantic import BaseModel, Field
-from sqlalchemy.orm import Session
-from typing import Annotated, Optional
+import time
+from datetime import datetime
+
+from fastapi import APIRouter, BackgroundTasks, Depends, File, HTTPException, Query, Path, UploadFile
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Annotated, Optional, Literal
 from starlette import status
 
-from app.database import SessionLocal
+from app.database import AsyncSessionLocal
+from app.catalog import conditional_catalog_get, bump_catalog_version, get_catalog_version, remove_product_references
 from app.routers.auth import get_current_user
-from app.models import Products, Supermarkets
+from app.models import ProductMatch, Products, ProductPrice, Supermarkets
+from app.export import EXPORT_BATCH_SIZE, export_response
+from app.price_history import get_price_points, price_changed, price_point, price_row
+from app.product_import import MAX_REPORTED_ERRORS, RowError, detect_format, read_batches
+from app.product_matching import refresh_product_matches, remove_product_matches
+from app.schemas import (CatalogChanges, PriceHistory, ProductEquivalent, ProductImportReport, ProductPage,
+                         ProductResponse, ProductSearchPage)
+from app.search import product_search_filter, search_products_query
 
 router = APIRouter(
     prefix="/product",
     tags=["product"]
 )
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
 user_dependency = Annotated[dict, Depends(get_current_user)]
+catalog_etag = conditional_catalog_get(get_db)
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+DEFAULT_PRICE_POINTS = 200
+MAX_PRICE_POINTS = 2000
+DEFAULT_PRICE_RANGE_SECONDS = 365 * 24 * 3600
+DEFAULT_EQUIVALENTS = 10
+MAX_EQUIVALENTS = 100
+# campi che cambiano il confronto con i prodotti degli altri supermercati
+MATCHING_FIELDS = {"name", "unit", "category", "supermarket_id"}
+
+async def _ndjson_lines(rows):
+    async for product in rows:
+        yield ProductResponse.model_validate(product).model_dump_json() + "\n"
 
 class ProductRequest(BaseModel):
     name: str = Field(max_length=100)
@@ -38,6 +64,10 @@ class ProductRequest(BaseModel):
     protein : float | None = None
     location: str | None = None
 
+class ProductImportRow(ProductRequest):
+    # con id la riga aggiorna un prodotto esistente, senza id ne crea uno nuovo
+    id: int | None = Field(default=None, gt=0)
+
 class ProductUpdate(BaseModel):
     name: str | None = None
     category: str | None = None
@@ -54,15 +84,19 @@ class ProductUpdate(BaseModel):
     location: str | None = None
 
 
-@router.get("", status_code=status.HTTP_200_OK)
+@router.get("", response_model=list[ProductResponse] | ProductPage, status_code=status.HTTP_200_OK)
 async def get_products(user: user_dependency, db: db_dependency,
+                       catalog_headers: Annotated[dict, Depends(catalog_etag)],
                        supermarket_id: Optional[int] = Query(default=None, gt=0),
                        category: Optional[str] = Query(default=None, max_length=100),
                        search: Optional[str] = Query(default=None),
-                       discounted_only: bool = False):
-    product_model = db.query(Products)
+                       discounted_only: bool = False,
+                       limit: Optional[int] = Query(default=None, gt=0, le=MAX_PAGE_SIZE),
+                       cursor: Optional[int] = Query(default=None, gt=0),
+                       format: Literal["json", "ndjson"] = "json"):
+    product_model = select(Products)
     if supermarket_id is not None:
-        supermarket = db.query(Supermarkets).filter(Supermarkets.id == supermarket_id).first()
+        supermarket = await db.scalar(select(Supermarkets).filter(Supermarkets.id == supermarket_id))
         print("supermarket_id:", supermarket_id)
         if supermarket is None:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Supermarket not found")
@@ -70,53 +104,245 @@ async def get_products(user: user_dependency, db: db_dependency,
     if category:
         product_model = product_model.filter(Products.category == category)
     if search:
-        product_model = product_model.filter(Products.name.ilike(f"%{search}%"))
+        product_model = product_model.filter(product_search_filter(db.get_bind().dialect.name, search))
     if discounted_only:
         product_model = product_model.filter(Products.discounted_price.isnot(None),
                                              Products.discounted_price < Products.original_price)
-    return product_model.all()
+    if format == "ndjson":
+        # i prodotti vengono letti a blocchi e scritti una riga alla volta, senza costruire la lista intera
+        rows = await db.stream_scalars(product_model.order_by(Products.id)
+                                       .execution_options(yield_per=STREAM_BATCH_SIZE))
+        return StreamingResponse(_ndjson_lines(rows), media_type="application/x-ndjson", headers=catalog_headers)
+    if limit is None and cursor is None:
+        return (await db.scalars(product_model.order_by(Products.id))).all()
+
+    # paginazione keyset: il cursore e' l'id dell'ultimo prodotto della pagina precedente
+    page_size = limit or DEFAULT_PAGE_SIZE
+    if cursor is not None:
+        product_model = product_model.filter(Products.id > cursor)
+    items = (await db.scalars(product_model.order_by(Products.id).limit(page_size + 1))).all()
+    next_cursor = items[page_size - 1].id if len(items) > page_size else None
+    return {"items": items[:page_size], "next_cursor": next_cursor}
+
+@router.get("/search", response_model=ProductSearchPage, status_code=status.HTTP_200_OK)
+async def search_products(user: user_dependency, db: db_dependency,
+                          q: str = Query(min_length=1, max_length=100),
+                          limit: int = Query(default=20, gt=0, le=MAX_PAGE_SIZE),
+                          offset: int = Query(default=0, ge=0)):
+    search_model = search_products_query(db.get_bind().dialect.name, q)
+    items = (await db.scalars(search_model.limit(limit + 1).offset(offset))).all()
+    next_offset = offset + limit if len(items) > limit else None
+    return {"items": items[:limit], "next_offset": next_offset}
+
+@router.get("/changes", response_model=CatalogChanges, status_code=status.HTTP_200_OK)
+async def get_catalog_changes(user: user_dependency, db: db_dependency,
+                              since: Optional[int] = Query(default=None, ge=0)):
+    # il token e' la versione del catalogo: senza since si riceve il catalogo completo,
+    # con since solo le righe create, modificate o eliminate dopo quella versione
+    token = await get_catalog_version(db)
+    if since is not None and since > token:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid sync token")
+    product_model = (select(Products).filter(Products.version <= token).order_by(Products.id)
+                     .execution_options(include_deleted=True))
+    supermarket_model = (select(Supermarkets).filter(Supermarkets.version <= token).order_by(Supermarkets.id)
+                         .execution_options(include_deleted=True))
+    if since is None:
+        product_model = product_model.filter(Products.deleted_at.is_(None))
+        supermarket_model = supermarket_model.filter(Supermarkets.deleted_at.is_(None))
+    else:
+        product_model = product_model.filter(Products.version > since)
+        supermarket_model = supermarket_model.filter(Supermarkets.version > since)
+    products = (await db.scalars(product_model)).all()
+    supermarkets = (await db.scalars(supermarket_model)).all()
+    return {"products": [product for product in products if product.deleted_at is None],
+            "supermarkets": [supermarket for supermarket in supermarkets if supermarket.deleted_at is None],
+            "deleted_products": [product.id for product in products if product.deleted_at is not None],
+            "deleted_supermarkets": [supermarket.id for supermarket in supermarkets
+                                     if supermarket.deleted_at is not None],
+            "token": token}
+
+@router.get("/export", status_code=status.HTTP_200_OK, response_class=StreamingResponse)
+async def export_products(user: user_dependency, db: db_dependency,
+                          supermarket_id: Optional[int] = Query(default=None, gt=0),
+                          category: Optional[str] = Query(default=None, max_length=100),
+                          format: Literal["csv", "ndjson"] = "csv", gzip: bool = False):
+    columns = list(ProductResponse.model_fields)
+    export_model = select(*(getattr(Products, column) for column in columns))
+    if supermarket_id is not None:
+        export_model = export_model.filter(Products.supermarket_id == supermarket_id)
+    if category:
+        export_model = export_model.filter(Products.category == category)
+    rows = await db.stream(export_model.order_by(Products.id).execution_options(yield_per=EXPORT_BATCH_SIZE))
+    return export_response(rows, columns, format, "products", gzip)
+
+@router.post("/import", response_model=ProductImportReport, status_code=status.HTTP_200_OK)
+async def import_products(user: user_dependency, db: db_dependency, background_tasks: BackgroundTasks,
+                          file: UploadFile = File(), format: Optional[Literal["csv", "ndjson"]] = None):
+    format = format or detect_format(file.filename, file.content_type)
+    if format is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unsupported file format")
+    report = {"inserted": 0, "updated": 0, "failed": 0, "errors": []}
 
-@router.get("/{product_id}", status_code=status.HTTP_200_OK)
+    def reject(row_number, errors):
+        report["failed"] += 1
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append({"row": row_number, "errors": errors})
+
+    known_supermarkets = set()
+    imported_ids = set()
+    # ogni blocco e' validato e scritto con poche istruzioni executemany e un commit:
+    # le righe valide restano importate anche se altre righe del file sono rifiutate
+    async for batch in read_batches(file.file, format):
+        rows = []
+        for row_number, row in batch:
+            if isinstance(row, RowError):
+                reject(row_number, [str(row)])
+                continue
+            try:
+                rows.append((row_number, ProductImportRow.model_validate(row)))
+            except ValidationError as exc:
+                reject(row_number, [f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in exc.errors()])
+
+        unknown_supermarkets = {row.supermarket_id for _, row in rows} - known_supermarkets
+        if unknown_supermarkets:
+            known_supermarkets.update(await db.scalars(select(Supermarkets.id)
+                                                       .filter(Supermarkets.id.in_(unknown_supermarkets))))
+        update_ids = {row.id for _, row in rows if row.id is not None}
+        current_prices = {}
+        if update_ids:
+            # anche i prodotti eliminati: reimportarli li ripristina
+            current_prices = {product.id: product for product in await db.execute(
+                select(Products.id, Products.original_price, Products.discounted_price)
+                .filter(Products.id.in_(update_ids)).execution_options(include_deleted=True))}
+
+        new_rows, update_rows = [], []
+        for row_number, row in rows:
+            if row.supermarket_id not in known_supermarkets:
+                reject(row_number, ["Supermarket id not found"])
+            elif row.id is None:
+                new_rows.append(row.model_dump(exclude={"id"}))
+            elif row.id not in current_prices:
+                reject(row_number, ["Product not found"])
+            else:
+                update_rows.append(row.model_dump())
+        if not new_rows and not update_rows:
+            continue
+
+        version = await bump_catalog_version(db)
+        recorded_at = int(time.time())
+        prices = []
+        if new_rows:
+            # insert Core: l'ORM separerebbe le righe in piu' executemany in base ai valori None.
+            # Niente RETURNING (con l'ordine garantito SQLite tornerebbe a una insert per riga):
+            # i prodotti appena creati sono gli unici con la versione di questo blocco
+            await db.execute(insert(Products.__table__), [{**product, "version": version} for product in new_rows])
+            for product in await db.execute(select(Products.id, Products.original_price, Products.discounted_price)
+                                            .filter(Products.version == version)):
+                prices.append(price_row(product.id, product.original_price, product.discounted_price, recorded_at))
+                imported_ids.add(product.id)
+        if update_rows:
+            await db.execute(update(Products), [{**product, "version": version, "deleted_at": None}
+                                                for product in update_rows])
+            imported_ids.update(product["id"] for product in update_rows)
+            prices += [price_row(product["id"], product["original_price"], product["discounted_price"], recorded_at)
+                       for product in update_rows
+                       if price_changed(current_prices[product["id"]], product["original_price"],
+                                        product["discounted_price"])]
+        if prices:
+            await db.execute(insert(ProductPrice.__table__), prices)
+        await db.commit()
+        report["inserted"] += len(new_rows)
+        report["updated"] += len(update_rows)
+    if imported_ids:
+        # l'indice di equivalenza si aggiorna dopo la risposta: le righe sono gia' tutte salvate
+        background_tasks.add_task(refresh_product_matches, imported_ids)
+    report["errors"].sort(key=lambda error: error["row"])
+    return report
+
+@router.get("/{product_id}", response_model=ProductResponse, status_code=status.HTTP_200_OK)
 async def get_product_by_id(user: user_dependency, db: db_dependency, product_id: int=Path(gt=0)):
-    product_model = db.query(Products).filter(Products.id == product_id).first()
+    product_model = await db.scalar(select(Products).filter(Products.id == product_id))
     if product_model is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
     return product_model
 
-@router.get("/supermarket/{supermarket_id}", status_code=status.HTTP_200_OK)
+@router.get("/{product_id}/prices", response_model=PriceHistory, status_code=status.HTTP_200_OK)
+async def get_product_prices(user: user_dependency, db: db_dependency, product_id: int = Path(gt=0),
+                             start: Optional[datetime] = None, end: Optional[datetime] = None,
+                             points: int = Query(default=DEFAULT_PRICE_POINTS, gt=0, le=MAX_PRICE_POINTS)):
+    product_model = await db.scalar(select(Products).filter(Products.id == product_id))
+    if product_model is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+    end_ts = int(end.timestamp()) if end else int(time.time())
+    start_ts = int(start.timestamp()) if start else end_ts - DEFAULT_PRICE_RANGE_SECONDS
+    if start_ts >= end_ts:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="start must be before end")
+    bucket_seconds, price_points = await get_price_points(db, product_id, start_ts, end_ts, points)
+    return {"product_id": product_id, "start": start_ts, "end": end_ts,
+            "bucket_seconds": bucket_seconds, "points": price_points}
+
+@router.get("/{product_id}/equivalents", response_model=list[ProductEquivalent], status_code=status.HTTP_200_OK)
+async def get_product_equivalents(user: user_dependency, db: db_dependency, product_id: int = Path(gt=0),
+                                  limit: int = Query(default=DEFAULT_EQUIVALENTS, gt=0, le=MAX_EQUIVALENTS)):
+    product_model = await db.scalar(select(Products.id).filter(Products.id == product_id))
+    if product_model is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+    # lo stesso prodotto negli altri supermercati, dal piu' simile
+    rows = (await db.execute(select(Products, ProductMatch.score)
+                             .join(ProductMatch, ProductMatch.match_id == Products.id)
+                             .filter(ProductMatch.product_id == product_id)
+                             .order_by(ProductMatch.score.desc(), Products.id).limit(limit))).all()
+    return [{"score": score, "product": product} for product, score in rows]
+
+@router.get("/supermarket/{supermarket_id}", response_model=list[ProductResponse], status_code=status.HTTP_200_OK, dependencies=[Depends(catalog_etag)])
 async def get_supermarket_products(user: user_dependency, db: db_dependency, supermarket_id: int=Path(gt=0)):
-    supermarket_model = db.query(Supermarkets).filter(Supermarkets.id == supermarket_id).first()
+    supermarket_model = await db.scalar(select(Supermarkets).filter(Supermarkets.id == supermarket_id))
     if supermarket_model is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Supermarket not found")
-    return (db.query(Products).filter(Products.supermarket_id == supermarket_id)
-            .order_by(Products.aisle_order).all())
+    return (await db.scalars(select(Products).filter(Products.supermarket_id == supermarket_id)
+                             .order_by(Products.aisle_order))).all()
 
-@router.post("", status_code=status.HTTP_201_CREATED)
-async def create_product(user: user_dependency, db: db_dependency, request: ProductRequest):
-    supermarket_model = db.query(Supermarkets).filter(Supermarkets.id == request.supermarket_id).first()
+@router.post("", response_model=ProductResponse, status_code=status.HTTP_201_CREATED)
+async def create_product(user: user_dependency, db: db_dependency, background_tasks: BackgroundTasks,
+                         request: ProductRequest):
+    supermarket_model = await db.scalar(select(Supermarkets).filter(Supermarkets.id == request.supermarket_id))
     if supermarket_model is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Supermarket id not found")
-    product_model = Products(**request.model_dump())
+    product_model = Products(**request.model_dump(), version=await bump_catalog_version(db))
     db.add(product_model)
-    db.commit()
-    db.refresh(product_model)
+    await db.flush()
+    db.add(ProductPrice(**price_point(product_model)))
+    await db.commit()
+    await db.refresh(product_model)
+    background_tasks.add_task(refresh_product_matches, [product_model.id])
     return product_model
 
 @router.delete("/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_product(user: user_dependency, db: db_dependency, product_id: int = Path(gt=0)):
-    product_model = db.query(Products).filter(Products.id == product_id).first()
+    product_model = await db.scalar(select(Products).filter(Products.id == product_id))
     if product_model is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
-    db.delete(product_model)
-    db.commit()
+    product_model.deleted_at = func.now()
+    product_model.version = await bump_catalog_version(db)
+    await remove_product_matches(db, [product_id])
+    await remove_product_references(db, [product_id])
+    await db.commit()
 
 @router.put("/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def update_product(user: user_dependency, db: db_dependency, request: ProductUpdate, product_id: int = Path(gt=0)):
-    product_model = db.query(Products).filter(Products.id == product_id).first()
+async def update_product(user: user_dependency, db: db_dependency, background_tasks: BackgroundTasks,
+                         request: ProductUpdate, product_id: int = Path(gt=0)):
+    product_model = await db.scalar(select(Products).filter(Products.id == product_id))
     if product_model is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
     update_data = request.model_dump(exclude_unset=True)
+    new_price = price_changed(product_model, update_data.get("original_price", product_model.original_price),
+                              update_data.get("discounted_price", product_model.discounted_price))
     for key, value in update_data.items():
         setattr(product_model, key, value)
-    db.commit()
+    if new_price:
+        db.add(ProductPrice(**price_point(product_model)))
+    product_model.version = await bump_catalog_version(db)
+    await db.commit()
+    if MATCHING_FIELDS & update_data.keys():
+        background_tasks.add_task(refresh_product_matches, [product_id])
 
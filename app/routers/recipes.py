@@ -1,26 +1,28 @@
-from fastapi import APIRouter, Depends, Path, HTTPException, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Body, Depends, Path, HTTPException, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Annotated, Optional
 from pydantic import BaseModel, Field
 from starlette import status
 
-from app.database import SessionLocal
+from app.catalog import get_catalog_version
+from app.database import AsyncSessionLocal
 from app.routers.auth import get_current_user
-from app.models import Recipes, Users
+from app.routers.cart import cart_upsert
+from app.models import Cart, Products, RecipeItems, Recipes, Users
+from app.recipe_summary import get_recipe_summaries, recipe_summary_cache
+from app.schemas import RecipeCartResponse, RecipeResponse, RecipeSummary
 
 router = APIRouter(
     prefix="/recipe",
     tags=["recipe"]
 )
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
 user_dependency = Annotated[dict, Depends(get_current_user)]
 
 class RecipeRequest(BaseModel):
@@ -28,52 +30,119 @@ class RecipeRequest(BaseModel):
     owner_id: int = Field(gt=0)
     image: str | None = None
 
-@router.get("", status_code=status.HTTP_200_OK)
+class RecipeCartRequest(BaseModel):
+    recipe_id: int = Field(gt=0)
+    # quante volte la ricetta va preparata: moltiplica le quantita' degli ingredienti
+    quantity: int = Field(default=1, gt=0, le=100)
+
+MAX_CART_RECIPES = 50
+
+async def add_recipes_to_cart(db: AsyncSession, owner_id: int, recipe_quantities: dict[int, int]):
+    found = set(await db.scalars(select(Recipes.id).filter(Recipes.id.in_(recipe_quantities))))
+    if found != recipe_quantities.keys():
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Recipe not found")
+    # outer join: gli ingredienti il cui prodotto e' stato eliminato tornano con Products.id NULL
+    items = (await db.execute(select(RecipeItems.recipe_id, RecipeItems.product_id, RecipeItems.quantity, Products.id)
+                              .outerjoin(Products, Products.id == RecipeItems.product_id)
+                              .filter(RecipeItems.recipe_id.in_(recipe_quantities))
+                              .order_by(RecipeItems.id))).all()
+    quantities, missing = {}, []
+    for recipe_id, product_id, quantity, live_product_id in items:
+        if live_product_id is None:
+            if product_id not in missing:
+                missing.append(product_id)
+            continue
+        quantities[product_id] = quantities.get(product_id, 0) + (quantity or 1) * recipe_quantities[recipe_id]
+    cart = []
+    if quantities:
+        # una sola insert-or-update: le righe gia' nel carrello sommano la quantita' e tornano da spuntare
+        cart = (await db.scalars(
+            cart_upsert(db.get_bind().dialect.name, [
+                {"product_id": product_id, "quantity": quantity, "owner_id": owner_id, "checked": False}
+                for product_id, quantity in quantities.items()
+            ], merge_quantities=True).returning(Cart),
+            execution_options={"populate_existing": True})).all()
+    await db.commit()
+    return {"cart": sorted(cart, key=lambda row: row.product_id), "missing": missing}
+
+@router.get("", response_model=list[RecipeResponse], status_code=status.HTTP_200_OK)
 async def get_recipes(user: user_dependency, db: db_dependency, owner_id: Optional[int]=Query(default=None, gt=0)):
     if owner_id:
-        user_model = db.query(Users).filter(Users.id == owner_id).first()
+        user_model = await db.scalar(select(Users).filter(Users.id == owner_id))
         if not user_model:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-        return db.query(Recipes).filter(Recipes.owner_id == owner_id).all()
-    return db.query(Recipes).all()
+        return (await db.scalars(select(Recipes).filter(Recipes.owner_id == owner_id))).all()
+    return (await db.scalars(select(Recipes))).all()
+
+@router.post("/add-to-cart", response_model=RecipeCartResponse, status_code=status.HTTP_201_CREATED)
+async def add_meal_plan_to_cart(user: user_dependency, db: db_dependency,
+                                request: list[RecipeCartRequest] = Body(min_length=1, max_length=MAX_CART_RECIPES)):
+    # piano settimanale: la stessa ricetta ripetuta somma le quantita'
+    recipe_quantities = {}
+    for item in request:
+        recipe_quantities[item.recipe_id] = recipe_quantities.get(item.recipe_id, 0) + item.quantity
+    return await add_recipes_to_cart(db, user.get("id"), recipe_quantities)
+
+@router.post("/{recipe_id}/add-to-cart", response_model=RecipeCartResponse, status_code=status.HTTP_201_CREATED)
+async def add_recipe_to_cart(user: user_dependency, db: db_dependency, recipe_id: int = Path(gt=0),
+                             quantity: int = Query(default=1, gt=0, le=100)):
+    return await add_recipes_to_cart(db, user.get("id"), {recipe_id: quantity})
+
+@router.get("/summary", response_model=list[RecipeSummary], status_code=status.HTTP_200_OK)
+async def get_recipes_summary(user: user_dependency, db: db_dependency,
+                              owner_id: Optional[int] = Query(default=None, gt=0)):
+    # costo e valori nutrizionali di tutte le ricette di un utente (di default quello autenticato)
+    recipe_ids = (await db.scalars(select(Recipes.id).filter(Recipes.owner_id == (owner_id or user.get("id")))
+                                   .order_by(Recipes.id))).all()
+    if not recipe_ids:
+        return []
+    return await get_recipe_summaries(db, recipe_ids, await get_catalog_version(db))
+
+@router.get("/{recipe_id}/summary", response_model=RecipeSummary, status_code=status.HTTP_200_OK)
+async def get_recipe_summary(user: user_dependency, db: db_dependency, recipe_id: int = Path(gt=0)):
+    recipe_model = await db.scalar(select(Recipes.id).filter(Recipes.id == recipe_id))
+    if recipe_model is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Recipe not found")
+    return (await get_recipe_summaries(db, [recipe_id], await get_catalog_version(db)))[0]
 
-@router.get("/{recipe_id}", status_code=status.HTTP_200_OK)
+@router.get("/{recipe_id}", response_model=RecipeResponse, status_code=status.HTTP_200_OK)
 async def get_recipe_by_id(user: user_dependency, db: db_dependency, recipe_id: int=Path(gt=0)):
-    recipe_model = db.query(Recipes).filter(Recipes.id == recipe_id).first()
+    recipe_model = await db.scalar(select(Recipes).filter(Recipes.id == recipe_id))
     if recipe_model is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Recipe not found")
     return recipe_model
 
-@router.post("", status_code=status.HTTP_201_CREATED)
+@router.post("", response_model=RecipeResponse, status_code=status.HTTP_201_CREATED)
 async def create_recipe(user: user_dependency, db: db_dependency, request: RecipeRequest):
     owner_id = request.owner_id
-    #user_model = db.query(Users).filter(Users.id == owner_id).filter(Users.id == user.get('id')).first()
-    user_model = db.query(Users).filter(Users.id == owner_id).first()
+    #user_model = await db.scalar(select(Users).filter(Users.id == owner_id).filter(Users.id == user.get('id')))
+    user_model = await db.scalar(select(Users).filter(Users.id == owner_id))
     if user_model is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Wrong user id")
     recipe_model = Recipes(**request.model_dump())
     db.add(recipe_model)
-    db.commit()
-    db.refresh(recipe_model)
+    await db.commit()
+    await db.refresh(recipe_model)
     return recipe_model
 
 @router.put("/{recipe_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def update_recipe(user: user_dependency, db: db_dependency, recipe_id: int, request: RecipeRequest):
     user_id = request.owner_id
-    user_model = db.query(Users).filter(Users.id == user_id).first()
+    user_model = await db.scalar(select(Users).filter(Users.id == user_id))
     if user_model is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Wrong user id")
-    recipe_model = db.query(Recipes).filter(Recipes.id == recipe_id).first()
+    recipe_model = await db.scalar(select(Recipes).filter(Recipes.id == recipe_id))
     if recipe_model is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Recipe not found")
     recipe_model.name = request.name
     recipe_model.owner_id = request.owner_id
-    db.commit()
+    await db.commit()
 
 @router.delete("/{recipe_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_recipe(user: user_dependency, db: db_dependency, recipe_id: int):
-    recipe_model = db.query(Recipes).filter(Recipes.id == recipe_id).first()
+    recipe_model = await db.scalar(select(Recipes).filter(Recipes.id == recipe_id))
     if recipe_model is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Recipe not found")
-    db.delete(recipe_model)
-    db.commit()
\ No newline at end of file
+    await db.delete(recipe_model)
+    await db.commit()
+    recipe_summary_cache.invalidate(recipe_id)
\ No newline at end of file
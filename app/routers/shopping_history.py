@@ -1,74 +1,122 @@
 from fastapi import APIRouter, Depends, HTTPException, Query, Path
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-from sqlalchemy.orm import Session
-from typing import Annotated, Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Annotated, Literal, Optional
 from starlette import status
 from datetime import datetime
 
-from app.database import SessionLocal
+from app.database import AsyncSessionLocal
+from app.export import EXPORT_BATCH_SIZE, export_response
 from app.routers.auth import get_current_user
-from app.models import Users, ShoppingHistory, ShoppingHistoryItem, Cart, Products
+from app.routers.cart import cart_upsert
+from app.models import Users, ShoppingHistory, ShoppingHistoryItem, ShoppingStats, Cart, Products
+from app.schemas import ShoppingHistoryItemResponse, ShoppingHistoryResponse, ShoppingStatsResponse
+from app.shopping_stats import remove_shopping_stats
 
 router = APIRouter(
     prefix="/shopping-history",
     tags=["shopping-history"]
 )
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
 user_dependency = Annotated[dict, Depends(get_current_user)]
 
-@router.get("", status_code=status.HTTP_200_OK)
+EXPORT_ITEM_COLUMNS = ["product_id", "name", "unit", "price_paid", "original_price", "was_discounted", "quantity",
+                       "category", "supermarket_id", "supermarket_name", "calories", "fat", "carbs", "protein"]
+
+@router.get("", response_model=list[ShoppingHistoryResponse], status_code=status.HTTP_200_OK)
 async def get_shopping_history(user: user_dependency, db: db_dependency):
     owner_id = user.get("id")
-    user_model = db.query(Users).filter(Users.id == owner_id).first()
+    user_model = await db.scalar(select(Users).filter(Users.id == owner_id))
     if not user_model:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    shopping_history_model = db.query(ShoppingHistory).filter(ShoppingHistory.user_id == owner_id).all()
-    return shopping_history_model
+    shopping_history_model = await db.scalars(select(ShoppingHistory).filter(ShoppingHistory.user_id == owner_id))
+    return shopping_history_model.all()
+
+@router.get("/stats", response_model=ShoppingStatsResponse, status_code=status.HTTP_200_OK)
+async def get_shopping_stats(user: user_dependency, db: db_dependency):
+    # legge solo il riepilogo dell'utente: il costo non dipende dal numero di spese
+    stats_model = (await db.scalars(select(ShoppingStats).filter(ShoppingStats.user_id == user.get("id"))
+                                    .order_by(ShoppingStats.dimension, ShoppingStats.key))).all()
+    buckets = {"month": [], "category": [], "supermarket": []}
+    for row in stats_model:
+        buckets[row.dimension].append({
+            "key": row.key or None,
+            "label": row.label,
+            "total_spent": round(row.total_spent, 2),
+            "total_items": row.total_items,
+            "savings": round(row.savings, 2),
+            "trips": row.trips,
+        })
+    # ogni spesa cade in un solo mese: i totali sono la somma dei mesi
+    months = buckets["month"]
+    return {
+        "total_spent": round(sum(month["total_spent"] for month in months), 2),
+        "total_items": sum(month["total_items"] for month in months),
+        "savings": round(sum(month["savings"] for month in months), 2),
+        "trips": sum(month["trips"] for month in months),
+        "by_month": months,
+        "by_category": buckets["category"],
+        "by_supermarket": buckets["supermarket"],
+    }
+
+@router.get("/export", status_code=status.HTTP_200_OK, response_class=StreamingResponse)
+async def export_shopping_history(user: user_dependency, db: db_dependency,
+                                  format: Literal["csv", "ndjson"] = "csv", gzip: bool = False):
+    # una riga per articolo acquistato, con i dati della spesa a cui appartiene
+    columns = ["history_id", "created_at", *EXPORT_ITEM_COLUMNS]
+    export_model = (select(ShoppingHistory.id, ShoppingHistory.created_at,
+                           *(getattr(ShoppingHistoryItem, column) for column in EXPORT_ITEM_COLUMNS))
+                    .join(ShoppingHistoryItem, ShoppingHistoryItem.history_id == ShoppingHistory.id)
+                    .filter(ShoppingHistory.user_id == user.get("id"))
+                    .order_by(ShoppingHistory.id, ShoppingHistoryItem.id))
+    rows = await db.stream(export_model.execution_options(yield_per=EXPORT_BATCH_SIZE))
+    return export_response(rows, columns, format, "shopping-history", gzip)
 
-@router.get("/{shopping_history_id}", status_code=status.HTTP_200_OK)
+@router.get("/{shopping_history_id}", response_model=ShoppingHistoryResponse, status_code=status.HTTP_200_OK)
 async def get_shopping_history_by_id(user: user_dependency, db: db_dependency, shopping_history_id: int=Path(gt=0)):
-    shopping_history_model = (db.query(ShoppingHistory).filter(ShoppingHistory.id == shopping_history_id)
-                              .filter(ShoppingHistory.user_id == user.get("id")).first())
+    shopping_history_model = await db.scalar(select(ShoppingHistory).filter(ShoppingHistory.id == shopping_history_id)
+                                             .filter(ShoppingHistory.user_id == user.get("id")))
     if shopping_history_model is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Shopping History not found")
     return shopping_history_model
 
-@router.get("/{shopping_history_id}/items", status_code=status.HTTP_200_OK)
+@router.get("/{shopping_history_id}/items", response_model=list[ShoppingHistoryItemResponse], status_code=status.HTTP_200_OK)
 async def get_shopping_history_items(user: user_dependency, db: db_dependency, shopping_history_id: int=Path(gt=0)):
-    shopping_history_model = (db.query(ShoppingHistory).filter(ShoppingHistory.id == shopping_history_id)
-                              .filter(ShoppingHistory.user_id == user.get("id")).first())
+    shopping_history_model = await db.scalar(select(ShoppingHistory).filter(ShoppingHistory.id == shopping_history_id)
+                                             .filter(ShoppingHistory.user_id == user.get("id")))
     if shopping_history_model is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Shopping History not found")
 
-    shopping_history_item_model = (db.query(ShoppingHistoryItem).filter
-                                   (ShoppingHistoryItem.history_id == shopping_history_id)
-                                   .all())
+    shopping_history_item_model = (await db.scalars(select(ShoppingHistoryItem).filter
+                                   (ShoppingHistoryItem.history_id == shopping_history_id))).all()
     return shopping_history_item_model
 
 @router.post("/{shopping_history_id}/restore-cart", status_code=status.HTTP_201_CREATED)
 async def shopping_history_restore_cart(user: user_dependency, db: db_dependency, shopping_history_id: int=Path(gt=0)):
     owner_id = user.get("id")
-    shopping_history_model = (db.query(ShoppingHistory).filter(ShoppingHistory.id == shopping_history_id)
-                              .filter(ShoppingHistory.user_id == owner_id).first())
+    shopping_history_model = await db.scalar(select(ShoppingHistory).filter(ShoppingHistory.id == shopping_history_id)
+                                             .filter(ShoppingHistory.user_id == owner_id))
     if shopping_history_model is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Shopping History not found")
 
-    shopping_history_item_model = (db.query(ShoppingHistoryItem).filter
-                                   (ShoppingHistoryItem.history_id == shopping_history_id)
-                                   .all())
+    shopping_history_item_model = (await db.scalars(select(ShoppingHistoryItem).filter
+                                   (ShoppingHistoryItem.history_id == shopping_history_id))).all()
+    product_ids = {item.product_id for item in shopping_history_item_model if item.product_id is not None}
+    products = {product.id: product for product in
+                (await db.scalars(select(Products).filter(Products.id.in_(product_ids)))).all()}
     missing_products = []
     updated_products = []
     restored_products = []
+    restored_quantities = {}
     for item in shopping_history_item_model:
-        product_model = db.query(Products).filter(Products.id == item.product_id).first()
+        product_model = products.get(item.product_id)
         if product_model is None:
             missing_products.append({
                 "id": item.product_id,
@@ -120,22 +168,24 @@ async def shopping_history_restore_cart(user: user_dependency, db: db_dependency
                 }
             })
 
-        cart_model = Cart(
-            product_id = item.product_id,
-            quantity = item.quantity,
-            owner_id = owner_id,
-            checked = False
-        )
-        db.add(cart_model)
-        restored_products.append(product_model.id)
-    db.commit()
+        if product_model.id not in restored_quantities:
+            restored_products.append(product_model.id)
+        restored_quantities[product_model.id] = restored_quantities.get(product_model.id, 0) + item.quantity
+    if restored_quantities:
+        # i prodotti gia' nel carrello prendono la quantita' dello storico invece di essere duplicati
+        await db.execute(cart_upsert(db.get_bind().dialect.name, [
+            {"product_id": product_id, "quantity": quantity, "owner_id": owner_id, "checked": False}
+            for product_id, quantity in restored_quantities.items()
+        ]))
+    await db.commit()
     return {"restored": restored_products, "updated": updated_products, "missing": missing_products}
 
 @router.delete("/{shopping_history_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_shopping_history(user: user_dependency, db: db_dependency, shopping_history_id: int):
-    shopping_history_model = (db.query(ShoppingHistory).filter(ShoppingHistory.id == shopping_history_id)
-                              .filter(ShoppingHistory.user_id == user.get("id")).first())
+    shopping_history_model = await db.scalar(select(ShoppingHistory).filter(ShoppingHistory.id == shopping_history_id)
+                                             .filter(ShoppingHistory.user_id == user.get("id")))
     if shopping_history_model is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Shopping History not found")
-    db.delete(shopping_history_model)
-    db.commit()
\ No newline at end of file
+    await remove_shopping_stats(db, shopping_history_model)
+    await db.delete(shopping_history_model)
+    await db.commit()
\ No newline at end of file
@@ -1,28 +1,29 @@
 from fastapi import APIRouter, Depends, Path, HTTPException
-from sqlalchemy import func
-from sqlalchemy.orm import Session
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Annotated
 from pydantic import BaseModel, Field
 from starlette import status
 
-from app.database import SessionLocal
+from app.database import AsyncSessionLocal
+from app.catalog import conditional_catalog_get, bump_catalog_version, remove_product_references
+from app.product_matching import remove_product_matches
 from app.routers.auth import get_current_user
 from app.models import Supermarkets, Products
+from app.schemas import ProductResponse, SupermarketResponse
 
 router = APIRouter(
     prefix="/supermarket",
     tags=["supermarket"]
 )
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
 user_dependency = Annotated[dict, Depends(get_current_user)]
+catalog_etag = conditional_catalog_get(get_db)
 
 class SupermarketRequest(BaseModel):
     name: str = Field(min_length=2, max_length=15)
@@ -34,54 +35,64 @@ class SupermarketUpdate(BaseModel):
     image: str | None = None
     location: str | None = None
 
-@router.get("", status_code=status.HTTP_200_OK)
+@router.get("", response_model=list[SupermarketResponse], status_code=status.HTTP_200_OK, dependencies=[Depends(catalog_etag)])
 async def get_supermarkets(user: user_dependency, db: db_dependency):
-    return db.query(Supermarkets).all()
+    return (await db.scalars(select(Supermarkets))).all()
 
-@router.get("/{supermarket_id}/products", status_code=status.HTTP_200_OK)
+@router.get("/{supermarket_id}/products", response_model=list[ProductResponse], status_code=status.HTTP_200_OK, dependencies=[Depends(catalog_etag)])
 async def get_supermarket_products(user: user_dependency, db: db_dependency, supermarket_id: int = Path(gt=0)):
-    supermarket_model = db.query(Supermarkets).filter(Supermarkets.id == supermarket_id).first()
+    supermarket_model = await db.scalar(select(Supermarkets).filter(Supermarkets.id == supermarket_id))
     if supermarket_model is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Supermarket not found")
-    return (db.query(Products).filter(Products.supermarket_id == supermarket_id)
-            .order_by(Products.aisle_order).all())
+    return (await db.scalars(select(Products).filter(Products.supermarket_id == supermarket_id)
+                             .order_by(Products.aisle_order))).all()
 
-@router.get("/{supermarket_id}", status_code=status.HTTP_200_OK)
+@router.get("/{supermarket_id}", response_model=SupermarketResponse, status_code=status.HTTP_200_OK)
 async def get_supermarket_by_id(user: user_dependency, db: db_dependency, supermarket_id: int=Path(gt=0)):
-    supermarket_model = db.query(Supermarkets).filter(Supermarkets.id == supermarket_id).first()
+    supermarket_model = await db.scalar(select(Supermarkets).filter(Supermarkets.id == supermarket_id))
     if supermarket_model is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Supermarket not found")
     return supermarket_model
 
-@router.post("", status_code=status.HTTP_201_CREATED)
+@router.post("", response_model=SupermarketResponse, status_code=status.HTTP_201_CREATED)
 async def create_supermarket(user: user_dependency, db: db_dependency, request: SupermarketRequest):
     normalized_name = request.name.strip().lower()
-    existing = db.query(Supermarkets).filter(func.lower(Supermarkets.name) == normalized_name).first()
+    existing = await db.scalar(select(Supermarkets).filter(func.lower(Supermarkets.name) == normalized_name))
     if existing:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail="Supermarket with this name already exists")
     data = request.model_dump()
     data['name'] = normalized_name.capitalize()
-    supermarket_model = Supermarkets(**data)
+    supermarket_model = Supermarkets(**data, version=await bump_catalog_version(db))
     db.add(supermarket_model)
-    db.commit()
-    db.refresh(supermarket_model)
+    await db.commit()
+    await db.refresh(supermarket_model)
     return supermarket_model
 
 @router.put("/{supermarket_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def update_supermarket(user: user_dependency, db: db_dependency, supermarket_id: int, request: SupermarketUpdate):
-    supermarket_model = db.query(Supermarkets).filter(Supermarkets.id == supermarket_id).first()
+    supermarket_model = await db.scalar(select(Supermarkets).filter(Supermarkets.id == supermarket_id))
     if supermarket_model is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Supermarket not found")
     update_data = request.model_dump(exclude_unset=True)
     for key, value in update_data.items():
         setattr(supermarket_model, key, value)
-    db.commit()
+    supermarket_model.version = await bump_catalog_version(db)
+    await db.commit()
 
 @router.delete("/{supermarket_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_supermarket(user: user_dependency, db: db_dependency, supermarket_id: int):
-    supermarket_model = db.query(Supermarkets).filter(Supermarkets.id == supermarket_id).first()
+    supermarket_model = await db.scalar(select(Supermarkets).filter(Supermarkets.id == supermarket_id))
     if supermarket_model is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Supermarket not found")
-    db.delete(supermarket_model)
-    db.commit()
\ No newline at end of file
+    version = await bump_catalog_version(db)
+    # i prodotti del supermercato diventano tombstone insieme a lui
+    await db.execute(update(Products).filter(Products.supermarket_id == supermarket_id)
+                     .filter(Products.deleted_at.is_(None))
+                     .values(deleted_at=func.now(), version=version))
+    supermarket_products = select(Products.id).filter(Products.supermarket_id == supermarket_id)
+    await remove_product_references(db, supermarket_products)
+    await remove_product_matches(db, supermarket_products)
+    supermarket_model.deleted_at = func.now()
+    supermarket_model.version = version
+    await db.commit()
\ No newline at end of file
@@ -1,30 +1,29 @@
 from fastapi import APIRouter, Depends, Path, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Annotated
 from pydantic import BaseModel, Field
 from starlette import status
 
-from app.database import SessionLocal
+from app.database import AsyncSessionLocal
 from app.routers.auth import get_current_user
 from app.models import Users
+from app.schemas import UserResponse
 
 router = APIRouter(
     prefix="/user",
     tags=["user"]
 )
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
 user_dependency = Annotated[dict, Depends(get_current_user)]
 
-@router.get("", status_code=status.HTTP_200_OK)
-def get_user(user: user_dependency, db: db_dependency):
+@router.get("", response_model=UserResponse, status_code=status.HTTP_200_OK)
+async def get_user(user: user_dependency, db: db_dependency):
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authorized")
-    return db.query(Users).filter(Users.id == user.get('id')).first()
\ No newline at end of file
+    return await db.scalar(select(Users).filter(Users.id == user.get('id')))
\ No newline at end of file
@@ -0,0 +1,257 @@
+from typing import Optional
+
+import orjson
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, ConfigDict
+
+
+class ORJSONResponse(JSONResponse):
+    # usata per le risposte senza response_model (dict costruiti a mano): quelle con
+    # response_model vengono gia' serializzate da pydantic direttamente in bytes
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+class ORMModel(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+
+class UserResponse(ORMModel):
+    id: int
+    email: Optional[str] = None
+    username: Optional[str] = None
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    is_active: Optional[bool] = None
+    role: Optional[str] = None
+
+
+class SupermarketResponse(ORMModel):
+    id: int
+    name: Optional[str] = None
+    image: Optional[str] = None
+    location: Optional[str] = None
+
+
+class ProductResponse(ORMModel):
+    id: int
+    name: Optional[str] = None
+    category: Optional[str] = None
+    original_price: Optional[float] = None
+    discounted_price: Optional[float] = None
+    unit: Optional[str] = None
+    supermarket_id: Optional[int] = None
+    aisle_order: Optional[float] = None
+    image: Optional[str] = None
+    calories: Optional[float] = None
+    fat: Optional[float] = None
+    carbs: Optional[float] = None
+    protein: Optional[float] = None
+    location: Optional[str] = None
+
+
+class ProductEquivalent(BaseModel):
+    score: float
+    product: ProductResponse
+
+
+class ProductPage(BaseModel):
+    items: list[ProductResponse]
+    next_cursor: Optional[int] = None
+
+
+class ProductSearchPage(BaseModel):
+    items: list[ProductResponse]
+    next_offset: Optional[int] = None
+
+
+class PricePoint(BaseModel):
+    t: int
+    min_cents: Optional[int] = None
+    max_cents: Optional[int] = None
+    avg_cents: Optional[int] = None
+    samples: int
+
+
+class PriceHistory(BaseModel):
+    product_id: int
+    start: int
+    end: int
+    bucket_seconds: int
+    points: list[PricePoint]
+
+
+class CatalogChanges(BaseModel):
+    products: list[ProductResponse]
+    supermarkets: list[SupermarketResponse]
+    deleted_products: list[int]
+    deleted_supermarkets: list[int]
+    token: int
+
+
+class ImportRowError(BaseModel):
+    row: int
+    errors: list[str]
+
+
+class ProductImportReport(BaseModel):
+    inserted: int
+    updated: int
+    failed: int
+    errors: list[ImportRowError]
+
+
+class CartResponse(ORMModel):
+    id: int
+    product_id: Optional[int] = None
+    quantity: Optional[int] = None
+    owner_id: Optional[int] = None
+    checked: Optional[bool] = None
+
+
+class BasketItem(BaseModel):
+    cart_id: int
+    product_id: int
+    name: Optional[str] = None
+    unit: Optional[str] = None
+    quantity: int
+    price: float
+    total: float
+
+
+class BasketStore(BaseModel):
+    supermarket_id: int
+    supermarket_name: Optional[str] = None
+    total: float
+    items: list[BasketItem]
+
+
+class BasketPlan(BaseModel):
+    max_stores: int
+    total: float
+    current_total: float
+    savings: float
+    stores: list[BasketStore]
+    unavailable: list[int]
+
+
+class ShoppingRouteItem(BaseModel):
+    id: int
+    product_id: int
+    quantity: int
+    checked: Optional[bool] = None
+    price: Optional[float] = None
+    subtotal: float
+    product: ProductResponse
+
+
+class ShoppingRouteGroup(BaseModel):
+    supermarket_id: Optional[int] = None
+    supermarket: Optional[SupermarketResponse] = None
+    total: float
+    remaining: float
+    items: list[ShoppingRouteItem]
+
+
+class RecipeCartResponse(BaseModel):
+    cart: list[CartResponse]
+    missing: list[int]
+
+
+class RecipeSupermarketSummary(BaseModel):
+    supermarket_id: Optional[int] = None
+    items: int
+    cost: float
+
+
+class RecipeSummary(BaseModel):
+    recipe_id: int
+    items: int
+    unavailable: int
+    total_cost: float
+    calories: float
+    fat: float
+    carbs: float
+    protein: float
+    supermarkets: list[RecipeSupermarketSummary]
+
+
+class RecipeResponse(ORMModel):
+    id: int
+    name: Optional[str] = None
+    image: Optional[str] = None
+    owner_id: Optional[int] = None
+
+
+class RecipeItemResponse(ORMModel):
+    id: int
+    recipe_id: Optional[int] = None
+    product_id: Optional[int] = None
+    quantity: Optional[int] = None
+
+
+class ShoppingHistoryResponse(ORMModel):
+    id: int
+    user_id: int
+    created_at: str
+    total_price: float
+    total_items: int
+
+
+class ShoppingHistoryItemResponse(ORMModel):
+    id: int
+    history_id: int
+    product_id: Optional[int] = None
+    name: str
+    image: Optional[str] = None
+    unit: Optional[str] = None
+    price_paid: float
+    was_discounted: Optional[bool] = None
+    quantity: Optional[int] = None
+    category: Optional[str] = None
+    aisle_order: Optional[float] = None
+    supermarket_id: Optional[int] = None
+    supermarket_name: Optional[str] = None
+    calories: Optional[float] = None
+    fat: Optional[float] = None
+    carbs: Optional[float] = None
+    protein: Optional[float] = None
+
+
+class SupermarketProductCount(BaseModel):
+    supermarket_id: Optional[int] = None
+    total: int
+    discounted: int
+
+
+class ProductSummary(BaseModel):
+    total: int
+    discounted: int
+    by_supermarket: list[SupermarketProductCount]
+
+
+class DashboardResponse(BaseModel):
+    user: UserResponse
+    supermarkets: list[SupermarketResponse]
+    recipes: list[RecipeResponse]
+    product_summary: ProductSummary
+    deals: list[ProductResponse]
+
+
+class SpendingBucket(BaseModel):
+    key: Optional[str] = None
+    label: Optional[str] = None
+    total_spent: float
+    total_items: int
+    savings: float
+    trips: int
+
+
+class ShoppingStatsResponse(BaseModel):
+    total_spent: float
+    total_items: int
+    savings: float
+    trips: int
+    by_month: list[SpendingBucket]
+    by_category: list[SpendingBucket]
+    by_supermarket: list[SpendingBucket]
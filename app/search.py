@@ -0,0 +1,133 @@
+import re
+
+from sqlalchemy import event, false, func, literal_column, or_, select, table, column, text
+
+from app.models import Products
+
+# SQLite: tabella FTS5 "external content" sincronizzata con products tramite trigger.
+# remove_diacritics permette di trovare "caffè" cercando "caffe".
+SQLITE_SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, content='products', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, name) VALUES (new.id, new.name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO products_fts(rowid, name) VALUES (new.id, new.name);
+    END""",
+    "INSERT INTO products_fts(products_fts) VALUES ('rebuild')",
+]
+
+SQLITE_DROP_SEARCH_DDL = [
+    "DROP TRIGGER IF EXISTS products_fts_au",
+    "DROP TRIGGER IF EXISTS products_fts_ad",
+    "DROP TRIGGER IF EXISTS products_fts_ai",
+    "DROP TABLE IF EXISTS products_fts",
+]
+
+# Postgres: unaccent non e' IMMUTABLE, quindi serve un wrapper per poterlo usare negli indici.
+POSTGRES_SEARCH_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    """CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+        AS $$ SELECT public.unaccent('public.unaccent', $1) $$""",
+    """CREATE INDEX IF NOT EXISTS ix_products_name_trgm ON products
+        USING gin (f_unaccent(lower(name)) gin_trgm_ops)""",
+    """CREATE INDEX IF NOT EXISTS ix_products_name_tsv ON products
+        USING gin (to_tsvector('italian', f_unaccent(name)))""",
+]
+
+POSTGRES_DROP_SEARCH_DDL = [
+    "DROP INDEX IF EXISTS ix_products_name_tsv",
+    "DROP INDEX IF EXISTS ix_products_name_trgm",
+    "DROP FUNCTION IF EXISTS f_unaccent(text)",
+]
+
+products_fts = table("products_fts", column("rowid"), column("rank"))
+
+
+def install_product_search(connection):
+    if connection.dialect.name == "sqlite":
+        statements = SQLITE_SEARCH_DDL
+    elif connection.dialect.name == "postgresql":
+        statements = POSTGRES_SEARCH_DDL
+    else:
+        return
+    for statement in statements:
+        connection.execute(text(statement))
+
+
+def uninstall_product_search(connection):
+    if connection.dialect.name == "sqlite":
+        statements = SQLITE_DROP_SEARCH_DDL
+    elif connection.dialect.name == "postgresql":
+        statements = POSTGRES_DROP_SEARCH_DDL
+    else:
+        return
+    for statement in statements:
+        connection.execute(text(statement))
+
+
+@event.listens_for(Products.__table__, "after_create")
+def _create_product_search(target, connection, **kw):
+    install_product_search(connection)
+
+
+def _fts_query(search):
+    # ogni parola diventa un prefisso tra virgolette, cosi' l'input dell'utente non viene
+    # interpretato come sintassi FTS5 e "Garl" trova "Garlic"
+    tokens = re.findall(r"\w+", search)
+    return " ".join(f'"{token}"*' for token in tokens)
+
+
+def _pg_name():
+    return func.f_unaccent(func.lower(Products.name))
+
+
+def _pg_tsvector():
+    return func.to_tsvector(literal_column("'italian'"), func.f_unaccent(Products.name))
+
+
+def _pg_tsquery(search):
+    return func.plainto_tsquery(literal_column("'italian'"), func.f_unaccent(search))
+
+
+def _like_pattern(search):
+    escaped = search.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def product_search_filter(dialect_name, search):
+    if dialect_name == "sqlite":
+        fts_query = _fts_query(search)
+        if not fts_query:
+            return false()
+        return Products.id.in_(select(products_fts.c.rowid)
+                               .filter(literal_column("products_fts").op("MATCH")(fts_query)))
+    if dialect_name == "postgresql":
+        return or_(_pg_name().like(func.f_unaccent(_like_pattern(search)), escape="\\"),
+                   _pg_tsvector().op("@@")(_pg_tsquery(search)))
+    return Products.name.ilike(f"%{search}%")
+
+
+def search_products_query(dialect_name, search):
+    if dialect_name == "sqlite":
+        fts_query = _fts_query(search)
+        if not fts_query:
+            return select(Products).filter(false())
+        return (select(Products).join(products_fts, products_fts.c.rowid == Products.id)
+                .filter(literal_column("products_fts").op("MATCH")(fts_query))
+                .order_by(products_fts.c.rank, Products.id))
+    if dialect_name == "postgresql":
+        return (select(Products).filter(product_search_filter(dialect_name, search))
+                .order_by(func.similarity(_pg_name(), func.f_unaccent(search.lower())).desc(),
+                          func.ts_rank(_pg_tsvector(), _pg_tsquery(search)).desc(),
+                          Products.id))
+    return (select(Products).filter(product_search_filter(dialect_name, search))
+            .order_by(Products.name, Products.id))
@@ -0,0 +1,70 @@
+from sqlalchemy import String, cast, delete, func, insert, literal, null, select, union_all
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import ShoppingHistory, ShoppingHistoryItem, ShoppingStats
+
+# riepilogo per utente aggiornato a ogni spesa: le statistiche leggono poche righe
+# (una per mese, categoria e supermercato) invece di tutto lo storico
+STATS_COLUMNS = ("user_id", "dimension", "key", "label", "total_spent", "total_items", "savings", "trips")
+
+
+def _stats_select(dialect_name: str, history_filter=None, sign: int = 1):
+    # aggregati per utente e chiave di ogni dimensione, in una sola SELECT (UNION ALL).
+    # La stessa query serve alla ricostruzione completa e agli aggiornamenti di una singola spesa
+    greatest = func.greatest if dialect_name == "postgresql" else func.max
+    quantity = func.coalesce(ShoppingHistoryItem.quantity, 0)
+    original_price = func.coalesce(ShoppingHistoryItem.original_price, ShoppingHistoryItem.price_paid)
+    totals = (sign * func.sum(ShoppingHistoryItem.price_paid * quantity),
+              sign * func.sum(quantity),
+              sign * func.sum(greatest(original_price - ShoppingHistoryItem.price_paid, 0) * quantity),
+              sign * func.count(ShoppingHistory.id.distinct()))
+    dimensions = (
+        ("month", func.substr(ShoppingHistory.created_at, 1, 7), cast(null(), String)),
+        ("category", func.coalesce(ShoppingHistoryItem.category, ""), cast(null(), String)),
+        ("supermarket", func.coalesce(cast(ShoppingHistoryItem.supermarket_id, String), ""),
+         func.max(ShoppingHistoryItem.supermarket_name)),
+    )
+    selects = []
+    for dimension, key, label in dimensions:
+        dimension_select = (select(ShoppingHistory.user_id, literal(dimension), key, label, *totals)
+                            .join(ShoppingHistoryItem, ShoppingHistoryItem.history_id == ShoppingHistory.id))
+        if history_filter is not None:
+            dimension_select = dimension_select.filter(history_filter)
+        selects.append(dimension_select.group_by(ShoppingHistory.user_id, key))
+    return union_all(*selects)
+
+
+def _stats_upsert(dialect_name: str, history_id: int, sign: int):
+    if dialect_name == "postgresql":
+        stmt = postgresql_insert(ShoppingStats)
+    else:
+        stmt = sqlite_insert(ShoppingStats)
+    stmt = stmt.from_select(STATS_COLUMNS, _stats_select(dialect_name, ShoppingHistory.id == history_id, sign))
+    return stmt.on_conflict_do_update(
+        index_elements=[ShoppingStats.user_id, ShoppingStats.dimension, ShoppingStats.key],
+        set_={
+            "label": func.coalesce(stmt.excluded.label, ShoppingStats.label),
+            "total_spent": ShoppingStats.total_spent + stmt.excluded.total_spent,
+            "total_items": ShoppingStats.total_items + stmt.excluded.total_items,
+            "savings": ShoppingStats.savings + stmt.excluded.savings,
+            "trips": ShoppingStats.trips + stmt.excluded.trips,
+        })
+
+
+async def add_shopping_stats(db: AsyncSession, history_id: int):
+    # dopo l'inserimento delle righe della spesa, nella stessa transazione
+    await db.execute(_stats_upsert(db.get_bind().dialect.name, history_id, 1))
+
+
+async def remove_shopping_stats(db: AsyncSession, history: ShoppingHistory):
+    # prima di eliminare le righe della spesa: la stessa aggregazione con il segno opposto
+    await db.execute(_stats_upsert(db.get_bind().dialect.name, history.id, -1))
+    await db.execute(delete(ShoppingStats).filter(ShoppingStats.user_id == history.user_id)
+                     .filter(ShoppingStats.trips <= 0))
+
+
+def rebuild_shopping_stats_statements(dialect_name: str) -> list:
+    # ricostruzione completa con GROUP BY sullo storico: usata per popolare la tabella di riepilogo
+    return [delete(ShoppingStats), insert(ShoppingStats).from_select(STATS_COLUMNS, _stats_select(dialect_name))]
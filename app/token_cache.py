@@ -0,0 +1,131 @@
+import calendar
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import RevokedToken
+
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 10000))
+TOKEN_REVOCATION_SYNC = float(os.getenv("TOKEN_REVOCATION_SYNC", 5))
+# margine sulla lettura incrementale: una revoca salvata da una transazione ancora aperta al momento
+# della sincronizzazione precedente viene riletta alla successiva
+REVOCATION_SYNC_OVERLAP = timedelta(minutes=1)
+
+
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+# LRU dei claim gia' verificati, indicizzato per digest del token. Le voci scadono insieme
+# al token (claim exp). Le revoche restano finche' il token non scade e non vengono mai scartate
+# per far posto ad altre; la tabella revoked_tokens le propaga agli altri worker (sync_revocations).
+class TokenCache:
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._revoked = {}
+        self._purge_at = maxsize
+        self._lock = threading.Lock()
+        self._synced_at = None
+        self._next_sync = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, digest: str):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self.misses += 1
+                return None
+            claims, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[digest]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return dict(claims)
+
+    def put(self, digest: str, claims: dict, expires_at: float | None):
+        with self._lock:
+            if digest in self._revoked:
+                return
+            self._entries[digest] = (dict(claims), expires_at)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def revoke(self, digest: str, expires_at: float | None):
+        with self._lock:
+            self._entries.pop(digest, None)
+            self._revoked[digest] = expires_at
+            # i token gia' scaduti vengono rifiutati da jwt.decode, non serve ricordarli. La pulizia
+            # scorre tutte le revoche, quindi si fa solo quando sono raddoppiate dall'ultima volta
+            if len(self._revoked) > self._purge_at:
+                now = time.time()
+                for revoked_digest, revoked_expires_at in list(self._revoked.items()):
+                    if revoked_expires_at is not None and revoked_expires_at <= now:
+                        del self._revoked[revoked_digest]
+                self._purge_at = max(self.maxsize, 2 * len(self._revoked))
+
+    def is_revoked(self, digest: str) -> bool:
+        with self._lock:
+            return digest in self._revoked
+
+    def sync_since(self):
+        # None se la sincronizzazione non e' ancora dovuta, altrimenti da quando rileggere le revoche.
+        # La prossima viene prenotata subito: le richieste concorrenti non ripetono la query
+        with self._lock:
+            now = time.monotonic()
+            if now < self._next_sync:
+                return None
+            self._next_sync = now + TOKEN_REVOCATION_SYNC
+            return self._synced_at - REVOCATION_SYNC_OVERLAP if self._synced_at else datetime.min
+
+    def synced(self, synced_at: datetime):
+        with self._lock:
+            self._synced_at = synced_at
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._revoked.clear()
+            self._purge_at = self.maxsize
+            self._synced_at = None
+            self._next_sync = 0.0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "size": len(self._entries), "revoked": len(self._revoked), "maxsize": self.maxsize}
+
+
+token_cache = TokenCache()
+
+
+def token_expiry(expires_at: datetime | None) -> float | None:
+    return calendar.timegm(expires_at.utctimetuple()) if expires_at else None
+
+
+async def sync_revocations(db: AsyncSession) -> None:
+    # al massimo una query ogni TOKEN_REVOCATION_SYNC secondi per worker: i logout fatti su un altro
+    # worker valgono anche qui entro quell'intervallo
+    since = token_cache.sync_since()
+    if since is None:
+        return
+    synced_at = datetime.utcnow()
+    rows = await db.execute(select(RevokedToken.digest, RevokedToken.expires_at)
+                            .filter(RevokedToken.revoked_at >= since)
+                            .filter(RevokedToken.expires_at.is_(None) | (RevokedToken.expires_at > synced_at)))
+    for digest, expires_at in rows:
+        token_cache.revoke(digest, token_expiry(expires_at))
+    token_cache.synced(synced_at)
@@ -0,0 +1,54 @@
+"""Confronto tra due report di benchmarks.load: segnala gli endpoint piu' lenti oltre la soglia.
+
+    python -m benchmarks.compare base.json new.json [--threshold 0.2] [--metric p95_ms]
+
+Esce con codice 1 se c'e' almeno una regressione, per poterlo usare in CI.
+"""
+import argparse
+import json
+import sys
+
+# differenze sotto questa soglia assoluta sono rumore di misura
+MIN_DELTA_MS = 1.0
+
+
+def compare(base, new, metric="p95_ms", threshold=0.2):
+    rows = []
+    for name, result in new["endpoints"].items():
+        previous = base["endpoints"].get(name)
+        if previous is None:
+            rows.append((name, None, result[metric], None, "new"))
+            continue
+        delta = result[metric] - previous[metric]
+        ratio = delta / previous[metric] if previous[metric] else 0.0
+        regressed = ratio > threshold and delta > MIN_DELTA_MS
+        if result["errors"] > previous["errors"]:
+            regressed = True
+        rows.append((name, previous[metric], result[metric], ratio, "REGRESSION" if regressed else ""))
+    for name in base["endpoints"].keys() - new["endpoints"].keys():
+        rows.append((name, base["endpoints"][name][metric], None, None, "missing"))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--metric", default="p95_ms", choices=["p50_ms", "p95_ms", "p99_ms", "mean_ms"])
+    parser.add_argument("--threshold", type=float, default=0.2, help="aumento relativo tollerato (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    with open(args.base) as base_file, open(args.new) as new_file:
+        base, new = json.load(base_file), json.load(new_file)
+    print(f"{args.metric}: {base['meta'].get('commit')} -> {new['meta'].get('commit')}")
+    rows = compare(base, new, args.metric, args.threshold)
+    for name, before, after, ratio, flag in rows:
+        before_text = "-" if before is None else f"{before:.2f}"
+        after_text = "-" if after is None else f"{after:.2f}"
+        ratio_text = "" if ratio is None else f"{ratio:+.0%}"
+        print(f"{name:45} {before_text:>10} {after_text:>10} {ratio_text:>7}  {flag}")
+    sys.exit(1 if any(flag == "REGRESSION" for *_, flag in rows) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""Benchmark di carico delle API: latenza p50/p95/p99 e throughput per ogni endpoint.
+
+L'app gira nello stesso processo (httpx.ASGITransport) su un database SQLite temporaneo
+popolato da benchmarks.seed con un seed fisso. Il report JSON si confronta con
+benchmarks.compare per trovare le regressioni tra due commit.
+
+    pip install -r requirements-dev.txt
+    python -m benchmarks.load --output report.json [--requests 200] [--concurrency 8] [--seed 42]
+"""
+import argparse
+import asyncio
+import contextlib
+import csv
+import io
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+
+def percentile(samples, p):
+    # nearest-rank su campioni gia' ordinati
+    return samples[max(math.ceil(p / 100 * len(samples)) - 1, 0)]
+
+
+def scenarios(fixture):
+    # (nome, metodo, funzione che dato utente e rng restituisce path e corpo, frazione delle richieste)
+    products = fixture["products"]
+    supermarkets = fixture["supermarkets"]
+    owned = fixture["users"]
+    # prodotti non ancora nel carrello di ogni utente: POST /cart non incontra duplicati
+    not_in_cart = {user_id: iter(random.Random(user_id).sample(
+        sorted(set(range(1, products + 1)) - set(data["cart_products"])), products - len(data["cart_products"])))
+        for user_id, data in owned.items()}
+    return [
+        ("GET /user", "GET", lambda user_id, rng: ("/user", None), 1),
+        ("GET /dashboard", "GET", lambda user_id, rng: ("/dashboard", None), 1),
+        ("GET /product", "GET", lambda user_id, rng: ("/product", None), 0.1),
+        ("GET /product?limit=100", "GET",
+         lambda user_id, rng: (f"/product?limit=100&cursor={rng.randint(1, products)}", None), 1),
+        ("GET /product?format=ndjson", "GET",
+         lambda user_id, rng: (f"/product?format=ndjson&supermarket_id={rng.randint(1, supermarkets)}", None), 1),
+        ("GET /product/search", "GET", lambda user_id, rng: (f"/product/search?q={rng.choice(SEARCH_TERMS)}", None), 1),
+        ("GET /product/{id}", "GET", lambda user_id, rng: (f"/product/{rng.randint(1, products)}", None), 1),
+        ("GET /product/{id}/prices", "GET",
+         lambda user_id, rng: (f"/product/{rng.randint(1, products)}/prices?points=100", None), 1),
+        ("GET /product/supermarket/{id}", "GET",
+         lambda user_id, rng: (f"/product/supermarket/{rng.randint(1, supermarkets)}", None), 1),
+        ("GET /product/{id}/equivalents", "GET",
+         lambda user_id, rng: (f"/product/{rng.randint(1, products)}/equivalents", None), 1),
+        ("GET /product/export", "GET",
+         lambda user_id, rng: (f"/product/export?supermarket_id={rng.randint(1, supermarkets)}", None), 1),
+        ("GET /product/changes", "GET", lambda user_id, rng: ("/product/changes?since=1", None), 1),
+        ("GET /supermarket", "GET", lambda user_id, rng: ("/supermarket", None), 1),
+        ("GET /supermarket/{id}", "GET", lambda user_id, rng: (f"/supermarket/{rng.randint(1, supermarkets)}", None), 1),
+        ("GET /supermarket/{id}/products", "GET",
+         lambda user_id, rng: (f"/supermarket/{rng.randint(1, supermarkets)}/products", None), 1),
+        ("GET /favorite", "GET", lambda user_id, rng: ("/favorite", None), 1),
+        ("GET /recipe", "GET", lambda user_id, rng: (f"/recipe?owner_id={user_id}", None), 1),
+        ("GET /recipe/{id}", "GET", lambda user_id, rng: (f"/recipe/{rng.choice(owned[user_id]['recipes'])}", None), 1),
+        ("GET /recipe-item", "GET",
+         lambda user_id, rng: (f"/recipe-item?recipe_id={rng.choice(owned[user_id]['recipes'])}", None), 1),
+        ("GET /recipe/summary", "GET", lambda user_id, rng: ("/recipe/summary", None), 1),
+        ("GET /recipe/{id}/summary", "GET",
+         lambda user_id, rng: (f"/recipe/{rng.choice(owned[user_id]['recipes'])}/summary", None), 1),
+        ("GET /cart", "GET", lambda user_id, rng: ("/cart", None), 1),
+        ("GET /cart/optimize", "GET", lambda user_id, rng: (f"/cart/optimize?max_stores={rng.randint(1, 3)}", None), 1),
+        ("GET /cart/route", "GET", lambda user_id, rng: ("/cart/route", None), 1),
+        ("GET /cart/{id}", "GET", lambda user_id, rng: (f"/cart/{rng.choice(owned[user_id]['cart'])}", None), 1),
+        ("PUT /cart/{id}", "PUT", lambda user_id, rng: (f"/cart/{rng.choice(owned[user_id]['cart'])}",
+                                                        {"quantity": rng.randint(1, 5)}), 1),
+        ("PATCH /cart", "PATCH", lambda user_id, rng: ("/cart", [{"id": cart_id, "checked": rng.random() < 0.5}
+                                                                 for cart_id in owned[user_id]["cart"]]), 1),
+        # prima di restore-cart, che riporta nel carrello prodotti qualsiasi dello storico
+        ("POST /cart", "POST", lambda user_id, rng: ("/cart", {"product_id": next(not_in_cart[user_id]),
+                                                                "quantity": rng.randint(1, 5)}), 1),
+        ("GET /shopping-history", "GET", lambda user_id, rng: ("/shopping-history", None), 1),
+        ("GET /shopping-history/{id}/items", "GET",
+         lambda user_id, rng: (f"/shopping-history/{rng.choice(owned[user_id]['history'])}/items", None), 1),
+        ("GET /shopping-history/stats", "GET", lambda user_id, rng: ("/shopping-history/stats", None), 1),
+        ("GET /shopping-history/export", "GET", lambda user_id, rng: ("/shopping-history/export", None), 1),
+        ("GET /metrics", "GET", lambda user_id, rng: ("/metrics", None), 1),
+        ("POST /shopping-history/{id}/restore-cart", "POST",
+         lambda user_id, rng: (f"/shopping-history/{rng.choice(owned[user_id]['history'])}/restore-cart", None), 0.25),
+        # le altre scritture in fondo: le letture misurano il database appena generato
+        ("POST /recipe/{id}/add-to-cart", "POST",
+         lambda user_id, rng: (f"/recipe/{rng.choice(owned[user_id]['recipes'])}/add-to-cart", None), 1),
+        ("POST /cart/finalize", "FINALIZE",
+         lambda user_id, rng: ("/cart/finalize", {"recipe_id": rng.choice(owned[user_id]["recipes"])}), 0.25),
+        ("POST /product/import", "IMPORT",
+         lambda user_id, rng: ("/product/import", import_csv(rng, supermarkets, IMPORT_ROWS)), 0.1),
+        # bcrypt domina: poche richieste bastano
+        ("POST /auth/token", "LOGIN", lambda user_id, rng: ("/auth/token", None), 0.1),
+    ]
+
+
+SEARCH_TERMS = ["pomodoro", "caffe", "mozz", "pasta riso", "latte", "pane"]
+IMPORT_ROWS = 500
+
+
+def import_csv(rng, supermarkets, rows):
+    from benchmarks.seed import CATEGORIES, UNITS, WORDS
+
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["name", "category", "original_price", "unit", "supermarket_id", "aisle_order"])
+    for _ in range(rows):
+        writer.writerow([" ".join(rng.sample(WORDS, 2)).capitalize(), rng.choice(CATEGORIES),
+                         round(rng.uniform(0.5, 20), 2), rng.choice(UNITS), rng.randint(1, supermarkets),
+                         rng.randint(1, 30)])
+    return output.getvalue()
+
+
+async def run_scenario(client, tokens, method, make_request, count, concurrency, rng, warmup):
+    from benchmarks.seed import BENCHMARK_PASSWORD
+
+    user_ids = sorted(tokens)
+    planned = [(user_id, *make_request(user_id, rng)) for user_id in (rng.choice(user_ids)
+                                                                        for _ in range(count + warmup))]
+
+    async def send(user_id, path, body):
+        headers = {"Authorization": f"Bearer {tokens[user_id]}"}
+        if method == "LOGIN":
+            return await client.post(path, data={"username": f"user{user_id}", "password": BENCHMARK_PASSWORD})
+        if method == "IMPORT":
+            return await client.post(path, files={"file": ("catalog.csv", body, "text/csv")}, headers=headers)
+        if method == "FINALIZE":
+            return await client.post(path, headers=headers)
+        return await client.request(method, path, json=body, headers=headers)
+
+    async def prepare(user_id, path, body):
+        # fuori dalla misura: il carrello da finalizzare si riempie con una ricetta e si spunta tutto
+        if method != "FINALIZE":
+            return
+        headers = {"Authorization": f"Bearer {tokens[user_id]}"}
+        response = await client.post(f"/recipe/{body['recipe_id']}/add-to-cart", headers=headers)
+        await client.patch("/cart", json=[{"id": item["id"], "checked": True} for item in response.json()["cart"]],
+                           headers=headers)
+
+    # le richieste dello stesso utente che cambiano il carrello non si sovrappongono
+    user_locks = defaultdict(asyncio.Lock)
+
+    for request in planned[:warmup]:
+        await prepare(*request)
+        await send(*request)
+
+    pending = iter(planned[warmup:])
+    latencies = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        for request in pending:
+            async with user_locks[request[0]] if method == "FINALIZE" else contextlib.nullcontext():
+                await prepare(*request)
+                start = time.perf_counter()
+                response = await send(*request)
+                latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+    }
+
+
+async def run(args, fixture):
+    import httpx
+
+    from app import passwords
+    from app.database import AsyncSessionLocal
+    from app.main import app
+    from app.product_matching import rebuild_product_matches
+    from app.routers.auth import create_access_token
+
+    # l'indice di equivalenza si mantiene in background dopo le scritture: qui si costruisce una volta
+    async with AsyncSessionLocal() as db:
+        print(f"product matches: {await rebuild_product_matches(db)} pairs")
+
+    tokens = {user_id: create_access_token(f"user{user_id}", user_id, "user", timedelta(hours=2))
+              for user_id in fixture["users"]}
+    rng = random.Random(args.seed)
+    results = {}
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark") as client:
+            for name, method, make_request, share in scenarios(fixture):
+                if args.only and not any(pattern in name for pattern in args.only):
+                    continue
+                count = max(int(args.requests * share), args.concurrency)
+                results[name] = await run_scenario(client, tokens, method, make_request, count,
+                                                   args.concurrency, rng, args.warmup)
+                print(f"{name:45} p50 {results[name]['p50_ms']:8.2f} ms  p95 {results[name]['p95_ms']:8.2f} ms  "
+                      f"p99 {results[name]['p99_ms']:8.2f} ms  {results[name]['throughput_rps']:8.1f} req/s"
+                      + (f"  errors {results[name]['errors']}" if results[name]["errors"] else ""))
+    finally:
+        passwords.shutdown_executor()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", default="benchmark-report.json")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--supermarkets", type=int, default=10)
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=200, help="richieste misurate per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--only", action="append", help="esegue solo gli endpoint che contengono il testo")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # il database va scelto prima di importare l'app: app.database legge DATABASE_URL all'import
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'benchmark.db')}"
+        from app.database import Base, engine
+        from app import catalog, search  # noqa: F401  registrano le tabelle e i trigger creati da create_all
+        from benchmarks.seed import generate
+
+        Base.metadata.create_all(engine)
+        started = time.perf_counter()
+        fixture = generate(engine, seed=args.seed, supermarkets=args.supermarkets, products=args.products,
+                           users=args.users)
+        print(f"seed: {time.perf_counter() - started:.1f}s")
+        results = asyncio.run(run(args, fixture))
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "supermarkets": args.supermarkets,
+            "products": args.products,
+            "users": args.users,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        },
+        "endpoints": results,
+    }
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+    print(f"report: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
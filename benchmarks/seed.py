@@ -0,0 +1,111 @@
+"""Generatore deterministico di dati sintetici per i benchmark.
+
+Lo stesso seed e le stesse dimensioni producono sempre lo stesso database, cosi' i report
+di commit diversi sono confrontabili.
+"""
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from app.models import (Cart, Favorites, ProductPrice, Products, RecipeItems, Recipes, ShoppingHistory,
+                        ShoppingHistoryItem, Supermarkets, Users)
+from app.passwords import bcrypt_context
+from app.price_history import to_cents
+from app.shopping_stats import rebuild_shopping_stats_statements
+
+CATEGORIES = ["Frutta", "Verdura", "Carne", "Pesce", "Latticini", "Pasta", "Bevande", "Surgelati", "Dolci", "Casa"]
+UNITS = ["pz", "kg", "100g", "l"]
+WORDS = ["pomodoro", "mozzarella", "caffè", "pasta", "riso", "mela", "pera", "latte", "yogurt", "pane",
+         "olio", "tonno", "pollo", "manzo", "biscotti", "acqua", "birra", "zucchina", "melanzana", "basilico"]
+BENCHMARK_PASSWORD = "benchmark"
+
+
+def generate(engine, seed=42, supermarkets=10, products=5000, users=50, cart_items=20, favorites=10,
+             recipes=3, recipe_items=5, trips=20, trip_items=10, price_changes=5):
+    rng = random.Random(seed)
+    now = int(time.time())
+    hashed_password = bcrypt_context.hash(BENCHMARK_PASSWORD)
+
+    supermarket_rows = [{"id": i, "name": f"Supermercato {i}", "location": f"Via Roma {i}, Matera"}
+                        for i in range(1, supermarkets + 1)]
+    product_rows = []
+    for i in range(1, products + 1):
+        original_price = round(rng.uniform(0.3, 25), 2)
+        product_rows.append({
+            "id": i,
+            "name": f"{rng.choice(WORDS)} {rng.choice(WORDS)} {i}",
+            "category": rng.choice(CATEGORIES),
+            "original_price": original_price,
+            "discounted_price": round(original_price * rng.uniform(0.5, 0.95), 2) if rng.random() < 0.2 else None,
+            "unit": rng.choice(UNITS),
+            "supermarket_id": rng.randint(1, supermarkets),
+            "aisle_order": round(rng.uniform(0, 40), 1),
+            "calories": round(rng.uniform(0, 900), 1),
+        })
+    price_rows = []
+    for product in product_rows:
+        recorded_at = now - 730 * 86400
+        for _ in range(price_changes + 1):
+            price_rows.append({"product_id": product["id"], "recorded_at": recorded_at,
+                               "original_cents": to_cents(product["original_price"]),
+                               "discounted_cents": to_cents(product["discounted_price"])})
+            recorded_at += rng.randint(1, 730 * 86400 // (price_changes + 1))
+
+    user_rows, cart_rows, favorite_rows, recipe_rows, recipe_item_rows = [], [], [], [], []
+    history_rows, history_item_rows = [], []
+    fixture = {"users": {}, "supermarkets": supermarkets, "products": products}
+    supermarket_names = {row["id"]: row["name"] for row in supermarket_rows}
+    for user_id in range(1, users + 1):
+        user_rows.append({"id": user_id, "username": f"user{user_id}", "email": f"user{user_id}@example.com",
+                          "first_name": f"Nome{user_id}", "last_name": f"Cognome{user_id}",
+                          "hashed_password": hashed_password, "is_active": True, "role": "user"})
+        owned = {"cart": [], "cart_products": [], "recipes": [], "history": []}
+        for product_id in rng.sample(range(1, products + 1), cart_items):
+            cart_rows.append({"id": len(cart_rows) + 1, "product_id": product_id, "owner_id": user_id,
+                              "quantity": rng.randint(1, 5), "checked": rng.random() < 0.5})
+            owned["cart"].append(len(cart_rows))
+            owned["cart_products"].append(product_id)
+        for product_id in rng.sample(range(1, products + 1), favorites):
+            favorite_rows.append({"product_id": product_id, "owner_id": user_id})
+        for _ in range(recipes):
+            recipe_id = len(recipe_rows) + 1
+            recipe_rows.append({"id": recipe_id, "name": f"Ricetta {recipe_id}", "owner_id": user_id})
+            owned["recipes"].append(recipe_id)
+            for product_id in rng.sample(range(1, products + 1), recipe_items):
+                recipe_item_rows.append({"recipe_id": recipe_id, "product_id": product_id,
+                                         "quantity": rng.randint(1, 3)})
+        for trip in range(trips):
+            history_id = len(history_rows) + 1
+            created_at = (datetime.fromtimestamp(now) - timedelta(days=7 * (trips - trip))).isoformat()
+            items = []
+            for product_id in rng.sample(range(1, products + 1), trip_items):
+                product = product_rows[product_id - 1]
+                items.append({
+                    "history_id": history_id, "product_id": product_id, "name": product["name"],
+                    "unit": product["unit"], "price_paid": product["discounted_price"] or product["original_price"],
+                    "original_price": product["original_price"],
+                    "was_discounted": product["discounted_price"] is not None, "quantity": rng.randint(1, 4),
+                    "category": product["category"], "aisle_order": product["aisle_order"],
+                    "supermarket_id": product["supermarket_id"],
+                    "supermarket_name": supermarket_names[product["supermarket_id"]],
+                })
+            history_rows.append({"id": history_id, "user_id": user_id, "created_at": created_at,
+                                 "total_price": sum(item["price_paid"] * item["quantity"] for item in items),
+                                 "total_items": sum(item["quantity"] for item in items)})
+            history_item_rows.extend(items)
+            owned["history"].append(history_id)
+        fixture["users"][user_id] = owned
+
+    with engine.begin() as connection:
+        for model, rows in ((Supermarkets, supermarket_rows), (Products, product_rows), (ProductPrice, price_rows),
+                            (Users, user_rows), (Cart, cart_rows), (Favorites, favorite_rows),
+                            (Recipes, recipe_rows), (RecipeItems, recipe_item_rows),
+                            (ShoppingHistory, history_rows), (ShoppingHistoryItem, history_item_rows)):
+            if rows:
+                connection.execute(insert(model), rows)
+        # riepilogo calcolato dallo storico con le stesse query dell'applicazione
+        for statement in rebuild_shopping_stats_statements(connection.dialect.name):
+            connection.execute(statement)
+    return fixture
@@ -0,0 +1,62 @@
+"""Costo di serializzazione di 10k prodotti: jsonable_encoder + json contro response model + orjson.
+
+    python -m benchmarks.serialization [--products 10000] [--repeat 5]
+"""
+import argparse
+import json
+import statistics
+import time
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from app.models import Products
+from app.schemas import ProductResponse
+
+
+def build_products(count):
+    return [Products(id=i, name=f"Prodotto {i}", category="Verdura", original_price=1.0 + i % 100 / 10,
+                     discounted_price=None if i % 3 else 0.9, unit="pz", supermarket_id=i % 10 + 1,
+                     aisle_order=float(i % 40), image=None, calories=120.0, fat=1.5, carbs=20.0,
+                     protein=3.0, location=None)
+            for i in range(1, count + 1)]
+
+
+def timed(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    products = build_products(args.products)
+    adapter = TypeAdapter(list[ProductResponse])
+
+    cases = {
+        # quello che faceva FastAPI senza response_model
+        "jsonable_encoder + json.dumps": lambda: json.dumps(jsonable_encoder(products)).encode(),
+        # route tipizzate: pydantic-core valida dagli attributi e scrive direttamente bytes
+        "response_model + dump_json": lambda: adapter.dump_json(
+            adapter.validate_python(products, from_attributes=True)),
+        # route senza response_model (dict costruiti a mano) con ORJSONResponse
+        "model_dump + orjson": lambda: orjson.dumps(
+            adapter.dump_python(adapter.validate_python(products, from_attributes=True))),
+    }
+    baseline = None
+    for name, func in cases.items():
+        seconds = timed(func, args.repeat)
+        baseline = baseline or seconds
+        print(f"{name:32} {seconds * 1000:8.1f} ms  x{baseline / seconds:.1f}")
+
+
+if __name__ == "__main__":
+    main()
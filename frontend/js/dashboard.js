@@ -6,31 +6,18 @@ const token = localStorage.getItem("token");
 if (!token) window.location.href = "index.html";
 async function loadDashboard() {
   try {
-    const [userRes, productsRes, recipesRes, supermarketsRes] = await Promise.all([
-      apiFetch(`${CONFIG.API_BASE_URL}/user`, {
-        headers: { Authorization: "Bearer " + token }
-      }),
-      apiFetch(`${CONFIG.API_BASE_URL}/product`, {
-        headers: { Authorization: "Bearer " + token }
-      }),
-      apiFetch(`${CONFIG.API_BASE_URL}/recipe?owner_id=1`, {
-        headers: { Authorization: "Bearer " + token }
-      }),
-       apiFetch(`${CONFIG.API_BASE_URL}/supermarket`, {
-        headers: { Authorization: "Bearer " + token }
-        })
-    ]);
-
-    const user = await userRes.json();
-    const products = await productsRes.json();
-    const recipes = await recipesRes.json();
-    const supermarkets = await supermarketsRes.json();
-    window.__allProducts = products;
-window.__allSupermarkets = supermarkets;
+    // una sola richiesta: profilo, supermercati, ricette e offerte
+    const res = await apiFetch(`${CONFIG.API_BASE_URL}/dashboard`, {
+      headers: { Authorization: "Bearer " + token }
+    });
+
+    const { user, deals, recipes, supermarkets } = await res.json();
+    window.__allProducts = deals;
+    window.__allSupermarkets = supermarkets;
 
 
     renderUser(user);
-    renderOffers(products, supermarkets);
+    renderOffers(deals, supermarkets);
     renderDashboardQuickActions()
     renderRecipe(recipes);
 
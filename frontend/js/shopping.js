@@ -4,9 +4,10 @@ import { openProductModal } from "./modal-function.js";
 const token = localStorage.getItem("token");
 if (!token) window.location.href = "index.html";
 
-let shoppingList = [];     // cart items
-let products = [];         // full products
-let supermarkets = [];     // full supermarkets
+let shoppingList = [];     // cart items, gia' in ordine di corsia per supermercato
+
+// operazioni accettate da una singola PATCH /cart (MAX_CART_OPERATIONS nel backend)
+const MAX_CART_OPERATIONS = 500;
 
 const totalAllEl = document.getElementById("total-budget");
 const totalPendingEl = document.getElementById("total-remaining");
@@ -26,45 +27,28 @@ document.getElementById("filter-store")
 // 1. LOAD DATA FROM BACKEND
 // =========================
 
-async function loadCart() {
-  const res = await apiFetch(`${CONFIG.API_BASE_URL}/cart`, {
+async function loadCartRoute() {
+  const res = await apiFetch(`${CONFIG.API_BASE_URL}/cart/route`, {
     headers: { "Authorization": "Bearer " + token }
   });
   return res.ok ? res.json() : [];
 }
 
-async function loadProducts() {
-  const res = await apiFetch(`${CONFIG.API_BASE_URL}/product`);
-  return res.ok ? res.json() : [];
-}
-
-async function loadSupermarkets() {
-  const res = await apiFetch(`${CONFIG.API_BASE_URL}/supermarket`);
-  return res.ok ? res.json() : [];
-}
-
 
 // =========================
 // 2. INIT PAGE
 // =========================
 
 async function initCart() {
-  // Load all data
-  products = await loadProducts();
-  supermarkets = await loadSupermarkets();
-  const rawCart = await loadCart();
-
-  // JOIN manuale cart → product → supermarket
-  shoppingList = rawCart.map(item => {
-    const product = products.find(p => p.id === item.product_id);
-    const supermarket = supermarkets.find(s => s.id === product.supermarket_id);
+  // carrello con prodotti e supermercati, raggruppato e ordinato dal backend
+  const groups = await loadCartRoute();
 
-    return {
+  shoppingList = groups.flatMap(group =>
+    group.items.map(item => ({
       ...item,
-      product,
-      supermarket
-    };
-  });
+      supermarket: group.supermarket ?? {}
+    }))
+  );
 
   renderList();
   populateStoreFilter();
@@ -117,20 +101,8 @@ let boughtItems = filtered.filter(i => i.checked);
     // Ordina per nome
     pendingItems.sort((a, b) => a.product.name.localeCompare(b.product.name));
     boughtItems.sort((a, b) => a.product.name.localeCompare(b.product.name));
-  } else {
-    // Ordina per aisle_order
-    pendingItems.sort((a, b) => {
-      const aOrder = a.product.aisle_order ?? 9999;
-      const bOrder = b.product.aisle_order ?? 9999;
-      return aOrder - bOrder;
-    });
-
-    boughtItems.sort((a, b) => {
-      const aOrder = a.product.aisle_order ?? 9999;
-      const bOrder = b.product.aisle_order ?? 9999;
-      return aOrder - bOrder;
-    });
   }
+  // con un solo negozio resta l'ordine di corsia di /cart/route
 
   // =========================
   // 4. RENDER
@@ -458,17 +430,20 @@ document.getElementById("select-all-btn").addEventListener("click", async () =>
   // 2. Controlla se sono già tutti selezionati
   const allSelected = visibleItems.every(i => i.checked);
 
-  // 3. Aggiorna backend per ogni item
-  for (const item of visibleItems) {
-    await apiFetch(`${CONFIG.API_BASE_URL}/cart/${item.id}`, {
-      method: "PUT",
+  // 3. Aggiorna backend con PATCH /cart, a blocchi di MAX_CART_OPERATIONS item per richiesta
+  for (let start = 0; start < visibleItems.length; start += MAX_CART_OPERATIONS) {
+    const chunk = visibleItems.slice(start, start + MAX_CART_OPERATIONS);
+    await apiFetch(`${CONFIG.API_BASE_URL}/cart`, {
+      method: "PATCH",
       headers: {
         "Authorization": "Bearer " + token,
         "Content-Type": "application/json"
       },
-      body: JSON.stringify({ checked: !allSelected })
+      body: JSON.stringify(chunk.map(item => ({ id: item.id, checked: !allSelected })))
     });
+  }
 
+  for (const item of visibleItems) {
     item.checked = !allSelected; // aggiorna anche localmente
   }
 
@@ -1,28 +1,40 @@
+import time
+
 from jose import jwt
 from datetime import timedelta
 from fastapi import HTTPException, status
 
+from app import passwords
+from app.models import RevokedToken
+from app.token_cache import TokenCache, token_cache
 from app.routers.auth import get_db, get_current_user, authenticate_user, create_access_token, SECRET_KEY, ALGORITHM
 from test.utils import *
 
 app.dependency_overrides[get_db] = override_get_db
 
-def test_authenticate_user(test_user):
-    db = TestingSessionLocal()
+@pytest.fixture(autouse=True)
+def clean_revoked_tokens():
+    yield
+    with engine.connect() as connection:
+        connection.execute(text("DELETE FROM revoked_tokens;"))
+        connection.commit()
 
-    authenticated_user = authenticate_user(test_user[0].username, "test", db)
+@pytest.mark.asyncio
+async def test_authenticate_user(test_user):
+    async with TestingAsyncSessionLocal() as db:
+        authenticated_user = await authenticate_user(test_user[0].username, "test", db)
     assert authenticated_user is not None
 
-def test_authenticate_user_invalid_username(test_user):
-    db = TestingSessionLocal()
-
-    authenticated_user = authenticate_user("WrongUsername", "test", db)
+@pytest.mark.asyncio
+async def test_authenticate_user_invalid_username(test_user):
+    async with TestingAsyncSessionLocal() as db:
+        authenticated_user = await authenticate_user("WrongUsername", "test", db)
     assert authenticated_user is False
 
-def test_authenticate_user_invalid_password(test_user):
-    db = TestingSessionLocal()
-
-    authenticated_user = authenticate_user(test_user[0].username, "WrongPassword", db)
+@pytest.mark.asyncio
+async def test_authenticate_user_invalid_password(test_user):
+    async with TestingAsyncSessionLocal() as db:
+        authenticated_user = await authenticate_user(test_user[0].username, "WrongPassword", db)
     assert authenticated_user is False
 
 def test_create_access_token():
@@ -44,7 +56,8 @@ async def test_get_current_user_valid_token():
     encode = {'sub': 'testuser', 'id': 1, 'role': 'admin'}
     token = jwt.encode(encode, SECRET_KEY, algorithm=ALGORITHM)
 
-    user = await get_current_user(token=token)
+    async with TestingAsyncSessionLocal() as db:
+        user = await get_current_user(token=token, db=db)
     assert user == {'username': 'testuser', 'id': 1, 'user_role': 'admin'}
 
 @pytest.mark.asyncio
@@ -54,7 +67,129 @@ async def test_get_current_user_missing_payload():
     token = jwt.encode(encode, SECRET_KEY, algorithm=ALGORITHM)
 
     with pytest.raises(HTTPException) as excinfo:
-        await get_current_user(token=token)
+        async with TestingAsyncSessionLocal() as db:
+            await get_current_user(token=token, db=db)
     assert excinfo.value.status_code == status.HTTP_401_UNAUTHORIZED
     assert excinfo.value.detail == 'Could not validate user'
 
+
+def test_create_user(test_user):
+    request_data = {'username': 'newuser', 'email': 'new@email.com', 'first_name': 'new',
+                    'last_name': 'user', 'password': 'secret'}
+    response = client.post('/auth', json=request_data)
+    assert response.status_code == status.HTTP_201_CREATED
+    db = TestingSessionLocal()
+    user_model = db.query(Users).filter(Users.username == 'newuser').first()
+    assert user_model is not None
+    assert test_bcrypt.verify('secret', user_model.hashed_password)
+    db.delete(user_model)
+    db.commit()
+
+def test_login_for_access_token(test_user):
+    with assert_max_queries(1):
+        response = client.post('/auth/token', data={'username': test_user[0].username, 'password': 'test'})
+    assert response.status_code == status.HTTP_201_CREATED
+    token = response.json()['access_token']
+    decoded_token = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    assert decoded_token['sub'] == test_user[0].username
+    assert decoded_token['id'] == test_user[0].id
+
+def test_login_for_access_token_wrong_password(test_user):
+    response = client.post('/auth/token', data={'username': test_user[0].username, 'password': 'wrong'})
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+def test_password_hashing_runs_in_pool_and_records_stats(test_user):
+    before = passwords.get_stats()
+    client.post('/auth/token', data={'username': test_user[0].username, 'password': 'test'})
+    after = passwords.get_stats()
+    assert after['submitted'] == before['submitted'] + 1
+    assert after['completed'] == before['completed'] + 1
+    assert after['pending'] == 0
+    assert after['hash_seconds'] > before['hash_seconds']
+
+def test_password_hashing_rejects_when_queue_full(test_user, monkeypatch):
+    monkeypatch.setattr(passwords, 'PASSWORD_HASH_MAX_PENDING', 0)
+    before = passwords.get_stats()
+    response = client.post('/auth/token', data={'username': test_user[0].username, 'password': 'test'})
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.headers['retry-after'] == '1'
+    assert passwords.get_stats()['rejected'] == before['rejected'] + 1
+
+def test_password_hash_workers_split_between_web_workers(monkeypatch):
+    monkeypatch.setattr(passwords.os, 'cpu_count', lambda: 8)
+    monkeypatch.setenv('WEB_CONCURRENCY', '4')
+    assert passwords.default_hash_workers() == 2
+    monkeypatch.setenv('WEB_CONCURRENCY', '16')
+    assert passwords.default_hash_workers() == 1
+    monkeypatch.delenv('WEB_CONCURRENCY')
+    assert passwords.default_hash_workers() == 8
+
+@pytest.mark.asyncio
+async def test_get_current_user_uses_token_cache():
+    token_cache.clear()
+    token = create_access_token('cacheduser', 3, 'user', timedelta(minutes=5))
+
+    async with TestingAsyncSessionLocal() as db:
+        user = await get_current_user(token=token, db=db)
+        assert await get_current_user(token=token, db=db) == user
+    assert user == {'username': 'cacheduser', 'id': 3, 'user_role': 'user'}
+    assert token_cache.stats()['misses'] == 1
+    assert token_cache.stats()['hits'] == 1
+
+def test_token_cache_respects_expiry():
+    cache = TokenCache(maxsize=10)
+    cache.put('expired', {'id': 1}, time.time() - 1)
+    cache.put('valid', {'id': 2}, time.time() + 60)
+    assert cache.get('expired') is None
+    assert cache.get('valid') == {'id': 2}
+    assert cache.stats()['size'] == 1
+
+def test_token_cache_evicts_least_recently_used():
+    cache = TokenCache(maxsize=2)
+    cache.put('a', {'id': 1}, None)
+    cache.put('b', {'id': 2}, None)
+    cache.get('a')
+    cache.put('c', {'id': 3}, None)
+    assert cache.get('b') is None
+    assert cache.get('a') == {'id': 1}
+    assert cache.stats()['evictions'] == 1
+
+def test_logout_revokes_token():
+    token_cache.clear()
+    token = create_access_token('revokeduser', 4, 'user', timedelta(minutes=5))
+    response = client.post('/auth/logout', headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    assert token_cache.stats()['revoked'] == 1
+
+    response = client.post('/auth/logout', headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    assert response.json() == {'detail': 'Could not validate user'}
+
+def test_token_cache_keeps_live_revocations():
+    cache = TokenCache(maxsize=2)
+    cache.revoke('expired', time.time() - 1)
+    for index in range(3):
+        cache.revoke(f'token{index}', time.time() + 60)
+    # oltre maxsize si scartano solo le revoche scadute
+    assert all(cache.is_revoked(f'token{index}') for index in range(3))
+    assert not cache.is_revoked('expired')
+
+def test_logout_revokes_token_beyond_cache_size(monkeypatch):
+    monkeypatch.setattr(token_cache, 'maxsize', 2)
+    token_cache.clear()
+    tokens = [create_access_token(f'user{index}', index + 10, 'user', timedelta(minutes=5)) for index in range(3)]
+    for token in tokens:
+        client.post('/auth/logout', headers={'Authorization': f'Bearer {token}'})
+    response = client.post('/auth/logout', headers={'Authorization': f'Bearer {tokens[0]}'})
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+def test_revocation_shared_between_workers():
+    token_cache.clear()
+    token = create_access_token('otherworker', 5, 'user', timedelta(minutes=5))
+    headers = {'Authorization': f'Bearer {token}'}
+    client.post('/auth/logout', headers=headers)
+    # un altro worker non ha la revoca in memoria ma la legge da revoked_tokens
+    token_cache.clear()
+    assert client.post('/auth/logout', headers=headers).status_code == status.HTTP_401_UNAUTHORIZED
+    db = TestingSessionLocal()
+    assert db.query(RevokedToken).count() >= 1
@@ -1,3 +1,6 @@
+from itertools import combinations
+
+import numpy as np
 from starlette import status
 from datetime import datetime, timedelta
 
@@ -5,18 +8,27 @@ from app.models import ShoppingHistory, ShoppingHistoryItem
 from test.utils import *
 from app.routers.cart import get_db, get_current_user
 from app.main import app
+from app.basket import cheapest_stores
 
 app.dependency_overrides[get_db] = override_get_db
 app.dependency_overrides[get_current_user] = override_get_current_user
 
 def test_get_cart(test_cart):
-    response = client.get('/cart')
+    with assert_max_queries(1):
+        response = client.get('/cart')
     assert response.status_code == status.HTTP_200_OK
     assert response.json() == [{'product_id': 1, 'quantity': 2,
                                'checked': False, 'id': 1, 'owner_id': 1}]
 
+def test_get_cart_hides_deleted_products(test_cart):
+    db = TestingSessionLocal()
+    db.query(Products).filter(Products.id == test_cart[0].product_id).update({'deleted_at': datetime.now()})
+    db.commit()
+    assert client.get('/cart').json() == []
+
 def test_get_cart_by_supermarket(test_cart):
-    response = client.get('/cart?supermarket_id=1')
+    with assert_max_queries(2):
+        response = client.get('/cart?supermarket_id=1')
     assert response.status_code == status.HTTP_200_OK
     assert response.json() == [{'product_id': 1, 'quantity': 2,
                                'checked': False, 'id': 1, 'owner_id': 1}]
@@ -27,7 +39,8 @@ def test_get_cart_by_supermarket_not_found(test_cart):
     assert response.json() == {'detail': 'Supermarket not found'}
 
 def test_get_cart_by_id(test_cart):
-    response = client.get(f'/cart/{test_cart[0].id}')
+    with assert_max_queries(1):
+        response = client.get(f'/cart/{test_cart[0].id}')
     assert response.status_code == status.HTTP_200_OK
     assert response.json() == {'product_id': 1, 'quantity': 2,
                                'checked': False, 'id': 1, 'owner_id': 1}
@@ -39,7 +52,8 @@ def test_get_cart_by_id_not_found(test_cart):
 
 def test_create_cart(test_cart):
     request_data = {'product_id': 3, 'quantity': 1}
-    response = client.post('/cart', json=request_data)
+    with assert_max_queries(3):
+        response = client.post('/cart', json=request_data)
     assert response.status_code == status.HTTP_201_CREATED
 
     created_cart = response.json()
@@ -68,8 +82,10 @@ def test_create_cart_product_not_found(test_cart):
     cart_model = db.query(Cart).filter(Cart.product_id == 9999).first()
     assert cart_model is None
 
-def test_create_shopping_history(test_cart):
-    response = client.post('/cart/finalize')
+def test_create_shopping_history(test_cart, clean_shopping_history):
+    client.put(f'/cart/{test_cart[0].id}', json={'checked': True})
+    with assert_max_queries(5):
+        response = client.post('/cart/finalize')
     assert response.status_code == status.HTTP_201_CREATED
     db = TestingSessionLocal()
     shopping_history_model = db.query(ShoppingHistory).filter(ShoppingHistory.id == 1).first()
@@ -93,9 +109,50 @@ def test_create_shopping_history(test_cart):
     cart_model = db.query(Cart).filter(Cart.id == 1).first()
     assert cart_model is None
 
+def test_create_shopping_history_only_checked_items(test_cart, test_product, clean_shopping_history):
+    db = TestingSessionLocal()
+    db.add(Cart(product_id=test_product[2].id, owner_id=1, quantity=3, checked=True))
+    db.commit()
+    response = client.post('/cart/finalize')
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()['finalized_items'] == 1
+
+    history_id = response.json()['history_id']
+    shopping_history_model = db.query(ShoppingHistory).filter(ShoppingHistory.id == history_id).first()
+    assert shopping_history_model.total_items == 3
+    assert shopping_history_model.total_price == 3 * 1.10
+
+    items = db.query(ShoppingHistoryItem).filter(ShoppingHistoryItem.history_id == history_id).all()
+    assert len(items) == 1
+    assert items[0].name == "Swile"
+    assert items[0].price_paid == 1.10
+    assert items[0].was_discounted == True
+    assert items[0].supermarket_name == "Conad"
+
+    cart_model = db.query(Cart).filter(Cart.owner_id == 1).all()
+    assert [c.id for c in cart_model] == [test_cart[0].id]
+
+def test_create_shopping_history_query_budget(test_cart, test_product, clean_shopping_history):
+    # le query restano le stesse qualunque sia il numero di righe nel carrello
+    db = TestingSessionLocal()
+    db.add(Cart(product_id=test_product[1].id, owner_id=1, quantity=1, checked=True))
+    db.add(Cart(product_id=test_product[2].id, owner_id=1, quantity=3, checked=True))
+    db.commit()
+    client.put(f'/cart/{test_cart[0].id}', json={'checked': True})
+    with assert_max_queries(5):
+        response = client.post('/cart/finalize')
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()['finalized_items'] == 3
+
+def test_create_shopping_history_empty_cart(test_cart):
+    response = client.post('/cart/finalize')
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert response.json() == {"detail": "The cart is empty!"}
+
 def test_update_all_cart(test_cart):
     request_data = {'quantity': 15, 'checked': True}
-    response = client.put(f'/cart/{test_cart[0].id}', json=request_data)
+    with assert_max_queries(2):
+        response = client.put(f'/cart/{test_cart[0].id}', json=request_data)
     assert response.status_code == status.HTTP_204_NO_CONTENT
 
     db = TestingSessionLocal()
@@ -144,8 +201,50 @@ def test_update_cart_not_found(test_cart):
     assert response.status_code == status.HTTP_404_NOT_FOUND
     assert response.json() == {"detail": "Cart not found"}
 
+def test_update_cart_batch(test_cart, test_product):
+    db = TestingSessionLocal()
+    cart3 = Cart(product_id=test_product[2].id, owner_id=1, quantity=1)
+    db.add(cart3)
+    db.commit()
+    request_data = [{'id': test_cart[0].id, 'quantity': 7, 'checked': True},
+                    {'id': cart3.id, 'delete': True},
+                    {'id': test_cart[1].id, 'checked': False},
+                    {'id': 9999, 'quantity': 2},
+                    {'id': test_cart[0].id, 'quantity': 1}]
+    with assert_max_queries(3):
+        response = client.patch('/cart', json=request_data)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == [{'id': test_cart[0].id, 'status': 'updated'},
+                               {'id': cart3.id, 'status': 'deleted'},
+                               {'id': test_cart[1].id, 'status': 'not_found'},
+                               {'id': 9999, 'status': 'not_found'},
+                               {'id': test_cart[0].id, 'status': 'duplicate'}]
+
+    cart_model = db.query(Cart).filter(Cart.owner_id == 1).all()
+    assert [(c.id, c.quantity, c.checked) for c in cart_model] == [(test_cart[0].id, 7, True)]
+    other_cart = db.query(Cart).filter(Cart.id == test_cart[1].id).first()
+    assert other_cart.checked == True
+
+def test_update_cart_batch_partial_fields(test_cart):
+    response = client.patch('/cart', json=[{'id': test_cart[0].id, 'checked': True}])
+    assert response.status_code == status.HTTP_200_OK
+    db = TestingSessionLocal()
+    cart_model = db.query(Cart).filter(Cart.id == test_cart[0].id).first()
+    assert cart_model.quantity == 2
+    assert cart_model.checked == True
+
+def test_update_cart_batch_nothing_to_update(test_cart):
+    response = client.patch('/cart', json=[{'id': test_cart[0].id}])
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == [{'id': test_cart[0].id, 'status': 'invalid'}]
+
+def test_update_cart_batch_empty(test_cart):
+    response = client.patch('/cart', json=[])
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
+
 def test_delete_cart(test_cart):
-    response = client.delete(f'/cart/{test_cart[0].id}')
+    with assert_max_queries(2):
+        response = client.delete(f'/cart/{test_cart[0].id}')
     assert response.status_code == status.HTTP_204_NO_CONTENT
     db = TestingSessionLocal()
     cart_model = db.query(Cart).filter(Cart.id == test_cart[0].id).first()
@@ -157,7 +256,8 @@ def test_delete_cart_not_found(test_cart):
     assert response.json() == {"detail": "Cart not found"}
 
 def test_delete_all_cart(test_cart):
-    response = client.delete('/cart')
+    with assert_max_queries(1):
+        response = client.delete('/cart')
     assert response.status_code == status.HTTP_204_NO_CONTENT
 
     db = TestingSessionLocal()
@@ -194,4 +294,95 @@ def test_delete_cart_by_supermarket_id_and_checked_product(test_cart):
 def test_delete_cart_by_supermarket_id_not_found(test_cart):
     response = client.delete('/cart?supermarket_id=9999')
     assert response.status_code == status.HTTP_404_NOT_FOUND
-    assert response.json() == {"detail": "Supermarket not found"}
\ No newline at end of file
+    assert response.json() == {"detail": "Supermarket not found"}
+
+def _optimize_fixture(test_cart):
+    db = TestingSessionLocal()
+    db.add_all([Products(name="onion ", unit="PZ", original_price=0.50, supermarket_id=2, aisle_order=1,
+                         category="Frutta"),
+                Products(name="Garlic", unit="100g", original_price=0.95, discounted_price=0.80, supermarket_id=1,
+                         aisle_order=1, category="Verdura"),
+                Cart(product_id=2, owner_id=1, quantity=1),
+                Cart(product_id=3, owner_id=1, quantity=1)])
+    db.commit()
+
+def test_optimize_cart(test_cart):
+    _optimize_fixture(test_cart)
+    with assert_max_queries(2):
+        response = client.get('/cart/optimize')
+    assert response.status_code == status.HTTP_200_OK
+    plan = response.json()
+    assert (plan['total'], plan['current_total'], plan['savings']) == (2.9, 3.22, 0.32)
+    assert plan['unavailable'] == []
+    assert [(store['supermarket_name'], store['total']) for store in plan['stores']] == [('Conad', 1.9), ('Lidl', 1.0)]
+    assert [(item['name'], item['price'], item['quantity']) for item in plan['stores'][1]['items']] == [
+        ('onion ', 0.5, 2)]
+
+def test_optimize_cart_single_store(test_cart):
+    _optimize_fixture(test_cart)
+    plan = client.get('/cart/optimize?max_stores=1').json()
+    # Lidl costa meno per due articoli ma non ha lo Swile: vince il supermercato che copre tutto
+    assert [store['supermarket_name'] for store in plan['stores']] == ['Conad']
+    assert (plan['total'], plan['current_total']) == (3.14, 3.22)
+
+def test_optimize_cart_unavailable(test_cart):
+    db = TestingSessionLocal()
+    db.query(Products).filter(Products.id == test_cart[0].product_id).update({'deleted_at': datetime.now()})
+    db.commit()
+    plan = client.get('/cart/optimize').json()
+    assert plan['unavailable'] == [test_cart[0].id]
+    assert plan['stores'] == [] and plan['total'] == 0
+
+def test_cheapest_stores_matches_brute_force():
+    rng = np.random.default_rng(7)
+    prices = rng.uniform(0.5, 10, size=(30, 8))
+    prices[rng.random(prices.shape) < 0.3] = np.inf
+    quantities = rng.integers(1, 4, size=30)
+    costs = prices * quantities[:, None]
+
+    def total(stores):
+        best = costs[:, list(stores)].min(axis=1)
+        return (np.isinf(best).sum(), best[np.isfinite(best)].sum())
+
+    expected = min(combinations(range(8), 3), key=total)
+    assert total(cheapest_stores(prices, quantities, 3)) == total(expected)
+
+def test_cheapest_stores_greedy(monkeypatch):
+    from app import basket
+    rng = np.random.default_rng(3)
+    prices = rng.uniform(0.5, 10, size=(100, 20))
+    quantities = np.ones(100)
+    exact = prices[:, cheapest_stores(prices, quantities, 4)].min(axis=1).sum()
+    # troppe combinazioni: ricerca greedy con scambi, vicina all'ottimo
+    monkeypatch.setattr(basket, "MAX_EXACT_COMBINATIONS", 0)
+    stores = cheapest_stores(prices, quantities, 4)
+    assert len(set(stores.tolist())) == 4
+    assert prices[:, stores].min(axis=1).sum() <= exact * 1.05
+
+def test_cart_route(test_cart):
+    db = TestingSessionLocal()
+    db.add_all([Products(name="Bread", unit="pz", original_price=1.5, supermarket_id=1, category="Forno"),
+                Products(name="Milk", unit="l", original_price=1.2, supermarket_id=1, aisle_order=1,
+                         category="Latticini"),
+                Cart(product_id=3, owner_id=1, quantity=1, checked=True),
+                Cart(product_id=4, owner_id=1, quantity=2),
+                Cart(product_id=5, owner_id=1, quantity=3),
+                Cart(product_id=2, owner_id=1, quantity=1)])
+    db.commit()
+    with assert_max_queries(1):
+        response = client.get('/cart/route')
+    assert response.status_code == status.HTTP_200_OK
+    groups = response.json()
+    assert [(group['supermarket']['name'], group['total'], group['remaining']) for group in groups] == [
+        ('Conad', 8.94, 7.84), ('Lidl', 0.88, 0.88)]
+    # in ordine di corsia, i prodotti senza corsia in fondo
+    assert [(item['product']['name'], item['product']['aisle_order'], item['quantity'], item['subtotal'])
+            for item in groups[0]['items']] == [
+        ('Milk', 1.0, 3, 3.6), ('Swile', 3.0, 1, 1.1), ('Onion', 3.2, 2, 1.24), ('Bread', None, 2, 3.0)]
+    assert groups[0]['items'][1]['checked'] is True
+    assert groups[1]['items'][0]['price'] == 0.88
+
+def test_cart_route_empty():
+    response = client.get('/cart/route')
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == []
@@ -0,0 +1,60 @@
+from datetime import datetime
+
+from starlette import status
+
+from test.utils import *
+from app.routers.dashboard import get_db, get_current_user
+from app.main import app
+
+app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_current_user] = override_get_current_user
+
+def test_get_dashboard(test_product, test_recipe):
+    with assert_max_queries(5):
+        response = client.get('/dashboard')
+    assert response.status_code == status.HTTP_200_OK
+    body = response.json()
+    assert body['user']['username'] == 'myusername'
+    assert 'hashed_password' not in body['user']
+    assert [supermarket['name'] for supermarket in body['supermarkets']] == ['Conad', 'Lidl']
+    assert [recipe['name'] for recipe in body['recipes']] == ['Carbonara']
+    assert body['product_summary'] == {'total': 3, 'discounted': 1,
+                                       'by_supermarket': [{'supermarket_id': 1, 'total': 2, 'discounted': 1},
+                                                          {'supermarket_id': 2, 'total': 1, 'discounted': 0}]}
+    assert [deal['name'] for deal in body['deals']] == ['Swile']
+
+def test_get_dashboard_etag(test_product, test_recipe):
+    response = client.get('/dashboard')
+    etag = response.headers['etag']
+    assert response.headers['cache-control'] == 'private, no-cache'
+    # la revalidazione legge solo profilo, ricette e versione del catalogo
+    with assert_max_queries(2):
+        response = client.get('/dashboard', headers={'If-None-Match': etag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    db = TestingSessionLocal()
+    db.execute(text("UPDATE catalog_version SET version = version + 1"))
+    db.commit()
+    response = client.get('/dashboard', headers={'If-None-Match': etag})
+    assert response.status_code == status.HTTP_200_OK
+    etag = response.headers['etag']
+
+    db.add(Recipes(name='Pesto', owner_id=test_recipe[0].owner_id))
+    db.commit()
+    response = client.get('/dashboard', headers={'If-None-Match': etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.json()['recipes']) == 2
+
+def test_get_dashboard_user_not_found():
+    response = client.get('/dashboard')
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+def test_get_dashboard_skips_deleted_products(test_product, test_recipe):
+    db = TestingSessionLocal()
+    product_model = db.query(Products).filter(Products.id == test_product[2].id).first()
+    product_model.deleted_at = datetime.now()
+    db.commit()
+    body = client.get('/dashboard').json()
+    assert body['product_summary']['total'] == 2
+    assert body['product_summary']['discounted'] == 0
+    assert body['deals'] == []
@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from starlette import status
 
 from test.utils import *
@@ -8,12 +10,20 @@ app.dependency_overrides[get_db] = override_get_db
 app.dependency_overrides[get_current_user] = override_get_current_user
 
 def test_get_favorites(test_favorite):
-    response = client.get('/favorite')
+    with assert_max_queries(1):
+        response = client.get('/favorite')
     assert response.status_code == status.HTTP_200_OK
     assert response.json() == [1]
 
+def test_get_favorites_hides_deleted_products(test_favorite):
+    db = TestingSessionLocal()
+    db.query(Products).filter(Products.id == test_favorite[0].product_id).update({'deleted_at': datetime.now()})
+    db.commit()
+    assert client.get('/favorite').json() == []
+
 def test_add_to_favorites(test_favorite):
-    response = client.post('/favorite', json={'product_id': 3})
+    with assert_max_queries(4):
+        response = client.post('/favorite', json={'product_id': 3})
     assert response.status_code == status.HTTP_201_CREATED
     assert response.json() == {"status": "added", "product_id": 3}
     db = TestingSessionLocal()
@@ -34,7 +44,8 @@ def test_add_to_favorites_favorite_not_found(test_favorite):
     assert response.json() == {"detail": "Product already in favorites"}
 
 def test_remove_from_favorites(test_favorite):
-    response = client.delete('/favorite/1')
+    with assert_max_queries(3):
+        response = client.delete('/favorite/1')
     assert response.status_code == status.HTTP_204_NO_CONTENT
     db = TestingSessionLocal()
     favorite_model = db.query(Favorites).filter(Favorites.product_id == 1).filter(Favorites.owner_id == 1).first()
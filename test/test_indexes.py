@@ -0,0 +1,49 @@
+from test.utils import *
+from app.routers import cart, favorites, recipes, recipe_items, shopping_history, supermarkets
+
+for router in (cart, favorites, recipes, recipe_items, shopping_history, supermarkets):
+    app.dependency_overrides[router.get_db] = override_get_db
+    app.dependency_overrides[router.get_current_user] = override_get_current_user
+
+
+def explain(statement):
+    # il piano non dipende dai valori: i parametri del log vengono legati a NULL
+    with engine.connect() as connection:
+        return [row[-1] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}",
+                                                              (None,) * statement.count("?"))]
+
+
+# richieste ai router sulle tabelle per utente: si controllano le istruzioni SQL che eseguono davvero
+ROUTER_REQUESTS = {
+    "read_cart": ("GET", "/cart", None),
+    "create_cart": ("POST", "/cart", {"product_id": 3, "quantity": 1}),
+    "optimize_cart": ("GET", "/cart/optimize", None),
+    "get_favorites": ("GET", "/favorite", None),
+    "add_to_favorites": ("POST", "/favorite", {"product_id": 3}),
+    "get_supermarket_products": ("GET", "/supermarket/1/products", None),
+    "get_recipes": ("GET", "/recipe?owner_id=1", None),
+    "get_recipe_items": ("GET", "/recipe-item?recipe_id=1", None),
+    "get_shopping_history": ("GET", "/shopping-history", None),
+    "get_shopping_history_items": ("GET", "/shopping-history/1/items", None),
+}
+
+# ordinamenti ammessi: optimize_cart ordina per id le sole righe del carrello dell'utente
+SORTED_IN_MEMORY = {"optimize_cart"}
+
+
+@pytest.mark.parametrize("name", ROUTER_REQUESTS)
+def test_router_query_uses_index(name, test_cart, test_favorite, test_recipe_item, test_shopping_history_item):
+    method, url, body = ROUTER_REQUESTS[name]
+    with assert_max_queries(10) as query_log:
+        response = client.request(method, url, json=body)
+    assert response.status_code < 300, response.text
+    plans = {statement: explain(statement) for statement in query_log}
+    assert any(plans.values())
+    for statement, plan in plans.items():
+        # le liste di IN vengono materializzate come tabelle costanti, non sono accessi alle tabelle
+        for step in [step for step in plan if not step.startswith(("LIST SUBQUERY", "SCAN CONSTANT ROW"))]:
+            if "TEMP B-TREE" in step:
+                assert name in SORTED_IN_MEMORY, f"{name}: {statement}\n{plan}"
+                continue
+            assert step.startswith("SEARCH") and ("INDEX" in step or "PRIMARY KEY" in step), \
+                f"{name}: {statement}\n{plan}"
@@ -0,0 +1,43 @@
+from starlette import status
+
+from test.utils import *
+from app.metrics import metrics, track_sql
+from app.routers import products
+from app.main import app
+
+app.dependency_overrides[products.get_db] = override_get_db
+app.dependency_overrides[products.get_current_user] = override_get_current_user
+
+def test_metrics_per_route(test_product):
+    metrics.clear()
+    client.get(f'/product/{test_product[0].id}')
+    client.get(f'/product/{test_product[1].id}')
+    client.get('/product/9999')
+
+    response = client.get('/metrics')
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['content-type'].startswith('text/plain; version=0.0.4')
+    body = response.text
+    assert 'http_requests_total{method="GET",route="/product/{product_id}",status="200"} 2' in body
+    assert 'http_requests_total{method="GET",route="/product/{product_id}",status="404"} 1' in body
+    assert 'http_request_duration_seconds_count{method="GET",route="/product/{product_id}"} 3' in body
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/product/{product_id}",le="+Inf"} 3' in body
+    # una select del prodotto per richiesta
+    assert 'http_request_db_statements_sum{method="GET",route="/product/{product_id}"} 3.0' in body
+    assert 'http_request_db_seconds_total{method="GET",route="/product/{product_id}"}' in body
+    assert 'password_hash_pending 0' in body
+    assert 'token_cache_size' in body
+    assert 'recipe_summary_cache_size' in body
+
+def test_metrics_unmatched_route():
+    metrics.clear()
+    client.get('/does-not-exist')
+    assert 'http_requests_total{method="GET",route="unmatched",status="404"} 1' in client.get('/metrics').text
+
+def test_track_sql(test_product):
+    db = TestingSessionLocal()
+    with track_sql() as stats:
+        db.query(Products).all()
+        db.query(Supermarkets).all()
+    assert stats.statements == 2
+    assert stats.seconds > 0
@@ -1,14 +1,25 @@
+import gzip
+import json
+from datetime import datetime, timezone
+
 from starlette import status
 
 from test.utils import *
 from app.routers.products import get_db, get_current_user
 from app.main import app
+from app import product_matching
+from app.product_matching import rebuild_product_matches
+from app.routers import supermarkets
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[supermarkets.get_db] = override_get_db
 app.dependency_overrides[get_current_user] = override_get_current_user
+# l'indice di equivalenza si aggiorna in background con una sessione propria
+product_matching.AsyncSessionLocal = TestingAsyncSessionLocal
 
 def test_get_products(test_product):
-    response = client.get('/product')
+    with assert_max_queries(2):
+        response = client.get('/product')
     assert response.status_code == status.HTTP_200_OK
     assert response.json() == [{'aisle_order': 3.2, 'name': 'Onion',
                                'supermarket_id': 1, 'original_price': 0.62, 'id': 1, 'image': None,
@@ -27,7 +38,8 @@ def test_get_products(test_product):
                                ]
 
 def test_get_product_by_id(test_product):
-    response = client.get(f'/product/{test_product[0].id}')
+    with assert_max_queries(1):
+        response = client.get(f'/product/{test_product[0].id}')
     assert response.status_code == status.HTTP_200_OK
     assert response.json() == {'aisle_order': 3.2, 'name': 'Onion',
                                'supermarket_id': 1, 'original_price': 0.62, 'id': 1, 'image': None,
@@ -51,7 +63,8 @@ def test_get_products_by_supermarket_query(test_product):
 
 def test_get_products_by_supermarket_path(test_product):
     supermarket_id = test_product[0].supermarket_id
-    response = client.get(f"/product/supermarket/{supermarket_id}")
+    with assert_max_queries(3):
+        response = client.get(f"/product/supermarket/{supermarket_id}")
     assert response.status_code == status.HTTP_200_OK
     assert response.json() == [{'aisle_order': 3, 'name': 'Swile',
                                 'supermarket_id': 1, 'original_price': 1.24, 'id': 3, 'image': None,
@@ -119,6 +132,106 @@ def test_get_products_by_search_and_category(test_product):
                                 'protein': None, 'discounted_price': None, 'location': None
                                 }]
 
+def test_get_products_paginated(test_product):
+    with assert_max_queries(2):
+        response = client.get("/product?limit=2")
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert [p['id'] for p in data['items']] == [1, 2]
+    assert data['next_cursor'] == 2
+
+    response = client.get(f"/product?limit=2&cursor={data['next_cursor']}")
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert [p['id'] for p in data['items']] == [3]
+    assert data['next_cursor'] is None
+
+def test_get_products_paginated_with_filters(test_product):
+    response = client.get("/product?supermarket_id=1&limit=1&cursor=1")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {'items': [{'aisle_order': 3, 'name': 'Swile',
+                                          'supermarket_id': 1, 'original_price': 1.24, 'id': 3, 'image': None,
+                                          'unit': 'pz', 'category': 'Verdura', 'calories': None, 'fat': None,
+                                          'carbs': None, 'protein': None, 'discounted_price': 1.10,
+                                          'location': None}],
+                               'next_cursor': None}
+
+def test_get_products_ndjson(test_product):
+    with assert_max_queries(2):
+        response = client.get("/product?format=ndjson&category=Verdura")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [p['name'] for p in lines] == ['Garlic', 'Swile']
+
+def test_get_products_ndjson_etag(test_product):
+    response = client.get("/product?format=ndjson")
+    assert response.status_code == status.HTTP_200_OK
+    etag = response.headers['etag']
+    assert response.headers['cache-control'] == 'private, no-cache'
+    assert etag != client.get("/product").headers['etag']
+
+    response = client.get("/product?format=ndjson", headers={'If-None-Match': etag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.content == b''
+
+def test_search_products(test_product):
+    with assert_max_queries(1):
+        response = client.get("/product/search?q=garl")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {'items': [{'aisle_order': 2.5, 'name': 'Garlic',
+                                          'supermarket_id': 2, 'original_price': 0.88, 'id': 2, 'image': None,
+                                          'unit': '100g', 'category': 'Verdura', 'calories': None, 'fat': None,
+                                          'carbs': None, 'protein': None, 'discounted_price': None,
+                                          'location': None}],
+                               'next_offset': None}
+
+def test_search_products_accent_insensitive(test_product):
+    db = TestingSessionLocal()
+    db.add(Products(name="Caffè Macinato", original_price=3.49, supermarket_id=test_product[0].supermarket_id,
+                    aisle_order=7, unit="250g", category="Colazione"))
+    db.add(Products(name="Caffe Decaffeinato", original_price=3.99, supermarket_id=test_product[0].supermarket_id,
+                    aisle_order=7, unit="250g", category="Colazione"))
+    db.commit()
+    response = client.get("/product/search?q=caffe macinato")
+    assert response.status_code == status.HTTP_200_OK
+    assert [p['name'] for p in response.json()['items']] == ['Caffè Macinato']
+
+    response = client.get("/product/search?q=caffè&limit=1")
+    data = response.json()
+    assert len(data['items']) == 1
+    assert data['next_offset'] == 1
+
+def test_search_products_follows_updates(test_product):
+    response = client.put(f"/product/{test_product[0].id}", json={'name': 'Cipolla Rossa'})
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    assert client.get("/product/search?q=onion").json()['items'] == []
+    assert [p['id'] for p in client.get("/product/search?q=cipolla").json()['items']] == [test_product[0].id]
+
+def test_get_products_etag(test_product):
+    response = client.get("/product")
+    assert response.status_code == status.HTTP_200_OK
+    etag = response.headers['etag']
+
+    response = client.get("/product", headers={'If-None-Match': etag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.headers['etag'] == etag
+    assert response.content == b''
+
+    response = client.get("/product?category=Verdura", headers={'If-None-Match': etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['etag'] != etag
+
+def test_get_products_etag_changes_after_write(test_product):
+    etag = client.get("/product").headers['etag']
+    response = client.put(f"/product/{test_product[0].id}", json={'discounted_price': 0.50})
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+
+    response = client.get("/product", headers={'If-None-Match': etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['etag'] != etag
+    assert response.json()[0]['discounted_price'] == 0.50
+
 
 def test_get_products_by_supermarket_query_not_found(test_product):
     response = client.get("/product?supermarket_id=9999")
@@ -134,7 +247,8 @@ def test_create_product(test_product):
     request_data = {'name': 'New Product', 'category': 'Meat', 'unit': 'pz',
                     'location': 'Corridoio 3','supermarket_id': 2, 'original_price': 2.30,
                     'discounted_price': 2.00, 'aisle_order': 3.00}
-    response = client.post('/product', json=request_data)
+    with assert_max_queries(7):
+        response = client.post('/product', json=request_data)
     assert response.status_code == status.HTTP_201_CREATED
 
     created_product = response.json()
@@ -168,7 +282,8 @@ def test_create_product_supermarket_not_found(test_product):
 def test_update_product(test_product):
     request_data = {'name': 'Updated Product', 'unit': '200g', 'supermarket_id': 1, 'original_price': 5.20,
                     'aisle_order': 1.20, 'discounted_price': 1.00}
-    response = client.put(f"/product/{test_product[0].id}", json=request_data)
+    with assert_max_queries(6):
+        response = client.put(f"/product/{test_product[0].id}", json=request_data)
     assert response.status_code == status.HTTP_204_NO_CONTENT
     db = TestingSessionLocal()
     product_model = db.query(Products).filter(Products.id == test_product[0].id).first()
@@ -189,13 +304,276 @@ def test_update_product_not_found(test_product):
     assert response.json() == {"detail": "Product not found"}
 
 def test_delete_product(test_product):
-    response = client.delete(f"/product/{test_product[0].id}")
+    with assert_max_queries(6):
+        response = client.delete(f"/product/{test_product[0].id}")
     assert response.status_code == status.HTTP_204_NO_CONTENT
     db = TestingSessionLocal()
     product_model = db.query(Products).filter(Products.id == test_product[0].id).first()
     assert product_model is None
 
+def test_delete_product_keeps_tombstone(test_product):
+    response = client.delete(f"/product/{test_product[0].id}")
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    db = TestingSessionLocal()
+    product_model = (db.query(Products).execution_options(include_deleted=True)
+                     .filter(Products.id == test_product[0].id).first())
+    assert product_model.deleted_at is not None
+    assert client.get(f"/product/{test_product[0].id}").status_code == status.HTTP_404_NOT_FOUND
+    assert [product['id'] for product in client.get('/product').json()] == [2, 3]
+
+def test_get_catalog_changes(test_product):
+    with assert_max_queries(3):
+        response = client.get('/product/changes')
+    assert response.status_code == status.HTTP_200_OK
+    snapshot = response.json()
+    assert [product['name'] for product in snapshot['products']] == ['Onion', 'Garlic', 'Swile']
+    assert [supermarket['name'] for supermarket in snapshot['supermarkets']] == ['Conad', 'Lidl']
+    assert snapshot['deleted_products'] == []
+
+    response = client.get('/product/changes', params={'since': snapshot['token']})
+    assert response.json() == {'products': [], 'supermarkets': [], 'deleted_products': [],
+                               'deleted_supermarkets': [], 'token': snapshot['token']}
+
+    client.put(f"/product/{test_product[1].id}", json={'name': 'Aglio'})
+    client.delete(f"/product/{test_product[2].id}")
+    response = client.get('/product/changes', params={'since': snapshot['token']})
+    changes = response.json()
+    assert [product['name'] for product in changes['products']] == ['Aglio']
+    assert changes['deleted_products'] == [test_product[2].id]
+    assert changes['supermarkets'] == []
+    assert changes['token'] == snapshot['token'] + 2
+
+    response = client.get('/product/changes', params={'since': changes['token'] - 1})
+    assert response.json()['products'] == []
+    assert response.json()['deleted_products'] == [test_product[2].id]
+
+def test_get_catalog_changes_deleted_supermarket(test_product):
+    token = client.get('/product/changes').json()['token']
+    response = client.delete(f"/supermarket/{test_product[0].supermarket_id}")
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    changes = client.get('/product/changes', params={'since': token}).json()
+    assert changes['deleted_supermarkets'] == [test_product[0].supermarket_id]
+    assert changes['deleted_products'] == [test_product[0].id, test_product[2].id]
+    assert [product['id'] for product in client.get('/product').json()] == [test_product[1].id]
+
+def test_get_catalog_changes_invalid_token(test_product):
+    token = client.get('/product/changes').json()['token']
+    response = client.get('/product/changes', params={'since': token + 1})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json() == {'detail': 'Invalid sync token'}
+
+def test_delete_product_in_cart(test_cart, test_favorite):
+    # carrelli e preferiti che puntano al prodotto vengono eliminati con lui
+    response = client.delete(f"/product/{test_cart[0].product_id}")
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    db = TestingSessionLocal()
+    assert db.query(Cart).filter(Cart.product_id == test_cart[0].product_id).count() == 0
+    assert db.query(Favorites).filter(Favorites.product_id == test_cart[0].product_id).count() == 0
+    assert db.query(Cart).count() == 1
+
 def test_delete_product_not_found(test_product):
     response = client.delete("/product/9999")
     assert response.status_code == status.HTTP_404_NOT_FOUND
     assert response.json() == {"detail": "Product not found"}
+
+
+def test_get_product_prices(test_product):
+    response = client.post('/product', json={'name': 'Pasta', 'category': 'Pasta', 'original_price': 1.5,
+                                             'unit': 'pz', 'supermarket_id': 1, 'aisle_order': 1})
+    product_id = response.json()['id']
+    client.put(f'/product/{product_id}', json={'discounted_price': 1.2})
+    client.put(f'/product/{product_id}', json={'name': 'Pasta integrale'})
+
+    db = TestingSessionLocal()
+    prices = db.query(ProductPrice).filter(ProductPrice.product_id == product_id).order_by(ProductPrice.id).all()
+    assert [(price.original_cents, price.discounted_cents) for price in prices] == [(150, None), (150, 120)]
+
+    with assert_max_queries(2):
+        response = client.get(f'/product/{product_id}/prices')
+    assert response.status_code == status.HTTP_200_OK
+    history = response.json()
+    assert history['product_id'] == product_id
+    assert history['end'] - history['start'] == 365 * 24 * 3600
+    assert len(history['points']) == 1
+    assert history['points'][0]['min_cents'] == 120
+    assert history['points'][0]['max_cents'] == 150
+    assert history['points'][0]['samples'] == 2
+
+def test_get_product_prices_downsampled(test_product):
+    start = int(datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp())
+    db = TestingSessionLocal()
+    # un cambio prezzo al giorno per due anni
+    db.add_all([ProductPrice(product_id=test_product[0].id, recorded_at=start + day * 86400,
+                             original_cents=100 + day % 50) for day in range(730)])
+    db.commit()
+
+    response = client.get(f'/product/{test_product[0].id}/prices',
+                          params={'start': '2025-01-01T00:00:00Z', 'end': '2026-01-01T00:00:00Z', 'points': 12})
+    assert response.status_code == status.HTTP_200_OK
+    points = response.json()['points']
+    assert len(points) == 12
+    assert sum(point['samples'] for point in points) == 730 - 366
+    assert all(point['min_cents'] <= point['avg_cents'] <= point['max_cents'] for point in points)
+
+    # l'intervallo senza variazioni riporta il prezzo in vigore all'inizio
+    response = client.get(f'/product/{test_product[0].id}/prices',
+                          params={'start': '2026-06-01T00:00:00Z', 'end': '2026-07-01T00:00:00Z'})
+    assert response.json()['points'] == [{'t': response.json()['start'], 'min_cents': 100 + 729 % 50,
+                                          'max_cents': 100 + 729 % 50, 'avg_cents': 100 + 729 % 50,
+                                          'samples': 1}]
+
+def test_get_product_prices_invalid_range(test_product):
+    response = client.get(f'/product/{test_product[0].id}/prices',
+                          params={'start': '2026-01-01T00:00:00Z', 'end': '2025-01-01T00:00:00Z'})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+def test_get_product_prices_not_found(test_product):
+    response = client.get('/product/9999/prices')
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+def test_import_products_csv(test_product):
+    csv_file = ("name,category,original_price,discounted_price,unit,supermarket_id,aisle_order,location\n"
+                "Pasta,Pasta,1.50,,pz,1,4,\n"
+                "Riso,Pasta,2.10,1.80,kg,2,5,Corridoio 2\n"
+                "Latte,Latticini,abc,,l,1,6,\n"
+                "Pane,Forno,1.00,,pz,9999,1,\n")
+    with assert_max_queries(8):
+        response = client.post('/product/import', files={'file': ('catalog.csv', csv_file, 'text/csv')})
+    assert response.status_code == status.HTTP_200_OK
+    report = response.json()
+    assert (report['inserted'], report['updated'], report['failed']) == (2, 0, 2)
+    assert [error['row'] for error in report['errors']] == [4, 5]
+    assert report['errors'][0]['errors'][0].startswith('original_price:')
+    assert report['errors'][1]['errors'] == ['Supermarket id not found']
+
+    db = TestingSessionLocal()
+    riso = db.query(Products).filter(Products.name == 'Riso').first()
+    assert (riso.discounted_price, riso.supermarket_id, riso.location) == (1.8, 2, 'Corridoio 2')
+    pasta = db.query(Products).filter(Products.name == 'Pasta').first()
+    assert pasta.discounted_price is None and pasta.location is None
+    prices = db.query(ProductPrice).filter(ProductPrice.product_id == riso.id).all()
+    assert [(price.original_cents, price.discounted_cents) for price in prices] == [(210, 180)]
+
+def test_import_products_ndjson_updates(test_product):
+    onion = {'id': test_product[0].id, 'name': 'Onion', 'category': 'Frutta', 'original_price': 0.62,
+             'unit': 'pz', 'supermarket_id': 1, 'aisle_order': 3.2}
+    lines = [json.dumps({**onion, 'name': 'Red onion'}),
+             json.dumps({**onion, 'id': test_product[1].id, 'name': 'Garlic', 'original_price': 0.99}),
+             '{not json',
+             json.dumps({**onion, 'id': 9999}),
+             json.dumps([1, 2]),
+             '']
+    version = client.get('/product/changes').json()['token']
+    response = client.post('/product/import', files={'file': ('catalog.ndjson', '\n'.join(lines))})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {'inserted': 0, 'updated': 2, 'failed': 3, 'errors': [
+        {'row': 3, 'errors': ['Invalid JSON']},
+        {'row': 4, 'errors': ['Product not found']},
+        {'row': 5, 'errors': ['Row must be a JSON object']}]}
+
+    changes = client.get(f'/product/changes?since={version}').json()
+    assert changes['token'] == version + 1
+    assert {product['name'] for product in changes['products']} == {'Red onion', 'Garlic'}
+    # solo il prezzo modificato entra nello storico
+    db = TestingSessionLocal()
+    prices = db.query(ProductPrice).filter(ProductPrice.product_id.in_([test_product[0].id, test_product[1].id])).all()
+    assert [(price.product_id, price.original_cents) for price in prices] == [(test_product[1].id, 99)]
+
+def test_import_products_batches(test_product):
+    header = "name,category,original_price,unit,supermarket_id,aisle_order\n"
+    csv_file = header + "".join(f"Prodotto {i},Casa,{1 + i % 7}.5,pz,{1 + i % 2},{i % 30}\n" for i in range(2500))
+    # tre blocchi di import e tre gruppi di id per l'indice di equivalenza: le istruzioni crescono per blocco, non per riga
+    with assert_max_queries(19):
+        response = client.post('/product/import', files={'file': ('catalog.csv', csv_file, 'text/csv')})
+    assert response.json() == {'inserted': 2500, 'updated': 0, 'failed': 0, 'errors': []}
+    db = TestingSessionLocal()
+    assert db.query(Products).count() == 2503
+    assert db.query(ProductPrice).count() == 2500
+
+def test_import_products_unsupported_format(test_product):
+    response = client.post('/product/import', files={'file': ('catalog.xlsx', b'data')})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json() == {'detail': 'Unsupported file format'}
+
+def test_export_products_csv(test_product):
+    client.delete(f'/product/{test_product[1].id}')
+    with assert_max_queries(1):
+        response = client.get('/product/export')
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['content-disposition'] == 'attachment; filename="products.csv"'
+    lines = response.text.splitlines()
+    assert lines[0] == 'id,name,category,original_price,discounted_price,unit,supermarket_id,aisle_order,' \
+                       'image,calories,fat,carbs,protein,location'
+    assert lines[1:] == ['1,Onion,Frutta,0.62,,pz,1,3.2,,,,,,', '3,Swile,Verdura,1.24,1.1,pz,1,3.0,,,,,,']
+
+def test_export_products_ndjson_gzip(test_product):
+    response = client.get('/product/export', params={'format': 'ndjson', 'gzip': True, 'supermarket_id': 1})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['content-type'] == 'application/gzip'
+    products = [json.loads(line) for line in gzip.decompress(response.content).splitlines()]
+    assert [product['name'] for product in products] == ['Onion', 'Swile']
+    assert products[1]['discounted_price'] == 1.1
+
+def test_export_products_matches_import(test_product):
+    # l'export CSV si puo' reimportare cosi' com'e': ogni riga aggiorna il prodotto con lo stesso id
+    exported = client.get('/product/export').text
+    response = client.post('/product/import', files={'file': ('products.csv', exported, 'text/csv')})
+    assert response.json() == {'inserted': 0, 'updated': 3, 'failed': 0, 'errors': []}
+
+def _create_products(*products):
+    ids = []
+    for name, supermarket_id in products:
+        response = client.post('/product', json={'name': name, 'category': 'Latticini', 'original_price': 1.2,
+                                                 'unit': 'l', 'supermarket_id': supermarket_id, 'aisle_order': 1})
+        ids.append(response.json()['id'])
+    return ids
+
+def test_get_product_equivalents(test_product):
+    whole, other_store, skimmed, same_store = _create_products(
+        ('Latte Intero 1 L', 1), ('latte intero 1l', 2), ('Latte scremato 1 L', 2), ('Latte Intero 1 L', 1))
+    with assert_max_queries(2):
+        response = client.get(f'/product/{whole}/equivalents')
+    assert response.status_code == status.HTTP_200_OK
+    assert [(match['product']['id'], match['score']) for match in response.json()] == [(other_store, 1.0)]
+    assert [match['product']['id'] for match in client.get(f'/product/{other_store}/equivalents').json()] == [
+        whole, same_store]
+
+    # l'indice segue modifiche ed eliminazioni
+    client.put(f'/product/{other_store}', json={'name': 'Latte scremato 1L'})
+    assert client.get(f'/product/{whole}/equivalents').json() == []
+    assert [match['product']['id'] for match in client.get(f'/product/{skimmed}/equivalents').json()] == []
+    client.put(f'/product/{skimmed}', json={'supermarket_id': 1})
+    assert [match['product']['id'] for match in client.get(f'/product/{skimmed}/equivalents').json()] == [other_store]
+    client.delete(f'/product/{other_store}')
+    assert client.get(f'/product/{skimmed}/equivalents').json() == []
+
+def test_delete_supermarket_removes_product_matches(test_product):
+    kept, other_store, deleted = _create_products(('Latte Intero 1 L', 1), ('latte intero 1l', 2), ('Latte Intero 1L', 2))
+    assert [match['product']['id'] for match in client.get(f'/product/{kept}/equivalents').json()] == [
+        other_store, deleted]
+    response = client.delete('/supermarket/2')
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    assert client.get(f'/product/{kept}/equivalents').json() == []
+    db = TestingSessionLocal()
+    assert db.query(ProductMatch).filter(ProductMatch.match_id.in_([other_store, deleted])).count() == 0
+
+def test_get_product_equivalents_not_found(test_product):
+    response = client.get('/product/9999/equivalents')
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+@pytest.mark.asyncio
+async def test_rebuild_product_matches(test_product, monkeypatch):
+    # aggiornamento incrementale a gruppi di due id: stesso risultato della ricostruzione completa
+    monkeypatch.setattr(product_matching, 'MATCH_CHUNK_SIZE', 2)
+    _create_products(('Latte Intero 1 L', 1))
+    client.post('/product/import', files={'file': ('catalog.ndjson', "\n".join(json.dumps(
+        {'name': name, 'category': 'Latticini', 'original_price': 1.3, 'unit': 'l', 'supermarket_id': supermarket_id,
+         'aisle_order': 1}) for name, supermarket_id in [('latte intero 1l', 2), ('Latte intero 1 L', 2), ('Panna', 1),
+                                                         ('Latte intero 1 litro', 1)]))})
+    db = TestingSessionLocal()
+    incremental = sorted((m.product_id, m.match_id, m.score) for m in db.query(ProductMatch).all())
+    assert len(incremental) == 8
+    async with TestingAsyncSessionLocal() as async_db:
+        assert await rebuild_product_matches(async_db) == 4
+    db.expire_all()
+    assert sorted((m.product_id, m.match_id, m.score) for m in db.query(ProductMatch).all()) == incremental
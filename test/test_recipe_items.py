@@ -9,7 +9,8 @@ app.dependency_overrides[get_current_user] = override_get_current_user
 
 
 def test_get_recipe_item(test_recipe_item):
-    response = client.get("/recipe-item")
+    with assert_max_queries(1):
+        response = client.get("/recipe-item")
     assert response.status_code == status.HTTP_200_OK
     assert response.json() == [{'recipe_id': 1, 'product_id': 1, 'quantity': 10, 'id': 1},
                                {'recipe_id': 1, 'product_id': 2, 'quantity': 5, 'id': 2},
@@ -49,7 +50,8 @@ def test_get_recipe_item_by_query_recipe_and_product_not_found(test_recipe_item)
     assert response.json() == {'detail': 'Recipe item not found'}
 
 def test_get_recipe_item_by_id(test_recipe_item):
-    response = client.get(f"/recipe-item/{test_recipe_item[0].id}")
+    with assert_max_queries(1):
+        response = client.get(f"/recipe-item/{test_recipe_item[0].id}")
     assert response.status_code == status.HTTP_200_OK
     assert response.json() == {'recipe_id': 1, 'product_id': 1, 'quantity': 10, 'id': 1}
 
@@ -60,7 +62,8 @@ def test_get_recipe_item_by_id_not_found(test_recipe_item):
 
 def test_create_recipe_item(test_recipe_item):
     request_data = {'recipe_id': 1, 'product_id': 1, 'quantity': 50}
-    response = client.post("/recipe-item", json=request_data)
+    with assert_max_queries(4):
+        response = client.post("/recipe-item", json=request_data)
     assert response.status_code == status.HTTP_201_CREATED
 
     new_recipe_item = response.json()
@@ -101,7 +104,8 @@ def test_create_recipe_item_recipe_id_and_product_id_not_found(test_recipe_item)
 
 def test_update_recipe_item(test_recipe_item):
     request_data = {'recipe_id': 1, 'product_id': 1, 'quantity': 50}
-    response = client.put(f"/recipe-item/{test_recipe_item[0].id}", json=request_data)
+    with assert_max_queries(4):
+        response = client.put(f"/recipe-item/{test_recipe_item[0].id}", json=request_data)
     assert response.status_code == status.HTTP_204_NO_CONTENT
 
     db = TestingSessionLocal()
@@ -151,7 +155,8 @@ def test_update_recipe_item_recipe_id_and_product_id_not_found(test_recipe_item)
     assert recipe_item_model.recipe_id != request_data['recipe_id']
 
 def test_delete_recipe_item(test_recipe_item):
-    response = client.delete(f"/recipe-item/{test_recipe_item[0].id}")
+    with assert_max_queries(2):
+        response = client.delete(f"/recipe-item/{test_recipe_item[0].id}")
     assert response.status_code == status.HTTP_204_NO_CONTENT
 
     db = TestingSessionLocal()
@@ -1,20 +1,28 @@
+from datetime import datetime
+
 from starlette import status
 
 from test.utils import *
 from app.routers.recipes import get_db, get_current_user
 from app.main import app
+from app.recipe_summary import recipe_summary_cache
+from app.routers import products, recipe_items
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[products.get_db] = override_get_db
+app.dependency_overrides[recipe_items.get_db] = override_get_db
 app.dependency_overrides[get_current_user] = override_get_current_user
 
 def test_get_recipe(test_recipe):
-    response = client.get(f"/recipe")
+    with assert_max_queries(1):
+        response = client.get(f"/recipe")
     assert response.status_code == status.HTTP_200_OK
     assert response.json() == [{'name': 'Carbonara', 'id': 1, 'owner_id': 1, 'image': None},
                                {'name': 'Risotto ai Funghi', 'id': 2, 'owner_id': 2, 'image': None}]
 
 def test_get_recipe_by_owner_id(test_recipe):
-    response = client.get(f"/recipe?owner_id={test_recipe[0].id}")
+    with assert_max_queries(2):
+        response = client.get(f"/recipe?owner_id={test_recipe[0].id}")
     assert response.status_code == status.HTTP_200_OK
     assert response.json() == [{'name': 'Carbonara', 'id': 1, 'owner_id': 1, 'image': None}]
 
@@ -24,7 +32,8 @@ def test_get_recipe_by_owner_id_not_found(test_recipe):
     assert response.json() == {'detail': 'User not found'}
 
 def test_get_recipe_by_id(test_recipe):
-    response = client.get(f"/recipe/{test_recipe[0].id}")
+    with assert_max_queries(1):
+        response = client.get(f"/recipe/{test_recipe[0].id}")
     assert response.status_code == status.HTTP_200_OK
     assert response.json() == {'name': 'Carbonara', 'id': test_recipe[0].id, 'owner_id': 1, 'image': None}
 
@@ -35,7 +44,8 @@ def test_get_recipe_by_id_not_found(test_recipe):
 
 def test_create_recipe(test_recipe):
     request_data = {'name': 'New Recipe', 'owner_id': 1}
-    response = client.post("/recipe", json=request_data)
+    with assert_max_queries(3):
+        response = client.post("/recipe", json=request_data)
     assert response.status_code == status.HTTP_201_CREATED
 
     new_recipe = response.json()
@@ -54,7 +64,8 @@ def test_create_recipe_wrong_owner_id(test_recipe):
 
 def test_update_recipe(test_recipe):
     request_data = {'name': 'New Recipe', 'owner_id': 2}
-    response = client.put(f"/recipe/{test_recipe[0].id}", json=request_data)
+    with assert_max_queries(3):
+        response = client.put(f"/recipe/{test_recipe[0].id}", json=request_data)
     assert response.status_code == status.HTTP_204_NO_CONTENT
 
     db = TestingSessionLocal()
@@ -82,7 +93,8 @@ def test_update_recipe_not_found(test_recipe):
     assert response.json() == {'detail': 'Recipe not found'}
 
 def test_delete_recipe(test_recipe):
-    response = client.delete(f"/recipe/{test_recipe[0].id}")
+    with assert_max_queries(2):
+        response = client.delete(f"/recipe/{test_recipe[0].id}")
     assert response.status_code == status.HTTP_204_NO_CONTENT
 
     db = TestingSessionLocal()
@@ -92,4 +104,91 @@ def test_delete_recipe(test_recipe):
 def test_delete_recipe_not_found(test_recipe):
     response = client.delete("/recipe/9999")
     assert response.status_code == status.HTTP_404_NOT_FOUND
-    assert response.json() == {'detail': 'Recipe not found'}
\ No newline at end of file
+    assert response.json() == {'detail': 'Recipe not found'}
+def test_add_recipe_to_cart(test_recipe_item, test_cart):
+    with assert_max_queries(3):
+        response = client.post(f"/recipe/{test_recipe_item[0].recipe_id}/add-to-cart?quantity=2")
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json() == {'cart': [{'id': test_cart[0].id, 'product_id': 1, 'quantity': 22, 'owner_id': 1,
+                                         'checked': False},
+                                        {'id': response.json()['cart'][1]['id'], 'product_id': 2, 'quantity': 10,
+                                         'owner_id': 1, 'checked': False}],
+                               'missing': []}
+    db = TestingSessionLocal()
+    cart_model = db.query(Cart).filter(Cart.owner_id == 1).order_by(Cart.product_id).all()
+    assert [(c.product_id, c.quantity) for c in cart_model] == [(1, 22), (2, 10)]
+    # il carrello degli altri utenti non cambia
+    assert db.query(Cart).filter(Cart.owner_id == 2).one().quantity == 10
+
+def test_add_meal_plan_to_cart(test_recipe_item, clean_cart):
+    with assert_max_queries(3):
+        response = client.post("/recipe/add-to-cart", json=[{'recipe_id': 1}, {'recipe_id': 2, 'quantity': 3},
+                                                            {'recipe_id': 1}])
+    assert response.status_code == status.HTTP_201_CREATED
+    assert [(c['product_id'], c['quantity']) for c in response.json()['cart']] == [(1, 23), (2, 10)]
+
+def test_add_recipe_to_cart_missing_product(test_recipe_item, clean_cart):
+    db = TestingSessionLocal()
+    db.query(Products).filter(Products.id == 2).update({'deleted_at': datetime.now()})
+    db.commit()
+    response = client.post("/recipe/1/add-to-cart")
+    assert response.status_code == status.HTTP_201_CREATED
+    assert [(c['product_id'], c['quantity']) for c in response.json()['cart']] == [(1, 10)]
+    assert response.json()['missing'] == [2]
+
+def test_add_recipe_to_cart_not_found(test_recipe_item, clean_cart):
+    response = client.post("/recipe/add-to-cart", json=[{'recipe_id': 1}, {'recipe_id': 9999}])
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert response.json() == {'detail': 'Recipe not found'}
+    db = TestingSessionLocal()
+    assert db.query(Cart).count() == 0
+
+def test_get_recipe_summary(test_recipe_item):
+    recipe_summary_cache.clear()
+    with assert_max_queries(3):
+        response = client.get("/recipe/1/summary")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {'recipe_id': 1, 'items': 2, 'unavailable': 0, 'total_cost': 10.6,
+                               'calories': 0.0, 'fat': 0.0, 'carbs': 0.0, 'protein': 0.0,
+                               'supermarkets': [{'supermarket_id': 1, 'items': 1, 'cost': 6.2},
+                                                {'supermarket_id': 2, 'items': 1, 'cost': 4.4}]}
+    # dalla cache: restano la verifica della ricetta e la versione del catalogo
+    with assert_max_queries(2):
+        assert client.get("/recipe/1/summary").json() == response.json()
+    assert recipe_summary_cache.stats()['hits'] == 1
+
+def test_get_recipe_summary_invalidation(test_recipe_item):
+    recipe_summary_cache.clear()
+    client.get("/recipe/1/summary")
+    # un prodotto modificato cambia la versione del catalogo
+    client.put("/product/1", json={'discounted_price': 0.5, 'calories': 40})
+    summary = client.get("/recipe/1/summary").json()
+    assert (summary['total_cost'], summary['calories']) == (9.4, 400.0)
+    # un ingrediente modificato invalida la ricetta
+    client.put(f"/recipe-item/{test_recipe_item[1].id}", json={'recipe_id': 1, 'product_id': 2, 'quantity': 1})
+    assert client.get("/recipe/1/summary").json()['total_cost'] == 5.88
+    client.delete(f"/recipe-item/{test_recipe_item[1].id}")
+    summary = client.get("/recipe/1/summary").json()
+    assert (summary['items'], summary['total_cost']) == (1, 5.0)
+    assert recipe_summary_cache.stats()['hits'] == 0
+
+def test_get_recipe_summary_unavailable_product(test_recipe_item):
+    recipe_summary_cache.clear()
+    client.delete("/product/2")
+    summary = client.get("/recipe/1/summary").json()
+    assert (summary['items'], summary['unavailable'], summary['total_cost']) == (2, 1, 6.2)
+    assert summary['supermarkets'] == [{'supermarket_id': 1, 'items': 1, 'cost': 6.2}]
+
+def test_get_recipe_summary_not_found(test_recipe_item):
+    response = client.get("/recipe/9999/summary")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert response.json() == {'detail': 'Recipe not found'}
+
+def test_get_recipes_summary(test_recipe_item):
+    recipe_summary_cache.clear()
+    with assert_max_queries(3):
+        response = client.get("/recipe/summary?owner_id=2")
+    assert response.status_code == status.HTTP_200_OK
+    assert [(s['recipe_id'], s['total_cost']) for s in response.json()] == [(2, 0.62)]
+    # senza owner_id: le ricette dell'utente autenticato
+    assert [(s['recipe_id'], s['total_cost']) for s in client.get("/recipe/summary").json()] == [(1, 10.6)]
@@ -1,14 +1,24 @@
+import csv
+import gzip
+import io
+import json
+
 from starlette import status
 
 from test.utils import *
 from app.routers.shopping_history import get_db, get_current_user
 from app.main import app
+from app.routers import cart
+from app.models import ShoppingStats
+from app.shopping_stats import rebuild_shopping_stats_statements
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[cart.get_db] = override_get_db
 app.dependency_overrides[get_current_user] = override_get_current_user
 
 def test_get_shopping_history(test_shopping_history_item):
-    response = client.get('/shopping-history')
+    with assert_max_queries(2):
+        response = client.get('/shopping-history')
     assert response.status_code == status.HTTP_200_OK
     assert response.json() == [{'id': 1, 'user_id': 1, 'total_items': 3, 'total_price': 5.50,
                                 'created_at': "2024-01-01T10:00:00"},
@@ -16,7 +26,8 @@ def test_get_shopping_history(test_shopping_history_item):
                                 'created_at': "2024-01-02T10:00:00"}]
 
 def test_get_shopping_history_by_id(test_shopping_history_item):
-    response = client.get('/shopping-history/1')
+    with assert_max_queries(1):
+        response = client.get('/shopping-history/1')
     assert response.status_code == status.HTTP_200_OK
     assert response.json() == {'id': 1, 'user_id': 1, 'total_items': 3,
                                'total_price': 5.50, 'created_at': "2024-01-01T10:00:00"}
@@ -27,7 +38,8 @@ def test_get_shopping_history_by_id_not_found(test_shopping_history_item):
     assert response.json() == {'detail': 'Shopping History not found'}
 
 def test_get_shopping_history_items(test_shopping_history_item):
-    response = client.get('/shopping-history/1/items')
+    with assert_max_queries(2):
+        response = client.get('/shopping-history/1/items')
     assert response.status_code == status.HTTP_200_OK
     assert response.json() == [{'id': 1, 'history_id': 1, 'product_id': 1, 'name': 'Onion', 'price_paid': 0.62,
                                 'was_discounted': False, 'supermarket_id': 1, 'supermarket_name': 'Conad',
@@ -45,8 +57,28 @@ def test_get_shopping_history_items_not_found(test_shopping_history_item):
     assert response.status_code == status.HTTP_404_NOT_FOUND
     assert response.json() == {'detail': 'Shopping History not found'}
 
-def test_shopping_history_restore_cart(test_shopping_history_item):
-    response = client.post("/shopping-history/1/restore-cart")
+def test_export_shopping_history_csv(test_shopping_history_item):
+    with assert_max_queries(1):
+        response = client.get('/shopping-history/export')
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['content-type'] == 'text/csv; charset=utf-8'
+    assert response.headers['content-disposition'] == 'attachment; filename="shopping-history.csv"'
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [(row['history_id'], row['created_at'], row['name'], row['quantity']) for row in rows] == [
+        ('1', '2024-01-01T10:00:00', 'Onion', '3'), ('1', '2024-01-01T10:00:00', 'Garlic', '5')]
+    assert rows[0]['original_price'] == ''
+
+def test_export_shopping_history_ndjson_gzip(test_shopping_history_item):
+    response = client.get('/shopping-history/export?format=ndjson&gzip=true')
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['content-type'] == 'application/gzip'
+    assert response.headers['content-disposition'] == 'attachment; filename="shopping-history.ndjson.gz"'
+    rows = [json.loads(line) for line in gzip.decompress(response.content).splitlines()]
+    assert [(row['history_id'], row['product_id'], row['price_paid']) for row in rows] == [(1, 1, 0.62), (1, 2, 0.88)]
+
+def test_shopping_history_restore_cart(test_shopping_history_item, clean_cart):
+    with assert_max_queries(4):
+        response = client.post("/shopping-history/1/restore-cart")
     assert response.status_code == status.HTTP_201_CREATED
     db = TestingSessionLocal()
     cart_model = db.query(Cart).all()
@@ -56,8 +88,30 @@ def test_shopping_history_restore_cart(test_shopping_history_item):
     assert cart_model[0].owner_id == 1
     assert cart_model[0].checked == False
 
+def test_shopping_history_restore_cart_existing_items(test_shopping_history_item, test_cart):
+    with assert_max_queries(4):
+        response = client.post("/shopping-history/1/restore-cart")
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()['restored'] == [1, 2]
+    db = TestingSessionLocal()
+    cart_model = db.query(Cart).filter(Cart.owner_id == 1).order_by(Cart.product_id).all()
+    assert [(c.product_id, c.quantity, c.checked) for c in cart_model] == [(1, 3, False), (2, 5, False)]
+    assert cart_model[0].id == test_cart[0].id
+
+def test_shopping_history_restore_cart_missing_product(test_shopping_history_item, clean_cart):
+    db = TestingSessionLocal()
+    db.query(Products).filter(Products.id == 2).delete()
+    db.commit()
+    response = client.post("/shopping-history/1/restore-cart")
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()['restored'] == [1]
+    assert [p['id'] for p in response.json()['missing']] == [2]
+    cart_model = db.query(Cart).all()
+    assert [c.product_id for c in cart_model] == [1]
+
 def test_delete_shopping_history(test_shopping_history_item):
-    response = client.delete('/shopping-history/1')
+    with assert_max_queries(7):
+        response = client.delete('/shopping-history/1')
     assert response.status_code == status.HTTP_204_NO_CONTENT
     db = TestingSessionLocal()
     shopping_history_model = db.query(ShoppingHistory).filter(ShoppingHistory.id == 1).first()
@@ -66,4 +120,65 @@ def test_delete_shopping_history(test_shopping_history_item):
 def test_delete_shopping_history_not_found(test_shopping_history_item):
     response = client.delete('/shopping-history/9999')
     assert response.status_code == status.HTTP_404_NOT_FOUND
-    assert response.json() == {"detail": "Shopping History not found"}
\ No newline at end of file
+    assert response.json() == {"detail": "Shopping History not found"}
+
+def test_get_shopping_stats(test_product, clean_cart, clean_shopping_history):
+    db = TestingSessionLocal()
+    db.add(Cart(product_id=test_product[0].id, owner_id=1, quantity=2, checked=True))
+    db.add(Cart(product_id=test_product[2].id, owner_id=1, quantity=3, checked=True))
+    db.commit()
+    assert client.post('/cart/finalize').status_code == status.HTTP_201_CREATED
+    db.add(Cart(product_id=test_product[1].id, owner_id=1, quantity=1, checked=True))
+    db.commit()
+    second_history_id = client.post('/cart/finalize').json()['history_id']
+
+    response = client.get('/shopping-history/stats')
+    assert response.status_code == status.HTTP_200_OK
+    stats = response.json()
+    assert stats['total_spent'] == 5.42
+    assert stats['total_items'] == 6
+    assert stats['savings'] == 0.42
+    assert stats['trips'] == 2
+    assert [(month['total_spent'], month['trips']) for month in stats['by_month']] == [(5.42, 2)]
+    assert stats['by_category'] == [
+        {'key': 'Frutta', 'label': None, 'total_spent': 1.24, 'total_items': 2, 'savings': 0.0, 'trips': 1},
+        {'key': 'Verdura', 'label': None, 'total_spent': 4.18, 'total_items': 4, 'savings': 0.42, 'trips': 2},
+    ]
+    assert stats['by_supermarket'] == [
+        {'key': '1', 'label': 'Conad', 'total_spent': 4.54, 'total_items': 5, 'savings': 0.42, 'trips': 1},
+        {'key': '2', 'label': 'Lidl', 'total_spent': 0.88, 'total_items': 1, 'savings': 0.0, 'trips': 1},
+    ]
+
+    assert client.delete(f'/shopping-history/{second_history_id}').status_code == status.HTTP_204_NO_CONTENT
+    stats = client.get('/shopping-history/stats').json()
+    assert stats['total_spent'] == 4.54
+    assert stats['trips'] == 1
+    assert [supermarket['label'] for supermarket in stats['by_supermarket']] == ['Conad']
+    assert stats['by_category'][1] == {'key': 'Verdura', 'label': None, 'total_spent': 3.3, 'total_items': 3,
+                                       'savings': 0.42, 'trips': 1}
+
+def test_shopping_stats_match_rebuild(test_product, clean_cart, clean_shopping_history):
+    db = TestingSessionLocal()
+    db.add_all([Cart(product_id=test_product[0].id, owner_id=1, quantity=2, checked=True),
+                Cart(product_id=test_product[2].id, owner_id=1, quantity=3, checked=True)])
+    db.commit()
+    client.post('/cart/finalize')
+    db.add(Cart(product_id=test_product[1].id, owner_id=1, quantity=1, checked=True))
+    db.commit()
+    client.delete(f"/shopping-history/{client.post('/cart/finalize').json()['history_id']}")
+
+    def stats_rows():
+        return sorted((row.user_id, row.dimension, row.key, row.label, round(row.total_spent, 6), row.total_items,
+                       round(row.savings, 6), row.trips) for row in db.query(ShoppingStats).all())
+    live = stats_rows()
+    with engine.begin() as connection:
+        for statement in rebuild_shopping_stats_statements('sqlite'):
+            connection.execute(statement)
+    db.expire_all()
+    assert stats_rows() == live
+
+def test_get_shopping_stats_empty(test_user):
+    response = client.get('/shopping-history/stats')
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {'total_spent': 0, 'total_items': 0, 'savings': 0, 'trips': 0,
+                               'by_month': [], 'by_category': [], 'by_supermarket': []}
@@ -8,13 +8,26 @@ app.dependency_overrides[get_db] = override_get_db
 app.dependency_overrides[get_current_user] = override_get_current_user
 
 def test_get_supermarket(test_supermarket):
-    response = client.get(f"/supermarket")
+    with assert_max_queries(2):
+        response = client.get(f"/supermarket")
     assert response.status_code == status.HTTP_200_OK
     assert response.json() == [{'name': 'Conad', 'id': 1, 'image': None, 'location': 'Via delle Arti 22, Matera'},
                                {'name': 'Lidl', 'id': 2, 'image': None, 'location': 'Via delle Arti 1, Matera'}]
 
+def test_get_supermarket_etag(test_supermarket):
+    etag = client.get("/supermarket").headers['etag']
+    response = client.get("/supermarket", headers={'If-None-Match': etag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    response = client.post("/supermarket", json={'name': 'Esselunga'})
+    assert response.status_code == status.HTTP_201_CREATED
+    response = client.get("/supermarket", headers={'If-None-Match': etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.json()) == 3
+
 def test_get_supermarket_by_id(test_supermarket):
-    response = client.get(f"/supermarket/{test_supermarket[0].id}")
+    with assert_max_queries(1):
+        response = client.get(f"/supermarket/{test_supermarket[0].id}")
     assert response.status_code == status.HTTP_200_OK
     assert response.json() == {'name': 'Conad', 'id': test_supermarket[0].id,
                                'image': None, 'location': 'Via delle Arti 22, Matera'}
@@ -25,7 +38,8 @@ def test_get_supermarket_by_id_not_found(test_supermarket):
     assert response.json() == {'detail': 'Supermarket not found'}
 
 def test_get_supermarket_products(test_product):
-    response = client.get(f"/supermarket/{test_product[0].supermarket_id}/products")
+    with assert_max_queries(3):
+        response = client.get(f"/supermarket/{test_product[0].supermarket_id}/products")
     assert response.status_code == status.HTTP_200_OK
     assert response.json() == [{'aisle_order': 3, 'name': 'Swile',
                                 'supermarket_id': 1, 'original_price': 1.24, 'id': 3, 'image': None,
@@ -43,7 +57,8 @@ def test_get_supermarket_products_not_found(test_supermarket):
 
 def test_create_supermarket(test_supermarket):
     request_data = {'name': 'New Supermarket', 'location': 'Via delle Arti 12, Matera'}
-    response = client.post("/supermarket", json=request_data)
+    with assert_max_queries(4):
+        response = client.post("/supermarket", json=request_data)
     assert response.status_code == status.HTTP_201_CREATED
 
     new_supermarket = response.json()
@@ -62,7 +77,8 @@ def test_create_duplicate_supermarket(test_supermarket):
 
 def test_update_supermarket(test_supermarket):
     request_data = {'name': 'New Supermarket'}
-    response = client.put(f"/supermarket/{test_supermarket[0].id}", json=request_data)
+    with assert_max_queries(3):
+        response = client.put(f"/supermarket/{test_supermarket[0].id}", json=request_data)
     assert response.status_code == status.HTTP_204_NO_CONTENT
 
     db = TestingSessionLocal()
@@ -77,7 +93,8 @@ def test_update_supermarket_not_found(test_supermarket):
     assert response.json() == {'detail': 'Supermarket not found'}
 
 def test_delete_supermarket(test_supermarket):
-    response = client.delete(f"/supermarket/{test_supermarket[0].id}")
+    with assert_max_queries(7):
+        response = client.delete(f"/supermarket/{test_supermarket[0].id}")
     assert response.status_code == status.HTTP_204_NO_CONTENT
 
     db = TestingSessionLocal()
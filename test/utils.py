@@ -1,31 +1,55 @@
+from contextlib import contextmanager
+
 import pytest
-from sqlalchemy import create_engine, StaticPool, text
+from sqlalchemy import create_engine, event, StaticPool, NullPool, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 from starlette.testclient import TestClient
 from passlib.context import CryptContext
 
-from app.database import Base
+from app.database import Base, get_async_url
 from app.main import app
 from app.models import (Products, Supermarkets, Recipes, RecipeItems, Cart,
-                        Users, ShoppingHistory, ShoppingHistoryItem, Favorites)
+                        Users, ShoppingHistory, ShoppingHistoryItem, Favorites, ProductMatch, ProductPrice)
 
-SQLALCHEMY_DATABASE_URL = "sqlite://"
+# database in memoria condiviso tra la connessione sincrona delle fixture e quelle async dei router
+SQLALCHEMY_DATABASE_URL = "sqlite:///file:testdb?mode=memory&cache=shared&uri=true"
 
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={'check_same_thread': False}, poolclass=StaticPool)
 
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(get_async_url(SQLALCHEMY_DATABASE_URL), poolclass=NullPool)
+
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+# istruzioni SQL eseguite dai router (engine async): le fixture usano l'engine sincrono e non contano
+_query_logs = []
+
+@event.listens_for(async_engine.sync_engine, "after_cursor_execute")
+def _log_query(conn, cursor, statement, parameters, context, executemany):
+    for query_log in _query_logs:
+        query_log.append(statement)
+
+@contextmanager
+def assert_max_queries(limit):
+    query_log = []
+    _query_logs.append(query_log)
+    try:
+        yield query_log
+    finally:
+        _query_logs.remove(query_log)
+    assert len(query_log) <= limit, (f"{len(query_log)} queries, expected at most {limit}:\n"
+                                     + "\n".join(query_log))
+
 Base.metadata.create_all(engine)
 
 test_bcrypt = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
-def override_get_db():
-    db = TestingSessionLocal()
-    try:
+async def override_get_db():
+    async with TestingAsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 def override_get_current_user():
     return {'username': 'myusername', 'id': 1, 'user_role': 'admin'}
@@ -67,6 +91,8 @@ def test_product(test_supermarket):
     db.commit()
     yield [product1, product2, product3]
     with engine.connect() as connection:
+        connection.execute(text("DELETE FROM product_matches;"))
+        connection.execute(text("DELETE FROM product_prices;"))
         connection.execute(text("DELETE FROM products;"))
         connection.commit()
 
@@ -265,3 +291,19 @@ def test_shopping_history_item(test_shopping_history, test_product):
         connection.execute(text("DELETE FROM shopping_history_items;"))
         connection.commit()
 
+
+@pytest.fixture
+def clean_shopping_history():
+    yield
+    with engine.connect() as connection:
+        connection.execute(text("DELETE FROM shopping_history_items;"))
+        connection.execute(text("DELETE FROM shopping_history;"))
+        connection.execute(text("DELETE FROM shopping_stats;"))
+        connection.commit()
+
+@pytest.fixture
+def clean_cart():
+    yield
+    with engine.connect() as connection:
+        connection.execute(text("DELETE FROM cart;"))
+        connection.commit()